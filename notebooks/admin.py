@@ -2,7 +2,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
-from .models import Notebook, Entry
+from .models import Notebook, Entry, AnalysisJob, NotebookRiskFactor, SavedSearch
 import json
 
 
@@ -19,7 +19,8 @@ class NotebookAdmin(admin.ModelAdmin):
     search_fields = ['title', 'company_name', 'stock_code', 'user__username']
     readonly_fields = [
         'created_at', 'updated_at', 'entry_count', 'ai_analysis_cache_display',
-        'ai_analysis_score', 'ai_investment_strategy', 'ai_last_analyzed'
+        'ai_analysis_score', 'ai_investment_strategy', 'ai_last_analyzed',
+        'ai_analyzer_version'
     ]
     
     fieldsets = (
@@ -32,7 +33,7 @@ class NotebookAdmin(admin.ModelAdmin):
         ('AI分析結果', {
             'fields': (
                 'ai_analysis_score', 'ai_investment_strategy', 'ai_last_analyzed',
-                'ai_analysis_cache_display'
+                'ai_analyzer_version', 'ai_analysis_cache_display'
             ),
             'classes': ('collapse',)
         }),
@@ -107,7 +108,8 @@ class EntryAdmin(admin.ModelAdmin):
     search_fields = ['title', 'content', 'notebook__title']
     readonly_fields = [
         'created_at', 'updated_at', 'ai_analysis_cache_display',
-        'ai_content_type', 'ai_sentiment', 'ai_analysis_score'
+        'ai_content_type', 'ai_sentiment', 'ai_analysis_score', 'ai_last_analyzed',
+        'ai_analyzer_version'
     ]
     
     fieldsets = (
@@ -116,8 +118,8 @@ class EntryAdmin(admin.ModelAdmin):
         }),
         ('AI分析結果', {
             'fields': (
-                'ai_content_type', 'ai_sentiment', 'ai_analysis_score',
-                'ai_analysis_cache_display'
+                'ai_content_type', 'ai_sentiment', 'ai_analysis_score', 'ai_last_analyzed',
+                'ai_analyzer_version', 'ai_analysis_cache_display'
             ),
             'classes': ('collapse',)
         }),
@@ -192,6 +194,41 @@ class EntryAdmin(admin.ModelAdmin):
     ai_analysis_score.short_description = "AI分析スコア"
 
 
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = [
+        'target_type', 'object_id', 'status', 'attempts', 'max_attempts',
+        'run_after', 'locked_by', 'updated_at'
+    ]
+    list_filter = ['status', 'target_type']
+    search_fields = ['object_id', 'last_error']
+    readonly_fields = ['content_hash', 'locked_by', 'locked_at', 'created_at', 'updated_at']
+    actions = ['requeue_jobs']
+    
+    def requeue_jobs(self, request, queryset):
+        """失敗（dead）ジョブの再投入"""
+        from .jobs import requeue_dead_jobs
+        
+        count = requeue_dead_jobs(queryset)
+        self.message_user(request, f'{count}件のジョブを再投入しました。')
+    requeue_jobs.short_description = "失敗ジョブを再投入"
+
+
+@admin.register(NotebookRiskFactor)
+class NotebookRiskFactorAdmin(admin.ModelAdmin):
+    list_display = ['term', 'notebook', 'mentions']
+    list_filter = ['term']
+    search_fields = ['term', 'notebook__title', 'notebook__user__username']
+    readonly_fields = ['notebook', 'term', 'mentions']
+
+
+@admin.register(SavedSearch)
+class SavedSearchAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'user', 'query', 'created_at']
+    search_fields = ['name', 'query', 'user__username']
+    readonly_fields = ['clauses', 'created_at', 'updated_at']
+
+
 # 管理画面のカスタマイズ
 admin.site.site_header = "株式分析記録アプリ 管理画面"
 admin.site.site_title = "株式分析記録アプリ"
@@ -5,88 +5,239 @@ AI分析機能 - 簡易版（外部依存関係最小化）
 """
 import re
 import json
-from typing import Dict, List, Any
+import hashlib
+from typing import Dict, List, Any, Optional, Tuple
 from collections import Counter
 from decimal import Decimal
+from .keyword_automaton import KeywordAutomaton, register_keywords, iter_keyword_hits
+from .stock_master import get_stock_master
+from .profiling import profiled, stage
+
+
+# タグパターン
+TAG_PATTERNS = [
+    {'pattern': r'配当|利回り|dividend', 'tag': '高配当', 'weight': 0.8},
+    {'pattern': r'成長|グロース|growth', 'tag': '成長株', 'weight': 0.8},
+    {'pattern': r'ev|電気自動車|electric', 'tag': 'EV', 'weight': 0.9},
+    {'pattern': r'決算|業績|earnings', 'tag': '決算分析', 'weight': 0.8},
+    {'pattern': r'リスク|危険|risk', 'tag': 'リスク管理', 'weight': 0.7},
+    {'pattern': r'長期|ホールド|long.term', 'tag': '長期投資', 'weight': 0.7},
+    {'pattern': r'短期|デイトレ|short.term', 'tag': '短期取引', 'weight': 0.7},
+    {'pattern': r'テクニカル|チャート|technical', 'tag': 'テクニカル', 'weight': 0.8},
+    {'pattern': r'ファンダメンタル|fundamental', 'tag': 'ファンダメンタル', 'weight': 0.8},
+    {'pattern': r'reit|不動産', 'tag': 'REIT', 'weight': 0.9},
+    {'pattern': r'米国|アメリカ|us|usa', 'tag': '米国株', 'weight': 0.8},
+    {'pattern': r'競合|比較|competitor', 'tag': '競合分析', 'weight': 0.7},
+    {'pattern': r'バリュー|割安|value', 'tag': 'バリュー投資', 'weight': 0.8},
+    {'pattern': r'新規上場|ipo', 'tag': 'IPO', 'weight': 0.9},
+    {'pattern': r'優待|株主優待', 'tag': '株主優待', 'weight': 0.9},
+]
+
+# センチメント分析パターン
+POSITIVE_PATTERNS = r'良い|上昇|成長|利益|好調|期待|強い|優秀|安定|買い|ポジティブ|有望|改善|増加|拡大'
+NEGATIVE_PATTERNS = r'悪い|下落|減少|損失|不調|心配|弱い|危険|不安定|売り|ネガティブ|懸念|悪化|減退'
+
+# リスク指標パターン
+RISK_INDICATORS = r'リスク|危険|不安定|暴落|損失|破綻|倒産|規制|競合激化'
+
+# リスク要因の正規化辞書（見出し語: 表記ゆれ・関連語）
+RISK_FACTOR_TERMS = {
+    '為替': ['為替', '円高', '円安', 'ドル円', '通貨安'],
+    'EV移行': ['ev移行', 'ev化', 'ev シフト', 'evシフト', '電動化'],
+    '半導体不足': ['半導体不足', 'チップ不足', '半導体の供給', '半導体供給'],
+    '規制': ['規制', '法規制', '規制強化', '独禁法'],
+    '金利': ['金利', '利上げ', '利下げ', '金融引き締め'],
+    '競合激化': ['競合激化', '競争激化', '価格競争', '新規参入'],
+    '景気後退': ['景気後退', '景気減速', 'リセッション', '不況'],
+    '原材料高': ['原材料', '資源価格', '原油高', 'コスト高'],
+    '地政学': ['地政学', '米中対立', '紛争', '戦争'],
+    '災害': ['災害', '地震', 'パンデミック', '感染症'],
+    '不祥事': ['不祥事', '訴訟', 'リコール', '不正会計'],
+    '減配': ['減配', '無配', '配当カット'],
+}
+
+# 分析用語・比較表現パターン（分析スコア用）
+ANALYSIS_TERMS = r'per|pbr|roe|eps|売上|利益|配当|成長率'
+COMPARISON_TERMS = r'前年|同期|比較|対比|vs'
+
+# キーワード抽出で除外する一般的な単語
+COMMON_WORDS = {
+    'の', 'は', 'が', 'を', 'に', 'で', 'と', 'から', 'まで', 'より',
+    'について', 'として', 'という', 'する', 'した', 'している',
+    'です', 'である', 'だと', '思う', '考える', 'ある', 'いる',
+    'この', 'その', 'どの', 'これ', 'それ', 'あれ'
+}
+
+# 部分集計の項目（数値として加算する項目・キー別に加算する項目）
+PARTIAL_COUNT_FIELDS = (
+    'length', 'positive', 'negative', 'risk',
+    'numeric_data', 'analysis_terms', 'comparison_terms',
+)
+PARTIAL_DICT_FIELDS = ('stocks', 'tags', 'words')
+
+# 分析ロジックのバージョン（ルール以外の判定ロジックを変更したら上げる）
+RULESET_VERSION = 2
+
+# 正規表現のメタ文字（これを含む候補語はオートマトンに載せない）
+_REGEX_META = re.compile(r'[.^$*+?{}\[\]\\()]')
+
+
+class RuleMatcher:
+    """
+    複数ルールの一括マッチャー
+    
+    ルールごとに re.findall を繰り返す代わりに、リテラルの候補語をキーワード
+    オートマトンで1回だけ走査し、ルール別のヒット数を返す。
+    各ルールのカウントは re.findall(pattern, text, re.IGNORECASE) と一致する。
+    ルールは固定長の選択パターン（リテラルと「.」のみ）であることを前提とし、
+    「.」を含む候補語だけを先読みパターンで補完する。
+    namespace を指定すると共有オートマトン（keyword_automaton）に辞書を登録する。
+    """
+    
+    def __init__(self, rules: List[Tuple[Any, str]], namespace: Optional[str] = None):
+        self.keys = [key for key, _ in rules]
+        self.namespace = namespace
+        
+        literal_entries = []
+        self._pattern_terms = []
+        for key, pattern in rules:
+            for alt_index, term in enumerate(pattern.split('|')):
+                if _REGEX_META.search(term):
+                    self._pattern_terms.append((key, alt_index, re.compile(term, re.IGNORECASE)))
+                else:
+                    literal_entries.append((term, (key, alt_index, len(term))))
+        
+        if namespace:
+            register_keywords(namespace, literal_entries)
+            self._automaton = None
+        else:
+            self._automaton = KeywordAutomaton(literal_entries)
+        
+        self._pattern_scanner = None
+        if self._pattern_terms:
+            alternation = '|'.join(regex.pattern for _, _, regex in self._pattern_terms)
+            self._pattern_scanner = re.compile(f'(?=(?:{alternation}))', re.IGNORECASE)
+    
+    def count(self, text: str) -> Dict[Any, int]:
+        """ルール別ヒット数（重複なし・左優先）"""
+        # (開始位置, 選択肢番号, ルール, 一致長)
+        hits = [(start, alt_index, key, length)
+                for start, (key, alt_index, length) in self._iter_literal_hits(text)]
+        
+        if self._pattern_scanner is not None:
+            for match in self._pattern_scanner.finditer(text):
+                pos = match.start()
+                for key, alt_index, regex in self._pattern_terms:
+                    term_match = regex.match(text, pos)
+                    if term_match:
+                        hits.append((pos, alt_index, key, term_match.end() - pos))
+        
+        # 同じ位置では先に書かれた選択肢が優先される（正規表現の選択と同じ）
+        hits.sort(key=lambda hit: (hit[0], hit[1]))
+        
+        counts = dict.fromkeys(self.keys, 0)
+        next_pos = dict.fromkeys(self.keys, 0)
+        for pos, _, key, length in hits:
+            if pos >= next_pos[key]:
+                counts[key] += 1
+                next_pos[key] = pos + length
+        
+        return counts
+    
+    def _iter_literal_hits(self, text: str):
+        """リテラル候補語のヒット列挙"""
+        if self._automaton is None:
+            for start, _, payload in iter_keyword_hits(text, self.namespace):
+                yield start, payload
+        else:
+            for start, keyword_index in self._automaton.iter_matches(text):
+                for payload in self._automaton.payloads[keyword_index]:
+                    yield start, payload
+
+
+def _build_rule_matcher() -> RuleMatcher:
+    """分析ルール全体のマッチャー構築"""
+    rules = [(('tag', i), data['pattern']) for i, data in enumerate(TAG_PATTERNS)]
+    rules += [
+        ('positive', POSITIVE_PATTERNS),
+        ('negative', NEGATIVE_PATTERNS),
+        ('risk', RISK_INDICATORS),
+    ]
+    return RuleMatcher(rules, namespace='analyzer')
+
+
+# モジュール読み込み時に一度だけ構築し、全インスタンスで共有
+RULE_MATCHER = _build_rule_matcher()
+
+# リスク要因辞書（見出し語自体も対象）
+_RISK_TERM_LOOKUP = {
+    alias.lower(): term for term, aliases in RISK_FACTOR_TERMS.items() for alias in [term] + aliases
+}
+register_keywords('risk_factor', _RISK_TERM_LOOKUP.items())
+
+
+def normalize_risk_term(term: str) -> str:
+    """リスク要因の表記を見出し語に正規化（辞書にない語はそのまま）"""
+    term = (term or '').strip()
+    return _RISK_TERM_LOOKUP.get(term.lower(), term)
+
+
+def extract_risk_factors(text: str) -> Dict[str, int]:
+    """リスク要因テキストから見出し語ごとの言及数を抽出"""
+    counts: Dict[str, int] = {}
+    if not text:
+        return counts
+    
+    # 入れ子の一致（「規制強化」中の「規制」など）は長い方だけを数える
+    covered_until = -1
+    hits = sorted(iter_keyword_hits(text.lower(), 'risk_factor'), key=lambda hit: (hit[0], -len(hit[1])))
+    for start, keyword, term in hits:
+        if start < covered_until:
+            continue
+        counts[term] = counts.get(term, 0) + 1
+        covered_until = start + len(keyword)
+    return counts
+
+
+def _rules_digest() -> str:
+    """ルール定義のハッシュ"""
+    rules = json.dumps(
+        [TAG_PATTERNS, POSITIVE_PATTERNS, NEGATIVE_PATTERNS, RISK_INDICATORS],
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(rules.encode('utf-8')).hexdigest()[:12]
+
+
+_RULES_DIGEST = _rules_digest()
+
+
+def get_analyzer_version() -> str:
+    """
+    分析器バージョン文字列
+    
+    ロジックのバージョン・ルール定義・銘柄マスタの内容から決まり、
+    いずれかが変わると保存済みの分析結果は再分析対象になる。
+    """
+    return f"{RULESET_VERSION}-{_RULES_DIGEST}-{get_stock_master().fingerprint}"
+
 
 class StockAnalysisAI:
     """株式分析AI - タグ推奨と内容分析（簡易版）"""
     
     def __init__(self):
-        # 銘柄パターン（日本の主要銘柄）
-        self.stock_patterns = [
-            {'pattern': r'7203|トヨタ自動車|toyota', 'stock': '7203トヨタ', 'confidence': 0.95},
-            {'pattern': r'6758|ソニー|sony', 'stock': '6758ソニー', 'confidence': 0.95},
-            {'pattern': r'9984|ソフトバンク|softbank', 'stock': '9984ソフトバンク', 'confidence': 0.95},
-            {'pattern': r'8306|三菱ufj|mufg', 'stock': '8306三菱UFJ', 'confidence': 0.9},
-            {'pattern': r'4519|中外製薬', 'stock': '4519中外製薬', 'confidence': 0.9},
-            {'pattern': r'2914|JT|日本たばこ', 'stock': '2914JT', 'confidence': 0.9},
-            {'pattern': r'9432|NTT', 'stock': '9432NTT', 'confidence': 0.9},
-            {'pattern': r'9433|KDDI', 'stock': '9433KDDI', 'confidence': 0.9},
-            {'pattern': r'4063|信越化学', 'stock': '4063信越化学', 'confidence': 0.9},
-            {'pattern': r'6861|キーエンス', 'stock': '6861キーエンス', 'confidence': 0.9},
-        ]
-        
-        # タグパターン
-        self.tag_patterns = [
-            {'pattern': r'配当|利回り|dividend', 'tag': '高配当', 'weight': 0.8},
-            {'pattern': r'成長|グロース|growth', 'tag': '成長株', 'weight': 0.8},
-            {'pattern': r'ev|電気自動車|electric', 'tag': 'EV', 'weight': 0.9},
-            {'pattern': r'決算|業績|earnings', 'tag': '決算分析', 'weight': 0.8},
-            {'pattern': r'リスク|危険|risk', 'tag': 'リスク管理', 'weight': 0.7},
-            {'pattern': r'長期|ホールド|long.term', 'tag': '長期投資', 'weight': 0.7},
-            {'pattern': r'短期|デイトレ|short.term', 'tag': '短期取引', 'weight': 0.7},
-            {'pattern': r'テクニカル|チャート|technical', 'tag': 'テクニカル', 'weight': 0.8},
-            {'pattern': r'ファンダメンタル|fundamental', 'tag': 'ファンダメンタル', 'weight': 0.8},
-            {'pattern': r'reit|不動産', 'tag': 'REIT', 'weight': 0.9},
-            {'pattern': r'米国|アメリカ|us|usa', 'tag': '米国株', 'weight': 0.8},
-            {'pattern': r'競合|比較|competitor', 'tag': '競合分析', 'weight': 0.7},
-            {'pattern': r'バリュー|割安|value', 'tag': 'バリュー投資', 'weight': 0.8},
-            {'pattern': r'新規上場|ipo', 'tag': 'IPO', 'weight': 0.9},
-            {'pattern': r'優待|株主優待', 'tag': '株主優待', 'weight': 0.9},
-        ]
-        
-        # センチメント分析パターン
-        self.positive_patterns = r'良い|上昇|成長|利益|好調|期待|強い|優秀|安定|買い|ポジティブ|有望|改善|増加|拡大'
-        self.negative_patterns = r'悪い|下落|減少|損失|不調|心配|弱い|危険|不安定|売り|ネガティブ|懸念|悪化|減退'
+        # ルール定義・コンパイル済みマッチャー・銘柄マスタはモジュールレベルで共有
+        self.tag_patterns = TAG_PATTERNS
+        self.positive_patterns = POSITIVE_PATTERNS
+        self.negative_patterns = NEGATIVE_PATTERNS
+        self.matcher = RULE_MATCHER
     
+    @profiled('analyzer.analyze_content')
     def analyze_content(self, content: str, title: str = "") -> Dict[str, Any]:
         """
         コンテンツの総合分析
         """
         try:
-            text = f"{title} {content}".lower()
-            
-            # 株式検出
-            stock_analysis = self._analyze_stock_mentions(text)
-            
-            # タグ抽出
-            tag_analysis = self._extract_tags(text)
-            
-            # センチメント分析
-            sentiment_analysis = self._analyze_sentiment(text)
-            
-            # リスク評価
-            risk_analysis = self._assess_risk(text)
-            
-            # キーワード抽出
-            keywords = self._extract_keywords(text)
-            
-            # 投資判断支援
-            investment_insights = self._generate_investment_insights(
-                text, stock_analysis, tag_analysis, sentiment_analysis
-            )
-            
-            return {
-                'suggested_tags': tag_analysis['tags'],
-                'stock_mentions': stock_analysis['stocks'],
-                'sentiment': sentiment_analysis['sentiment'],
-                'confidence': sentiment_analysis['confidence'],
-                'risk_level': risk_analysis['level'],
-                'keywords': keywords,
-                'investment_insights': investment_insights,
-                'analysis_score': self._calculate_analysis_score(text)
-            }
+            return self.analysis_from_partial(self.analyze_partial(content, title))
         except Exception as e:
             # エラー時のフォールバック
             return {
@@ -100,42 +251,100 @@ class StockAnalysisAI:
                 'analysis_score': 0
             }
     
-    def _analyze_stock_mentions(self, text: str) -> Dict[str, Any]:
-        """株式メンション分析"""
-        detected_stocks = []
+    @profiled('analyzer.analyze_partial')
+    def analyze_partial(self, content: str, title: str = "") -> Dict[str, Any]:
+        """
+        加算可能な部分集計（ルール別ヒット数・単語頻度など）
+        
+        エントリー単位で保存しておき merge_partials で合算すれば、
+        ノート全体の分析結果を全文の再分析なしに求められる。
+        """
+        text = f"{title} {content}".lower()
+        
+        # 全ルールを1回の走査でカウント
+        with stage('analyzer.rule_matching'):
+            hits = self.matcher.count(text)
+        
+        return {
+            'length': len(text),
+            'stocks': {s['stock']: s['mentions'] for s in self._analyze_stock_mentions(text)['details']},
+            'tags': {
+                data['tag']: hits[('tag', i)]
+                for i, data in enumerate(self.tag_patterns) if hits[('tag', i)]
+            },
+            'positive': hits['positive'],
+            'negative': hits['negative'],
+            'risk': hits['risk'],
+            'words': dict(self._count_words(text)),
+            'numeric_data': int(bool(re.search(r'\d+[%円ドル]', text))),
+            'analysis_terms': int(bool(re.search(ANALYSIS_TERMS, text, re.IGNORECASE))),
+            'comparison_terms': int(bool(re.search(COMPARISON_TERMS, text, re.IGNORECASE))),
+        }
+    
+    @profiled('analyzer.analysis_from_partial')
+    def analysis_from_partial(self, partial: Dict[str, Any]) -> Dict[str, Any]:
+        """部分集計（単体または合算済み）から分析結果を生成"""
+        text_length = partial.get('length', 0)
+        
+        # 株式検出
+        stock_analysis = {
+            'stocks': [stock for stock, mentions in partial.get('stocks', {}).items() if mentions > 0]
+        }
+        
+        # タグ抽出
+        tag_analysis = self._extract_tags(partial.get('tags', {}))
+        
+        # センチメント分析
+        sentiment_analysis = self._analyze_sentiment(partial.get('positive', 0), partial.get('negative', 0))
         
-        for pattern_data in self.stock_patterns:
-            try:
-                matches = re.findall(pattern_data['pattern'], text, re.IGNORECASE)
-                if matches:
-                    detected_stocks.append({
-                        'stock': pattern_data['stock'],
-                        'confidence': pattern_data['confidence'],
-                        'mentions': len(matches)
-                    })
-            except Exception:
-                continue
+        # リスク評価
+        risk_analysis = self._assess_risk(partial.get('risk', 0))
+        
+        # キーワード抽出
+        keywords = self._extract_keywords(partial.get('words', {}))
+        
+        # 投資判断支援
+        investment_insights = self._generate_investment_insights(
+            text_length, stock_analysis, tag_analysis, sentiment_analysis
+        )
+        
+        return {
+            'suggested_tags': tag_analysis['tags'],
+            'stock_mentions': stock_analysis['stocks'],
+            'sentiment': sentiment_analysis['sentiment'],
+            'confidence': sentiment_analysis['confidence'],
+            'risk_level': risk_analysis['level'],
+            'keywords': keywords,
+            'investment_insights': investment_insights,
+            'analysis_score': self._calculate_analysis_score(partial)
+        }
+    
+    @profiled('analyzer.stock_matching')
+    def _analyze_stock_mentions(self, text: str) -> Dict[str, Any]:
+        """株式メンション分析（銘柄マスタによるコード・企業名検出）"""
+        try:
+            detected_stocks = get_stock_master().detect(text)
+        except Exception:
+            detected_stocks = []
         
         return {
             'stocks': [s['stock'] for s in detected_stocks],
             'details': detected_stocks
         }
     
-    def _extract_tags(self, text: str) -> Dict[str, Any]:
+    @profiled('analyzer.tag_extraction')
+    def _extract_tags(self, tag_mentions: Dict[str, int]) -> Dict[str, Any]:
         """タグ抽出"""
         detected_tags = []
         
         for pattern_data in self.tag_patterns:
-            try:
-                matches = re.findall(pattern_data['pattern'], text, re.IGNORECASE)
-                if matches:
-                    detected_tags.append({
-                        'tag': pattern_data['tag'],
-                        'weight': pattern_data['weight'],
-                        'mentions': len(matches)
-                    })
-            except Exception:
-                continue
+            mentions = tag_mentions.get(pattern_data['tag'], 0)
+            if mentions > 0:
+                detected_tags.append({
+                    'tag': pattern_data['tag'],
+                    'weight': pattern_data['weight'],
+                    'mentions': mentions
+                })
         
         # 重要度順でソート
         detected_tags.sort(key=lambda x: x['weight'] * x['mentions'], reverse=True)
@@ -145,12 +354,9 @@ class StockAnalysisAI:
             'details': detected_tags
         }
     
-    def _analyze_sentiment(self, text: str) -> Dict[str, Any]:
+    def _analyze_sentiment(self, positive_matches: int, negative_matches: int) -> Dict[str, Any]:
         """センチメント分析"""
         try:
-            positive_matches = len(re.findall(self.positive_patterns, text, re.IGNORECASE))
-            negative_matches = len(re.findall(self.negative_patterns, text, re.IGNORECASE))
-            
             if positive_matches > negative_matches + 1:
                 sentiment = "positive"
             elif negative_matches > positive_matches + 1:
@@ -172,12 +378,9 @@ class StockAnalysisAI:
                 'scores': {'positive': 0, 'negative': 0}
             }
     
-    def _assess_risk(self, text: str) -> Dict[str, Any]:
+    def _assess_risk(self, risk_matches: int) -> Dict[str, Any]:
         """リスク評価"""
         try:
-            risk_indicators = r'リスク|危険|不安定|暴落|損失|破綻|倒産|規制|競合激化'
-            risk_matches = len(re.findall(risk_indicators, text, re.IGNORECASE))
-            
             if risk_matches > 2:
                 level = "high"
             elif risk_matches > 0:
@@ -189,28 +392,25 @@ class StockAnalysisAI:
         except Exception:
             return {'level': 'unknown', 'mentions': 0}
     
-    def _extract_keywords(self, text: str) -> List[str]:
-        """キーワード抽出（簡易版）"""
+    @profiled('analyzer.keyword_counting')
+    def _count_words(self, text: str) -> Counter:
+        """単語頻度（簡易版）"""
         try:
-            # 一般的な単語を除外
-            common_words = {
-                'の', 'は', 'が', 'を', 'に', 'で', 'と', 'から', 'まで', 'より',
-                'について', 'として', 'という', 'する', 'した', 'している',
-                'です', 'である', 'だと', '思う', '考える', 'ある', 'いる',
-                'この', 'その', 'どの', 'これ', 'それ', 'あれ'
-            }
-            
             # 単語分割（簡易版）
             words = re.findall(r'[ぁ-んァ-ヶー一-龠a-zA-Z0-9]+', text)
-            words = [w for w in words if len(w) > 1 and w not in common_words]
-            
+            return Counter(w for w in words if len(w) > 1 and w not in COMMON_WORDS)
+        except Exception:
+            return Counter()
+    
+    def _extract_keywords(self, word_counts: Dict[str, int]) -> List[str]:
+        """キーワード抽出（簡易版）"""
+        try:
             # 頻度順でソート
-            word_count = Counter(words)
-            return [word for word, count in word_count.most_common(8)]
+            return [word for word, count in Counter(word_counts).most_common(8) if count > 0]
         except Exception:
             return []
     
-    def _generate_investment_insights(self, text: str, stock_analysis: Dict, 
+    def _generate_investment_insights(self, text_length: int, stock_analysis: Dict, 
                                     tag_analysis: Dict, sentiment_analysis: Dict) -> List[str]:
         """投資判断支援インサイト生成"""
         insights = []
@@ -230,7 +430,7 @@ class StockAnalysisAI:
             if '長期投資' in tag_analysis['tags'] and '高配当' in tag_analysis['tags']:
                 insights.append("長期配当投資戦略の特徴が見られます")
             
-            if len(text) > 500:
+            if text_length > 500:
                 insights.append("詳細な分析内容が記録されています")
                 
             if not insights:
@@ -240,31 +440,108 @@ class StockAnalysisAI:
         
         return insights
     
-    def _calculate_analysis_score(self, text: str) -> int:
+    def _calculate_analysis_score(self, partial: Dict[str, Any]) -> int:
         """分析スコア計算（0-100）"""
         try:
             score = 0
+            text_length = partial.get('length', 0)
             
             # 文字数による加点
-            if len(text) > 100:
+            if text_length > 100:
                 score += 20
-            if len(text) > 300:
+            if text_length > 300:
                 score += 20
             
             # 数値データの存在
-            if re.search(r'\d+[%円ドル]', text):
+            if partial.get('numeric_data', 0) > 0:
                 score += 15
             
             # 具体的な分析用語
-            analysis_terms = r'per|pbr|roe|eps|売上|利益|配当|成長率'
-            if re.search(analysis_terms, text, re.IGNORECASE):
+            if partial.get('analysis_terms', 0) > 0:
                 score += 25
             
             # 比較表現
-            comparison_terms = r'前年|同期|比較|対比|vs'
-            if re.search(comparison_terms, text, re.IGNORECASE):
+            if partial.get('comparison_terms', 0) > 0:
                 score += 20
             
             return min(score, 100)
         except Exception:
-            return 0
\ No newline at end of file
+            return 0
+
+
+def merge_partials(*partials: Dict[str, Any]) -> Dict[str, Any]:
+    """部分集計の合算"""
+    total = {field: 0 for field in PARTIAL_COUNT_FIELDS}
+    total.update({field: {} for field in PARTIAL_DICT_FIELDS})
+    
+    for partial in partials:
+        if not partial:
+            continue
+        for field in PARTIAL_COUNT_FIELDS:
+            total[field] += partial.get(field, 0)
+        for field in PARTIAL_DICT_FIELDS:
+            bucket = total[field]
+            for key, value in partial.get(field, {}).items():
+                bucket[key] = bucket.get(key, 0) + value
+    
+    return total
+
+
+def subtract_partial(total: Dict[str, Any], partial: Dict[str, Any]) -> Dict[str, Any]:
+    """部分集計の差し引き（エントリーの更新・削除時）"""
+    result = merge_partials(total)
+    if not partial:
+        return result
+    
+    for field in PARTIAL_COUNT_FIELDS:
+        result[field] = max(result[field] - partial.get(field, 0), 0)
+    for field in PARTIAL_DICT_FIELDS:
+        bucket = result[field]
+        for key, value in partial.get(field, {}).items():
+            remaining = bucket.get(key, 0) - value
+            if remaining > 0:
+                bucket[key] = remaining
+            else:
+                bucket.pop(key, None)
+    
+    return result
+
+
+# 並列一括分析（run_ai_analysis --workers のワーカープロセスで実行）
+_worker_analyzer: Optional[StockAnalysisAI] = None
+
+
+def init_analysis_worker():
+    """ワーカープロセスの初期化（分析器・銘柄マスタを先に読み込む）"""
+    global _worker_analyzer
+    try:
+        import django
+        from django.apps import apps
+        if not apps.ready:
+            django.setup()
+    except Exception:
+        pass
+    
+    get_stock_master()
+    _worker_analyzer = StockAnalysisAI()
+
+
+def analyze_batch(items: List[Tuple[int, str, str, Optional[Dict[str, Any]]]]) -> List[Tuple[int, Any, Any]]:
+    """
+    テキストの一括分析（DBアクセスなし）
+    
+    items: (主キー, 本文, タイトル, 合算する保存済み部分集計) のリスト
+    戻り値: (主キー, 部分集計, 分析結果) のリスト。失敗した項目は部分集計・分析結果が None
+    """
+    analyzer = _worker_analyzer or StockAnalysisAI()
+    results = []
+    for pk, text, title, base_partial in items:
+        try:
+            partial = analyzer.analyze_partial(text, title)
+            if base_partial:
+                partial = merge_partials(partial, base_partial)
+            results.append((pk, partial, analyzer.analysis_from_partial(partial)))
+        except Exception as e:
+            print(f"一括分析エラー ({pk}): {str(e)}")
+            results.append((pk, None, None))
+    return results
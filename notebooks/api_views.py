@@ -6,15 +6,27 @@ from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
 from django.core.paginator import Paginator
+from django.core.cache import cache
 from django.utils import timezone
 from datetime import timedelta
-from .models import Notebook, Entry
-from .ai_analyzer import StockAnalysisAI
+from django.db.models import Count, Q, Sum
+from .models import Notebook, Entry, NotebookRiskFactor, SavedSearch, SavedSearchMatch
+from .ai_analyzer import StockAnalysisAI, normalize_risk_term
 from .calculators import InvestmentCalculator
-from .semantic_search import SemanticSearchEngine
+from .semantic_search import get_search_engine, normalize_query
+from .search_backends import search_notebooks
+from .autocomplete import get_prefix_index
+from .percolator import compile_query
+from .profiling import profiled, get_stats, reset_stats, is_enabled
+from .utils import (
+    entry_urls, generate_user_cache_key, get_user_data_version, PUBLIC_DATA_VERSION, USER_RESULT_CACHE_TIMEOUT
+)
 from decimal import Decimal
 import json
 
+# セマンティック検索APIで1回に返す件数の上限
+SEMANTIC_SEARCH_MAX_LIMIT = 50
+
 @login_required
 @require_http_methods(["GET"])
 def search_notebooks_api(request):
@@ -25,25 +37,7 @@ def search_notebooks_api(request):
     if len(query) < 2:
         return JsonResponse({'results': []})
     
-    notebooks = Notebook.objects.filter(
-        user=request.user
-    ).filter(
-        title__icontains=query
-    ) | Notebook.objects.filter(
-        user=request.user
-    ).filter(
-        company_name__icontains=query
-    ) | Notebook.objects.filter(
-        user=request.user
-    ).filter(
-        stock_code__icontains=query
-    ) | Notebook.objects.filter(
-        user=request.user
-    ).filter(
-        tags__name__icontains=query
-    )
-    
-    notebooks = notebooks.distinct()[:limit]
+    notebooks = search_notebooks(request.user.id, query, limit)
     
     results = []
     for notebook in notebooks:
@@ -63,6 +57,22 @@ def search_notebooks_api(request):
     
     return JsonResponse({'results': results})
 
+@login_required
+@require_http_methods(["GET"])
+def autocomplete_api(request):
+    """検索ボックスの入力補完API（タイトル・銘柄コード・企業名・タグ名の前方一致、足りなければ部分一致）"""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        return JsonResponse({'error': '不正な件数です'}, status=400)
+    
+    if not query:
+        return JsonResponse({'results': [], 'tags': []})
+    
+    results, tags = get_prefix_index(request.user.id).suggest(query, limit)
+    return JsonResponse({'results': results, 'tags': tags})
+
 @login_required
 @require_http_methods(["POST"])
 def ai_analyze_content_api(request):
@@ -177,28 +187,53 @@ def dashboard_stats_api(request):
 @login_required
 @require_http_methods(["GET"])
 def semantic_search_api(request):
-    """セマンティック検索API"""
+    """セマンティック検索API（mode=entries でエントリー単位の検索）"""
     try:
         query = request.GET.get('q', '').strip()
-        limit = int(request.GET.get('limit', 10))
+        try:
+            limit = min(max(int(request.GET.get('limit', 10)), 1), SEMANTIC_SEARCH_MAX_LIMIT)
+        except ValueError:
+            return JsonResponse({'error': '不正な件数です'}, status=400)
+        cursor = request.GET.get('cursor') or None
+        mode = 'entries' if request.GET.get('mode') == 'entries' else 'notebooks'
         
         if len(query) < 2:
             return JsonResponse({
                 'success': True,
                 'results': [],
+                'next_cursor': None,
                 'message': 'クエリが短すぎます'
             })
         
-        search_engine = SemanticSearchEngine()
-        results = search_engine.semantic_search(query, request.user.id, limit)
+        # 同じ検索はデータが更新されるまでキャッシュから返す
+        cache_key = generate_user_cache_key(
+            'semantic_search', request.user.id, mode, normalize_query(query), limit, cursor or ''
+        )
+        page = cache.get(cache_key)
+        if page is None:
+            if mode == 'entries':
+                results = get_search_engine().search_entries(query, request.user.id, limit)
+                page = {'results': results, 'next_cursor': None}
+            else:
+                try:
+                    # ファセット件数は一致したノート全体の値のため最初のページのみ集計
+                    page = get_search_engine().semantic_search_page(
+                        query, request.user.id, limit, cursor, facets=cursor is None
+                    )
+                except ValueError as e:
+                    return JsonResponse({'error': str(e)}, status=400)
+            cache.set(cache_key, page, USER_RESULT_CACHE_TIMEOUT)
         
         return JsonResponse({
             'success': True,
-            'results': results,
+            'results': page['results'],
+            'next_cursor': page['next_cursor'],
+            'facets': page.get('facets'),
             'query': query,
-            'total_results': len(results)
+            'mode': mode,
+            'total_results': len(page['results'])
         })
-        
+    
     except Exception as e:
         return JsonResponse({'error': f'セマンティック検索エラー: {str(e)}'}, status=500)
 
@@ -208,11 +243,19 @@ def related_content_api(request, notebook_id):
     """関連コンテンツ推奨API"""
     try:
         limit = int(request.GET.get('limit', 5))
+        # scope=public で他のユーザーの公開ノートも対象
+        include_public = request.GET.get('scope') == 'public'
         
-        search_engine = SemanticSearchEngine()
-        related_content = search_engine.find_related_content(
-            notebook_id, request.user.id, limit  # int型として渡す
+        cache_key = generate_user_cache_key(
+            'related_content', request.user.id, notebook_id, limit,
+            get_user_data_version(PUBLIC_DATA_VERSION) if include_public else ''
         )
+        related_content = cache.get(cache_key)
+        if related_content is None:
+            related_content = get_search_engine().find_related_content(
+                notebook_id, request.user.id, limit, include_public  # int型として渡す
+            )
+            cache.set(cache_key, related_content, USER_RESULT_CACHE_TIMEOUT)
         
         return JsonResponse({
             'success': True,
@@ -235,7 +278,7 @@ def auto_categorize_api(request):
         if not content:
             return JsonResponse({'error': '分析する内容がありません'}, status=400)
         
-        search_engine = SemanticSearchEngine()
+        search_engine = get_search_engine()
         categorization = search_engine.auto_categorize_content(content, title)
         
         return JsonResponse({
@@ -250,13 +293,14 @@ def auto_categorize_api(request):
 
 @login_required
 @require_http_methods(["GET"])
+@profiled('api.ai_insights')
 def ai_insights_api(request, notebook_id):
     """AI洞察・推奨API"""
     try:
         notebook = Notebook.objects.get(pk=notebook_id, user=request.user)
         
         # ノート全体のAI分析
-        search_engine = SemanticSearchEngine()
+        search_engine = get_search_engine()
         full_text = search_engine._extract_full_text(notebook)
         
         analyzer = StockAnalysisAI()
@@ -287,6 +331,153 @@ def ai_insights_api(request, notebook_id):
     except Exception as e:
         return JsonResponse({'error': f'AI洞察取得エラー: {str(e)}'}, status=500)
         
+@login_required
+@require_http_methods(["GET", "POST"])
+def profiling_stats_api(request):
+    """段階別計測結果API（スタッフ専用。POSTで集計をリセット）"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': '権限がありません'}, status=403)
+    
+    stages = get_stats()
+    if request.method == 'POST':
+        reset_stats()
+    
+    return JsonResponse({
+        'success': True,
+        'enabled': is_enabled(),
+        'stages': stages,
+    })
+
+@login_required
+@require_http_methods(["GET"])
+def risk_exposure_api(request):
+    """リスク要因エクスポージャーAPI（term 指定時は該当ノート一覧、未指定時はリスク項目別の集計）"""
+    try:
+        term = normalize_risk_term(request.GET.get('term', ''))
+        
+        if term:
+            factors = NotebookRiskFactor.objects.filter(
+                term=term, notebook__user=request.user
+            ).select_related('notebook').order_by('-mentions', '-notebook__updated_at')
+            
+            return JsonResponse({
+                'success': True,
+                'term': term,
+                'notebooks': [{
+                    'id': factor.notebook.pk,
+                    'title': factor.notebook.title,
+                    'stock_code': factor.notebook.stock_code,
+                    'company_name': factor.notebook.company_name,
+                    'mentions': factor.mentions,
+                } for factor in factors]
+            })
+        
+        exposure = NotebookRiskFactor.objects.filter(
+            notebook__user=request.user
+        ).values('term').annotate(
+            notebook_count=Count('notebook'), mentions=Sum('mentions')
+        ).order_by('-notebook_count', 'term')
+        
+        return JsonResponse({
+            'success': True,
+            'exposure': list(exposure),
+        })
+    
+    except Exception as e:
+        return JsonResponse({'error': f'リスク要因集計エラー: {str(e)}'}, status=500)
+
+@login_required
+@require_http_methods(["GET", "POST"])
+def saved_searches_api(request):
+    """保存した検索API（GET: 一覧と未読の一致数、POST: 追加）"""
+    try:
+        if request.method == 'POST':
+            data = json.loads(request.body)
+            query = (data.get('query') or '').strip()
+            
+            if len(query) > 200:
+                return JsonResponse({'error': '検索条件が長すぎます'}, status=400)
+            if not compile_query(query):
+                return JsonResponse({'error': '検索条件に語が含まれていません'}, status=400)
+            
+            saved_search = SavedSearch.objects.create(
+                user=request.user, query=query, name=(data.get('name') or '').strip()[:200]
+            )
+            return JsonResponse({
+                'success': True,
+                'saved_search': {
+                    'id': saved_search.pk,
+                    'name': saved_search.name,
+                    'query': saved_search.query,
+                    'unread_count': 0,
+                }
+            }, status=201)
+        
+        saved_searches = SavedSearch.objects.filter(user=request.user).annotate(
+            unread_count=Count('matches', filter=Q(matches__is_read=False))
+        )
+        return JsonResponse({
+            'success': True,
+            'saved_searches': [{
+                'id': saved_search.pk,
+                'name': saved_search.name,
+                'query': saved_search.query,
+                'unread_count': saved_search.unread_count,
+            } for saved_search in saved_searches]
+        })
+    
+    except json.JSONDecodeError:
+        return JsonResponse({'error': '不正なJSONデータです'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': f'保存した検索エラー: {str(e)}'}, status=500)
+
+@login_required
+@require_http_methods(["DELETE"])
+def saved_search_delete_api(request, saved_search_id):
+    """保存した検索の削除API（一致の記録も削除）"""
+    deleted, _ = SavedSearch.objects.filter(pk=saved_search_id, user=request.user).delete()
+    if not deleted:
+        return JsonResponse({'error': '保存した検索が見つかりません'}, status=404)
+    return JsonResponse({'success': True})
+
+@login_required
+@require_http_methods(["GET", "POST"])
+def saved_search_matches_api(request):
+    """保存した検索の一致API（GET: 未読の一致を新しい順に、POST: 既読にする）"""
+    try:
+        if request.method == 'POST':
+            data = json.loads(request.body or '{}')
+            matches = SavedSearchMatch.objects.filter(user=request.user, is_read=False)
+            # ids 未指定時はすべて既読にする
+            if data.get('ids') is not None:
+                matches = matches.filter(pk__in=[int(pk) for pk in data['ids']])
+            return JsonResponse({'success': True, 'updated': matches.update(is_read=True)})
+        
+        limit = min(int(request.GET.get('limit', 20)), 100)
+        matches = SavedSearchMatch.objects.filter(user=request.user, is_read=False).select_related(
+            'saved_search', 'entry', 'notebook'
+        )[:limit]
+        urls = entry_urls((match.entry_id, match.notebook_id) for match in matches)
+        return JsonResponse({
+            'success': True,
+            'matches': [{
+                'id': match.pk,
+                'saved_search_id': match.saved_search_id,
+                'saved_search': str(match.saved_search),
+                'entry_id': match.entry_id,
+                'entry_title': match.entry.title,
+                'notebook_id': match.notebook_id,
+                'notebook_title': match.notebook.title,
+                'matched_at': match.matched_at.isoformat(),
+                'url': urls[match.entry_id],
+            } for match in matches]
+        })
+    
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return JsonResponse({'error': '不正なJSONデータです'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': f'保存した検索の一致取得エラー: {str(e)}'}, status=500)
+
 def generate_improvement_suggestions(notebook, analysis, categorization):
     """改善提案生成"""
     suggestions = []
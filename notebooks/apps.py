@@ -4,4 +4,12 @@ from django.apps import AppConfig
 class NotebooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'notebooks'
-    verbose_name = 'ノートブック'
\ No newline at end of file
+    verbose_name = 'ノートブック'
+    
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from . import signals  # noqa: F401
+        from .search_backends import create_search_schema
+        
+        # 全文検索の仮想テーブルはモデル外のため migrate 後に作成
+        post_migrate.connect(create_search_schema, sender=self)
@@ -0,0 +1,174 @@
+# notebooks/autocomplete.py
+"""
+検索ボックスの入力補完（ユーザー別の前方一致インデックス）
+タイトル（語単位）・銘柄コード・企業名・タグ名をソート済み配列に並べ、前方一致の範囲を二分探索で引く。
+前方一致が足りない場合は照合キーの部分一致で補う（「自動車」で「トヨタ自動車」を引く）。
+インデックスはプロセス内に保持し、ユーザーデータの版数が変わるか最大保持時間を過ぎたら作り直す
+（版数はプロセスごとのキャッシュにあるため、他のプロセスでの書き込みは最大保持時間内に反映される）
+"""
+import heapq
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from django.contrib.contenttypes.models import ContentType
+from django.urls import reverse
+from taggit.models import TaggedItem
+
+from .models import Notebook
+from .utils import get_user_data_version
+
+# プロセス内に保持するインデックスのユーザー数（超えたら最も使われていないものから破棄）
+AUTOCOMPLETE_MAX_USERS = 32
+
+# インデックスの最大保持時間（秒）
+AUTOCOMPLETE_MAX_AGE = 60
+
+# 補完候補の1件に含めるタグ数
+AUTOCOMPLETE_TAGS_PER_NOTEBOOK = 3
+
+# 部分一致で補う入力の最小文字数
+AUTOCOMPLETE_SUBSTRING_MIN_LENGTH = 2
+
+# 前方一致の範囲の上端（どの文字よりも後ろに並ぶ文字）
+_MAX_CHAR = chr(0x10FFFF)
+
+
+def normalize_term(text: str) -> str:
+    """照合用の正規化（全角英数字の半角化・小文字化）"""
+    return unicodedata.normalize('NFKC', text or '').lower().strip()
+
+
+def _notebook_keys(title: str, stock_code: str, company_name: str, tags: List[str]) -> set:
+    """ノートを引く照合キー（タイトル全体と語ごと・銘柄コード・企業名・タグ名）"""
+    title = normalize_term(title)
+    keys = {title, normalize_term(stock_code), normalize_term(company_name)}
+    keys.update(title.split())
+    keys.update(normalize_term(tag) for tag in tags)
+    keys.discard('')
+    return keys
+
+
+class PrefixIndex:
+    """ユーザー1人分の前方一致インデックス"""
+    
+    def __init__(self, notebooks: List[Tuple], tags: Dict[int, List[str]]):
+        # notebooks は新しい順。並び順を順位として、前方一致した中から新しいものを返す
+        self.notebooks = notebooks
+        notebook_keys = [
+            _notebook_keys(title, stock_code, company_name, tags.get(pk, []))
+            for pk, title, _, stock_code, company_name in notebooks
+        ]
+        entries = sorted((key, rank) for rank, keys in enumerate(notebook_keys) for key in keys)
+        self.keys = [key for key, _ in entries]
+        self.ranks = [rank for _, rank in entries]
+        # 部分一致用に順位ごとの照合キーを連結（キーをまたいで一致しないよう改行で区切る）
+        self.haystacks = ['\n'.join(keys) for keys in notebook_keys]
+        self.notebook_tags = tags
+        
+        tag_counts = {}
+        for names in tags.values():
+            for name in names:
+                tag_counts[name] = tag_counts.get(name, 0) + 1
+        tag_entries = sorted((normalize_term(name), name, count) for name, count in tag_counts.items())
+        self.tag_keys = [key for key, _, _ in tag_entries]
+        self.tags = [(name, count) for _, name, count in tag_entries]
+    
+    @staticmethod
+    def _prefix_range(keys: List[str], prefix: str) -> Tuple[int, int]:
+        return bisect_left(keys, prefix), bisect_left(keys, prefix + _MAX_CHAR)
+    
+    def _substring_ranks(self, term: str, limit: int, exclude: set) -> List[int]:
+        """照合キーに term を含むノートの順位（新しい順に limit 件まで）"""
+        ranks = []
+        for rank, haystack in enumerate(self.haystacks):
+            if len(ranks) >= limit:
+                break
+            if term in haystack and rank not in exclude:
+                ranks.append(rank)
+        return ranks
+    
+    def suggest(self, query: str, limit: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        前方一致するノート（新しい順）とタグ（件数順）
+        
+        前方一致のノートが limit 件に満たない場合は、部分一致するノートを新しい順に後ろへ補う。
+        """
+        prefix = normalize_term(query)
+        if not prefix:
+            return [], []
+        
+        lo, hi = self._prefix_range(self.keys, prefix)
+        ranks = heapq.nsmallest(limit, set(self.ranks[lo:hi]))
+        if len(ranks) < limit and len(prefix) >= AUTOCOMPLETE_SUBSTRING_MIN_LENGTH:
+            ranks += self._substring_ranks(prefix, limit - len(ranks), set(ranks))
+        
+        notebooks = []
+        for rank in ranks:
+            pk, title, subtitle, stock_code, company_name = self.notebooks[rank]
+            notebooks.append({
+                'id': str(pk),
+                'title': title,
+                'subtitle': subtitle,
+                'stock_code': stock_code,
+                'company_name': company_name,
+                'tags': self.notebook_tags.get(pk, [])[:AUTOCOMPLETE_TAGS_PER_NOTEBOOK],
+                'url': reverse('notebook_detail', kwargs={'pk': pk}),
+            })
+        
+        lo, hi = self._prefix_range(self.tag_keys, prefix)
+        tags = [
+            {'name': name, 'count': count}
+            for name, count in heapq.nlargest(limit, self.tags[lo:hi], key=lambda item: item[1])
+        ]
+        return notebooks, tags
+
+
+def build_prefix_index(user_id: int) -> PrefixIndex:
+    """ユーザーのノート・タグからインデックスを作成（2クエリ）"""
+    notebooks = Notebook.objects.filter(user_id=user_id)
+    
+    tags = {}
+    for object_id, name in TaggedItem.objects.filter(
+        content_type=ContentType.objects.get_for_model(Notebook),
+        object_id__in=notebooks.order_by().values('pk')
+    ).values_list('object_id', 'tag__name'):
+        tags.setdefault(object_id, []).append(name)
+    
+    return PrefixIndex(
+        list(notebooks.order_by('-updated_at', '-pk').values_list(
+            'pk', 'title', 'subtitle', 'stock_code', 'company_name'
+        )),
+        tags
+    )
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_prefix_index(user_id: int) -> PrefixIndex:
+    """
+    ユーザーの前方一致インデックス
+    
+    版数が変わっておらず、作成から AUTOCOMPLETE_MAX_AGE 秒以内であればプロセス内のものを再利用する。
+    """
+    # 作成前に版数を読むことで、作成中の書き込みは次回の作り直しで反映される
+    version = get_user_data_version(user_id)
+    now = time.monotonic()
+    with _lock:
+        cached = _indexes.get(user_id)
+        if cached and cached[0] == version and now - cached[1] < AUTOCOMPLETE_MAX_AGE:
+            _indexes.move_to_end(user_id)
+            return cached[2]
+    
+    index = build_prefix_index(user_id)
+    with _lock:
+        _indexes[user_id] = (version, now, index)
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > AUTOCOMPLETE_MAX_USERS:
+            _indexes.popitem(last=False)
+    return index
@@ -0,0 +1,413 @@
+# notebooks/batch_analysis.py
+"""
+AI分析の一括実行（run_ai_analysis --workers 用）
+主キーを一定件数ずつ読み込み、分析はプロセスプールで並列実行し、結果は行ごとの UPDATE 文を executemany でまとめて書き戻す（bulk_update_fields）
+チェックポイントファイルにより、中断した位置から再開できる
+"""
+import json
+import os
+from pathlib import Path
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from taggit.models import Tag, TaggedItem
+
+from .ai_analyzer import (
+    analyze_batch, get_analyzer_version, init_analysis_worker, merge_partials, subtract_partial,
+)
+from .models import Entry, Notebook
+from .search_index import index_notebooks
+from .semantic_search import get_search_engine
+from .utils import bump_user_data_version, PUBLIC_DATA_VERSION
+
+# perform_ai_analysis_for_entry / _notebook と同じ最小文字数
+MIN_ENTRY_LENGTH = 10
+MIN_NOTEBOOK_LENGTH = 20
+
+# AI推奨タグの自動追加数
+ENTRY_AUTO_TAGS = 2
+NOTEBOOK_AUTO_TAGS = 3
+
+ENTRY_FIELDS = [
+    'id', 'notebook_id', 'title', 'content',
+    'ai_content_hash', 'ai_analyzer_version', 'ai_partial',
+]
+
+PHASES = ('entries', 'notebooks')
+
+
+class Checkpoint:
+    """中断再開用のチェックポイント（フェーズごとの処理済み最大主キー）"""
+    
+    def __init__(self, path, params):
+        self.path = Path(path) if path else None
+        self.params = params
+        self.positions = {}
+        self.resumed = False
+        
+        if self.path and self.path.exists():
+            try:
+                with self.path.open(encoding='utf-8') as f:
+                    state = json.load(f)
+                # 対象・分析器バージョンが同じ実行のみ再開する
+                if state.get('params') == params:
+                    self.positions = state.get('positions', {})
+                    self.resumed = bool(self.positions)
+            except (OSError, ValueError) as e:
+                print(f"チェックポイント読み込みエラー: {str(e)}")
+    
+    def position(self, phase):
+        """処理済みの最大主キー"""
+        return self.positions.get(phase, 0)
+    
+    def save(self, phase, last_pk):
+        """処理位置の記録（一時ファイル経由で置き換え）"""
+        self.positions[phase] = last_pk
+        if not self.path:
+            return
+        
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump({'params': self.params, 'positions': self.positions}, f)
+        os.replace(tmp_path, self.path)
+    
+    def clear(self):
+        """完了時の削除"""
+        self.positions = {}
+        if self.path and self.path.exists():
+            self.path.unlink()
+
+
+class BatchAnalysisRunner:
+    """エントリー → ノートブックの順に一括分析"""
+    
+    def __init__(self, workers=1, chunk_size=500, force=False, user=None, notebook_id=None,
+                 checkpoint_path=None, log=print, stale=False, since=None):
+        self.workers = max(int(workers), 1)
+        self.chunk_size = max(int(chunk_size), 1)
+        self.force = force
+        self.user = user
+        self.notebook_id = notebook_id
+        self.log = log
+        self.stale = stale
+        self.since = since
+        self.analyzer_version = get_analyzer_version()
+        
+        self.checkpoint = Checkpoint(checkpoint_path, {
+            'user': user.pk if user else None,
+            'notebook': notebook_id,
+            'force': force,
+            'stale': stale,
+            'since': since.isoformat() if since else None,
+            'analyzer_version': self.analyzer_version,
+        })
+        self.stats = {phase: {'analyzed': 0, 'skipped': 0, 'failed': 0} for phase in PHASES}
+        self._pool = None
+    
+    @property
+    def incremental(self):
+        """変更分のみを対象にするモード（--stale / --since）"""
+        return self.stale or self.since is not None
+    
+    def scoped(self, model):
+        """--user / --notebook で絞り込んだクエリセット"""
+        queryset = model.objects.all()
+        notebook_lookup = 'pk' if model is Notebook else 'notebook_id'
+        user_lookup = 'user' if model is Notebook else 'notebook__user'
+        if self.notebook_id:
+            queryset = queryset.filter(**{notebook_lookup: self.notebook_id})
+        elif self.user:
+            queryset = queryset.filter(**{user_lookup: self.user})
+        return queryset
+    
+    def incremental_conditions(self):
+        """
+        変更分の選択条件
+        
+        OR でまとめると全件走査になるため、条件ごとに別クエリにしてそれぞれインデックスを使わせる。
+        （未分析 / 分析後に更新 / 分析器バージョンが現行と異なる）
+        """
+        if not self.stale:
+            conditions = [Q()]
+        else:
+            conditions = [
+                Q(ai_last_analyzed__isnull=True),
+                Q(updated_at__gt=F('ai_last_analyzed')),
+                Q(ai_analyzer_version__lt=self.analyzer_version),
+                Q(ai_analyzer_version__gt=self.analyzer_version),
+            ]
+        if self.since is not None:
+            conditions = [condition & Q(updated_at__gte=self.since) for condition in conditions]
+        return conditions
+    
+    def candidate_pks(self, model, after_pk=0):
+        """変更分の主キー一覧（昇順）"""
+        queryset = self.scoped(model)
+        if after_pk:
+            queryset = queryset.filter(pk__gt=after_pk)
+        
+        pks = set()
+        for condition in self.incremental_conditions():
+            pks.update(queryset.filter(condition).order_by().values_list('pk', flat=True))
+        return sorted(pks)
+    
+    def entry_queryset(self):
+        """対象エントリー"""
+        queryset = self.scoped(Entry)
+        if not self.force:
+            queryset = queryset.filter(ai_analysis_cache={})
+        return queryset
+    
+    def notebook_queryset(self):
+        """対象ノートブック"""
+        queryset = self.scoped(Notebook)
+        if not self.force:
+            # 未分析のノートと、現行バージョンで分析済みだがエントリー集計が変わったノート
+            # （旧バージョンで分析済みのノートは --force 指定時のみ再分析）
+            queryset = queryset.filter(
+                Q(ai_last_analyzed__isnull=True) | Q(ai_analyzer_version=self.analyzer_version)
+            )
+        return queryset
+    
+    def run(self):
+        """一括分析の実行"""
+        if self.checkpoint.resumed:
+            self.log(f'チェックポイントから再開: {self.checkpoint.positions}')
+        
+        try:
+            if self.workers > 1:
+                self._pool = self._create_pool()
+            self._run_phase('entries', Entry, self.entry_queryset, self._process_entries)
+            self._run_phase('notebooks', Notebook, self.notebook_queryset, self._process_notebooks)
+        finally:
+            if self._pool:
+                self._pool.shutdown()
+                self._pool = None
+        
+        self.checkpoint.clear()
+        return self.stats
+    
+    def _create_pool(self):
+        """分析用プロセスプール"""
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        
+        # 子プロセスにDB接続を引き継がない
+        connections.close_all()
+        start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=init_analysis_worker,
+        )
+    
+    def _run_phase(self, phase, model, get_queryset, process):
+        """主キー順に一定件数ずつ処理（処理済み位置をチェックポイントに記録）"""
+        last_pk = self.checkpoint.position(phase)
+        if self.incremental:
+            pk_stream = self.candidate_pks(model, last_pk)
+        else:
+            pk_stream = get_queryset().filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)
+            pk_stream = pk_stream.iterator(chunk_size=self.chunk_size)
+        
+        chunk = []
+        for pk in pk_stream:
+            chunk.append(pk)
+            if len(chunk) >= self.chunk_size:
+                self._process_chunk(phase, chunk, process)
+                chunk = []
+        if chunk:
+            self._process_chunk(phase, chunk, process)
+    
+    def _process_chunk(self, phase, pks, process):
+        """1チャンクの処理と進捗表示"""
+        process(pks)
+        self.checkpoint.save(phase, pks[-1])
+        
+        stats = self.stats[phase]
+        self.log(
+            f'  {phase}: ~{pks[-1]} 分析{stats["analyzed"]}件 '
+            f'スキップ{stats["skipped"]}件 失敗{stats["failed"]}件'
+        )
+    
+    def _analyze(self, items):
+        """分析の実行（ワーカー数に応じて分割して並列実行）"""
+        if not items:
+            return {}
+        
+        if not self._pool:
+            batches = [analyze_batch(items)]
+        else:
+            size = max(len(items) // (self.workers * 4), 1)
+            batches = self._pool.map(analyze_batch, [items[i:i + size] for i in range(0, len(items), size)])
+        
+        return {pk: (partial, analysis) for batch in batches for pk, partial, analysis in batch}
+    
+    def _process_entries(self, pks):
+        """エントリーのチャンク処理（ノート集計も差分更新）"""
+        stats = self.stats['entries']
+        targets = []
+        current_pks = []
+        for entry in Entry.objects.filter(pk__in=pks).only(*ENTRY_FIELDS).iterator():
+            content_hash = entry.get_ai_content_hash()
+            if len(entry.content.strip()) <= MIN_ENTRY_LENGTH:
+                stats['skipped'] += 1
+            elif entry.is_ai_analysis_current(content_hash):
+                current_pks.append(entry.pk)
+                stats['skipped'] += 1
+            else:
+                targets.append((entry, content_hash))
+        
+        # 内容が変わっていない行は分析日時だけ更新し、次回以降 --stale の対象から外す
+        if current_pks:
+            Entry.objects.filter(pk__in=current_pks).update(ai_last_analyzed=timezone.now())
+        
+        results = self._analyze([(entry.pk, entry.content, entry.title, None) for entry, _ in targets])
+        
+        updated = []
+        update_fields = []
+        notebook_deltas = {}
+        auto_tags = {}
+        for entry, content_hash in targets:
+            partial, analysis = results.get(entry.pk, (None, None))
+            if analysis is None:
+                stats['failed'] += 1
+                continue
+            
+            notebook_deltas.setdefault(entry.notebook_id, []).append((entry.ai_partial, partial))
+            update_fields = entry.apply_ai_analysis(analysis, content_hash, partial)
+            updated.append(entry)
+            auto_tags[entry.pk] = analysis.get('suggested_tags', [])[:ENTRY_AUTO_TAGS]
+        
+        if not updated:
+            return
+        
+        with transaction.atomic():
+            bulk_update_fields(Entry, updated, update_fields)
+            
+            notebooks = list(
+                Notebook.objects.select_for_update().filter(pk__in=notebook_deltas).only('id', 'ai_entries_aggregate')
+            )
+            for notebook in notebooks:
+                deltas = notebook_deltas[notebook.pk]
+                notebook.ai_entries_aggregate = subtract_partial(
+                    merge_partials(notebook.ai_entries_aggregate, *[new for _, new in deltas]),
+                    merge_partials(*[old for old, _ in deltas])
+                )
+            bulk_update_fields(Notebook, notebooks, ['ai_entries_aggregate'])
+            
+            bulk_add_tags(Entry, auto_tags)
+            # タグは一括作成でシグナルが飛ばないため、検索インデックス・結果キャッシュはここで更新
+            index_notebooks(notebook_deltas)
+            bump_owner_data_versions(notebook_deltas)
+        
+        stats['analyzed'] += len(updated)
+        
+        # 変更分モードではノートの分析日時が古くならないため、集計が変わったノートをここで更新
+        if self.incremental:
+            self._process_notebooks(sorted(notebook_deltas))
+    
+    def _process_notebooks(self, pks):
+        """ノートブックのチャンク処理（エントリーは再分析せず集計を使用）"""
+        stats = self.stats['notebooks']
+        targets = []
+        current_pks = []
+        for notebook in Notebook.objects.filter(pk__in=pks).iterator():
+            header_text = notebook.get_ai_header_text()
+            aggregate = notebook.ai_entries_aggregate or {}
+            content_hash = notebook.get_ai_content_hash()
+            if len(header_text.strip()) + aggregate.get('length', 0) <= MIN_NOTEBOOK_LENGTH:
+                stats['skipped'] += 1
+            elif notebook.is_ai_analysis_current(content_hash):
+                current_pks.append(notebook.pk)
+                stats['skipped'] += 1
+            else:
+                targets.append((notebook, header_text, content_hash))
+        
+        if current_pks:
+            Notebook.objects.filter(pk__in=current_pks).update(ai_last_analyzed=timezone.now())
+        
+        results = self._analyze([
+            (notebook.pk, header_text, notebook.title, notebook.ai_entries_aggregate)
+            for notebook, header_text, _ in targets
+        ])
+        
+        updated = []
+        update_fields = []
+        auto_tags = {}
+        for notebook, _, content_hash in targets:
+            _, analysis = results.get(notebook.pk, (None, None))
+            if analysis is None:
+                stats['failed'] += 1
+                continue
+            
+            update_fields = notebook.apply_ai_analysis(analysis, content_hash)
+            updated.append(notebook)
+            auto_tags[notebook.pk] = analysis.get('suggested_tags', [])[:NOTEBOOK_AUTO_TAGS]
+        
+        if not updated:
+            return
+        
+        with transaction.atomic():
+            bulk_update_fields(Notebook, updated, update_fields)
+            bulk_add_tags(Notebook, auto_tags)
+            index_notebooks(auto_tags)
+            bump_owner_data_versions(auto_tags)
+            # タグが変わったノートの特徴を更新し、特徴が変わったノートの関連ノート表は次の読み込み時に計算
+            engine = get_search_engine()
+            engine.invalidate_related_notebooks(engine.refresh_notebook_features(auto_tags))
+        
+        stats['analyzed'] += len(updated)
+
+
+def bump_owner_data_versions(notebook_ids):
+    """ノート所有者の結果キャッシュの無効化（一括書き込みはシグナルが飛ばないため）"""
+    # 公開ノートを含む場合は公開ノート対象の結果も無効化
+    owners = set(Notebook.objects.filter(pk__in=list(notebook_ids)).values_list('user_id', 'is_public').distinct())
+    bump_user_data_version(*{user_id for user_id, _ in owners}, *(
+        [PUBLIC_DATA_VERSION] if any(is_public for _, is_public in owners) else []
+    ))
+
+
+def bulk_update_fields(model, objs, fields):
+    """
+    指定フィールドの一括書き込み
+    
+    QuerySet.bulk_update は CASE WHEN 式の組み立てが件数×フィールド数に比例して重いため、
+    行ごとの UPDATE 文を executemany でまとめて実行する。
+    """
+    if not objs or not fields:
+        return
+    
+    model_fields = [model._meta.get_field(name) for name in fields]
+    quote = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        quote(model._meta.db_table),
+        ', '.join(f'{quote(field.column)} = %s' for field in model_fields),
+        quote(model._meta.pk.column),
+    )
+    params = [
+        [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in model_fields] + [obj.pk]
+        for obj in objs
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def bulk_add_tags(model, tags_by_pk):
+    """AI推奨タグの一括追加（付与済みのタグは無視）"""
+    names = {name for names in tags_by_pk.values() for name in names}
+    if not names:
+        return
+    
+    tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+    for name in names - tags.keys():
+        tags[name] = Tag.objects.create(name=name)
+    
+    content_type = ContentType.objects.get_for_model(model)
+    TaggedItem.objects.bulk_create([
+        TaggedItem(content_type=content_type, object_id=pk, tag=tags[name])
+        for pk, names in tags_by_pk.items() for name in names
+    ], ignore_conflicts=True)
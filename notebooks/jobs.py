@@ -0,0 +1,224 @@
+# notebooks/jobs.py
+"""
+AI分析のバックグラウンドジョブ（DBキュー）
+ビューはジョブを登録するだけで応答し、analysis_worker コマンドが分析を実行する
+ノートの特徴と関連ノート表の更新（ノート・エントリー・タグの書き込み時）も同じキューで実行する
+外部ブローカーは不要（SQLiteでも動作）
+"""
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import AnalysisJob, Entry, Notebook
+from .utils import generate_content_hash
+
+ACTIVE_STATUSES = ('pending', 'running')
+
+# 再試行間隔（秒）: 基本間隔 × 2^(試行回数-1)、上限あり
+RETRY_BACKOFF_BASE = getattr(settings, 'AI_JOB_RETRY_BACKOFF', 30)
+RETRY_BACKOFF_MAX = getattr(settings, 'AI_JOB_RETRY_BACKOFF_MAX', 3600)
+DEFAULT_MAX_ATTEMPTS = getattr(settings, 'AI_JOB_MAX_ATTEMPTS', 5)
+
+# 実行中のまま放置されたジョブ（ワーカー異常終了など）を再取得するまでの秒数
+STALE_LOCK_SECONDS = getattr(settings, 'AI_JOB_STALE_LOCK_SECONDS', 600)
+
+
+def default_worker_id():
+    """ワーカー識別子（ホスト名:プロセスID）"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_analysis(target_type, object_id, content_hash=''):
+    """
+    分析ジョブ登録
+    
+    同じ対象・同じ内容のジョブが待機中・実行中なら登録しない。
+    内容の異なる待機中ジョブがあれば、それを最新の内容で置き換える。
+    """
+    now = timezone.now()
+    
+    with transaction.atomic():
+        active = AnalysisJob.objects.filter(
+            target_type=target_type, object_id=object_id, status__in=ACTIVE_STATUSES
+        )
+        
+        job = active.filter(content_hash=content_hash).first()
+        if job:
+            return job
+        
+        job = active.filter(status='pending').first()
+        if job:
+            job.content_hash = content_hash
+            job.attempts = 0
+            job.run_after = now
+            job.last_error = ''
+            job.save(update_fields=['content_hash', 'attempts', 'run_after', 'last_error', 'updated_at'])
+            return job
+        
+        return AnalysisJob.objects.create(
+            target_type=target_type,
+            object_id=object_id,
+            content_hash=content_hash,
+            max_attempts=DEFAULT_MAX_ATTEMPTS,
+            run_after=now,
+        )
+
+
+def enqueue_notebook_analysis(notebook):
+    """ノートブック分析ジョブ登録"""
+    content_hash = generate_content_hash(notebook.title, notebook.get_ai_header_text())
+    return enqueue_analysis('notebook', notebook.pk, content_hash)
+
+
+def enqueue_entry_analysis(entry):
+    """エントリー分析ジョブ登録（分析済みの内容なら登録しない）"""
+    content_hash = entry.get_ai_content_hash()
+    if entry.is_ai_analysis_current(content_hash):
+        return None
+    return enqueue_analysis('entry', entry.pk, content_hash)
+
+
+def enqueue_feature_refresh(notebook_id):
+    """
+    特徴・関連ノート表の更新ジョブ登録
+    
+    待機中のジョブがあればそれにまとめる。内容ハッシュの代わりに登録時刻を使い、
+    実行中のジョブより後の書き込みは新しいジョブで反映する。
+    """
+    return enqueue_analysis('features', notebook_id, str(time.time_ns()))
+
+
+def claim_jobs(batch_size=20, worker_id=None):
+    """
+    実行可能なジョブをまとめて取得
+    
+    状態を条件にした UPDATE で取得するため、複数ワーカーでも同じジョブを二重に取得しない。
+    """
+    worker_id = worker_id or default_worker_id()
+    now = timezone.now()
+    claimable = (
+        Q(status='pending', run_after__lte=now) |
+        Q(status='running', locked_at__lt=now - timedelta(seconds=STALE_LOCK_SECONDS))
+    )
+    
+    with transaction.atomic():
+        job_ids = list(
+            AnalysisJob.objects.filter(claimable)
+            .order_by('run_after', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not job_ids:
+            return []
+        
+        AnalysisJob.objects.filter(claimable, id__in=job_ids).update(
+            status='running',
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+    
+    return list(AnalysisJob.objects.filter(
+        id__in=job_ids, status='running', locked_by=worker_id, locked_at=now
+    ).order_by('run_after', 'id'))
+
+
+def _run_notebook_job(object_id):
+    """ノートブック分析ジョブの処理"""
+    from .views import perform_ai_analysis_for_notebook
+    
+    notebook = Notebook.objects.filter(pk=object_id).first()
+    if notebook is None:
+        return  # 削除済み
+    perform_ai_analysis_for_notebook(notebook, raise_errors=True)
+
+
+def _run_entry_job(object_id):
+    """エントリー分析ジョブの処理（ノート集計が変わるためノート分析も更新）"""
+    from .views import perform_ai_analysis_for_entry, perform_ai_analysis_for_notebook
+    
+    entry = Entry.objects.select_related('notebook').filter(pk=object_id).first()
+    if entry is None:
+        return  # 削除済み
+    perform_ai_analysis_for_entry(entry, raise_errors=True)
+    perform_ai_analysis_for_notebook(entry.notebook, raise_errors=True)
+
+
+def _run_features_job(object_id):
+    """
+    特徴・関連ノート表の更新ジョブの処理
+    
+    特徴が変わった場合のみ、このノートと、このノートを関連ノートに持つノートの関連ノート表を更新する。
+    """
+    from .semantic_search import get_search_engine
+    
+    engine = get_search_engine()
+    if object_id in engine.refresh_notebook_features([object_id]):
+        engine.refresh_related_notebooks([object_id], reverse=True)
+
+
+JOB_HANDLERS = {
+    'notebook': _run_notebook_job,
+    'entry': _run_entry_job,
+    'features': _run_features_job,
+}
+
+
+def retry_delay(attempts):
+    """再試行までの待ち時間（指数バックオフ）"""
+    return timedelta(seconds=min(RETRY_BACKOFF_BASE * 2 ** max(attempts - 1, 0), RETRY_BACKOFF_MAX))
+
+
+def run_job(job):
+    """ジョブ1件の実行（失敗時は再試行を予約し、上限に達したら dead にする）"""
+    owned = AnalysisJob.objects.filter(pk=job.pk, status='running', locked_by=job.locked_by)
+    
+    try:
+        JOB_HANDLERS[job.target_type](job.object_id)
+    except Exception as e:
+        error = f"{type(e).__name__}: {str(e)}"
+        if job.attempts >= job.max_attempts:
+            owned.update(status='dead', last_error=error, locked_by='', locked_at=None,
+                         updated_at=timezone.now())
+        else:
+            owned.update(status='pending', last_error=error, locked_by='', locked_at=None,
+                         run_after=timezone.now() + retry_delay(job.attempts),
+                         updated_at=timezone.now())
+        print(f"AI分析ジョブエラー ({job}): {error}")
+        return False
+    
+    owned.update(status='done', last_error='', locked_by='', locked_at=None,
+                 updated_at=timezone.now())
+    return True
+
+
+def process_jobs(batch_size=20, worker_id=None):
+    """ジョブを1バッチ取得して実行し、件数を返す"""
+    jobs = claim_jobs(batch_size, worker_id)
+    succeeded = sum(1 for job in jobs if run_job(job))
+    return {
+        'claimed': len(jobs),
+        'done': succeeded,
+        'failed': len(jobs) - succeeded,
+    }
+
+
+def purge_finished_jobs(days=7):
+    """完了から一定期間経過したジョブの削除"""
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = AnalysisJob.objects.filter(status='done', updated_at__lt=cutoff).delete()
+    return deleted
+
+
+def requeue_dead_jobs(queryset=None):
+    """dead ジョブを再投入"""
+    queryset = AnalysisJob.objects.all() if queryset is None else queryset
+    return queryset.filter(status='dead').update(
+        status='pending', attempts=0, run_after=timezone.now(), updated_at=timezone.now()
+    )
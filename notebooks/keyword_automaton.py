@@ -0,0 +1,174 @@
+# notebooks/keyword_automaton.py
+"""
+キーワード辞書の多パターン照合（Aho-Corasick法）
+分析器・検索エンジンの辞書を1つのオートマトンにまとめ、テキストを1回の走査で照合する
+"""
+import re
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class KeywordAutomaton:
+    """Aho-Corasick 多パターン照合オートマトン"""
+    
+    def __init__(self, entries: Iterable[Tuple[str, Any]]):
+        # 状態遷移・失敗遷移・出力（キーワード番号）
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        
+        self.keywords: List[str] = []
+        self.payloads: List[List[Any]] = []
+        
+        index: Dict[str, int] = {}
+        for keyword, payload in entries:
+            keyword = keyword.lower()
+            if not keyword:
+                continue
+            if keyword not in index:
+                index[keyword] = len(self.keywords)
+                self.keywords.append(keyword)
+                self.payloads.append([])
+                self._insert(keyword, index[keyword])
+            self.payloads[index[keyword]].append(payload)
+        
+        self._build_failure_links()
+        
+        # ルート状態では先頭文字になり得ない文字を正規表現で読み飛ばす
+        first_chars = ''.join(re.escape(char) for char in sorted(self._goto[0]))
+        self._first_char_re = re.compile(f'[{first_chars}]') if first_chars else None
+    
+    def _insert(self, keyword: str, keyword_index: int):
+        """トライへのキーワード追加"""
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append(keyword_index)
+    
+    def _build_failure_links(self):
+        """失敗遷移の構築（幅優先）"""
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+    
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """
+        (開始位置, キーワード番号) を全て列挙
+        
+        重なり・入れ子の一致も含めて返す。テキストは小文字化済みであること。
+        """
+        if self._first_char_re is None:
+            return
+        
+        goto, fail, out, keywords = self._goto, self._fail, self._out, self.keywords
+        skip = self._first_char_re.search
+        state = 0
+        position = 0
+        length = len(text)
+        
+        while position < length:
+            if state == 0:
+                match = skip(text, position)
+                if match is None:
+                    return
+                position = match.start()
+            
+            char = text[position]
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            
+            for keyword_index in out[state]:
+                yield position - len(keywords[keyword_index]) + 1, keyword_index
+            position += 1
+    
+    def find_keywords(self, text: str) -> List[str]:
+        """テキストに含まれるキーワード一覧（出現順・重複なし）"""
+        seen = {}
+        for _, keyword_index in self.iter_matches(text.lower()):
+            seen.setdefault(keyword_index, None)
+        return [self.keywords[keyword_index] for keyword_index in seen]
+
+
+# 共有オートマトン（名前空間ごとの辞書を登録し、利用時に一度だけ構築）
+_registry: Dict[str, List[Tuple[str, Any]]] = {}
+_shared_automaton: Optional[KeywordAutomaton] = None
+_shared_lock = threading.Lock()
+
+
+def register_keywords(namespace: str, entries: Iterable[Tuple[str, Any]]):
+    """共有オートマトンへの辞書登録（次回利用時に再構築）"""
+    global _shared_automaton
+    with _shared_lock:
+        _registry[namespace] = list(entries)
+        _shared_automaton = None
+
+
+def get_shared_automaton() -> KeywordAutomaton:
+    """登録済み全辞書の共有オートマトン取得"""
+    global _shared_automaton
+    automaton = _shared_automaton
+    if automaton is None:
+        with _shared_lock:
+            if _shared_automaton is None:
+                _shared_automaton = KeywordAutomaton(
+                    (keyword, (namespace, payload))
+                    for namespace, entries in _registry.items()
+                    for keyword, payload in entries
+                )
+            automaton = _shared_automaton
+    return automaton
+
+
+def iter_keyword_hits(text: str, namespace: str) -> Iterator[Tuple[int, str, Any]]:
+    """
+    指定名前空間の辞書ヒットを (開始位置, キーワード, ペイロード) で列挙
+    
+    テキストは小文字化済みであること。
+    """
+    automaton = get_shared_automaton()
+    for start, keyword_index in automaton.iter_matches(text):
+        for payload_namespace, payload in automaton.payloads[keyword_index]:
+            if payload_namespace == namespace:
+                yield start, automaton.keywords[keyword_index], payload
+
+
+def find_keyword_hits(text: str, namespaces: Iterable[str]) -> List[Tuple[str, Any]]:
+    """
+    複数の名前空間の辞書ヒットを (名前空間, ペイロード) で取得（1回の走査。出現順・重複なし）
+    
+    テキストは小文字化済みであること。
+    """
+    namespaces = set(namespaces)
+    automaton = get_shared_automaton()
+    found = {}
+    for _, keyword_index in automaton.iter_matches(text):
+        for hit in automaton.payloads[keyword_index]:
+            if hit[0] in namespaces:
+                found.setdefault(hit, None)
+    return list(found)
+
+
+def find_keyword_payloads(text: str, namespace: str) -> List[Any]:
+    """指定名前空間でテキストにヒットしたペイロード一覧（出現順・重複なし）"""
+    found = {}
+    for _, _, payload in iter_keyword_hits(text, namespace):
+        found.setdefault(payload, None)
+    return list(found)
@@ -0,0 +1,93 @@
+# notebooks/management/commands/ai_profile.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from notebooks.models import Notebook
+from notebooks.ai_analyzer import StockAnalysisAI
+from notebooks.semantic_search import SemanticSearchEngine
+from notebooks import profiling
+
+
+class Command(BaseCommand):
+    help = 'AI分析・検索処理を段階別に計測して結果を表示します'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--notebook',
+            type=int,
+            help='AI洞察（ai_insights_api 相当）の処理を計測するノートブックID',
+        )
+        parser.add_argument(
+            '--query',
+            type=str,
+            help='セマンティック検索を計測する検索クエリ（--user と併用）',
+        )
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='検索対象ユーザー（ユーザー名を指定）',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=1,
+            help='繰り返し回数（デフォルト: 1）',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='結果をJSONで出力',
+        )
+    
+    def handle(self, *args, **options):
+        if not options['notebook'] and not options['query']:
+            raise CommandError('--notebook または --query を指定してください')
+        
+        profiling.reset_stats()
+        profiling.enable()
+        try:
+            for _ in range(max(options['repeat'], 1)):
+                if options['notebook']:
+                    self.run_insights(options['notebook'])
+                if options['query']:
+                    self.run_search(options['query'], options['user'])
+        finally:
+            profiling.disable()
+        
+        stats = profiling.get_stats()
+        if options['json']:
+            self.stdout.write(json.dumps(stats, ensure_ascii=False, indent=2))
+            return
+        
+        self.stdout.write(f'{"段階":<36} {"回数":>6} {"合計ms":>10} {"平均ms":>9} {"p95ms":>8} {"最大ms":>9}')
+        for name, data in stats.items():
+            self.stdout.write(
+                f'{name:<36} {data["count"]:>6} {data["total_ms"]:>10.2f} '
+                f'{data["avg_ms"]:>9.3f} {data["p95_ms"]:>8} {data["max_ms"]:>9.2f}'
+            )
+    
+    def run_insights(self, notebook_id):
+        """ai_insights_api と同じ処理の実行"""
+        try:
+            notebook = Notebook.objects.get(pk=notebook_id)
+        except Notebook.DoesNotExist:
+            raise CommandError(f'ノートブック ID "{notebook_id}" が見つかりません')
+        
+        with profiling.stage('api.ai_insights'):
+            search_engine = SemanticSearchEngine()
+            full_text = search_engine._extract_full_text(notebook)
+            StockAnalysisAI().analyze_content(full_text, notebook.title)
+            search_engine.auto_categorize_content(full_text, notebook.title)
+            search_engine.find_related_content(notebook.pk, notebook.user_id, 3)
+    
+    def run_search(self, query, username):
+        """セマンティック検索の実行"""
+        if not username:
+            raise CommandError('--query には --user の指定が必要です')
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f'ユーザー "{username}" が見つかりません')
+        
+        SemanticSearchEngine().semantic_search(query, user.id)
@@ -0,0 +1,78 @@
+# notebooks/management/commands/analysis_worker.py
+import time
+
+from django.core.management.base import BaseCommand
+from notebooks.models import AnalysisJob
+from notebooks.jobs import default_worker_id, process_jobs, purge_finished_jobs
+
+
+class Command(BaseCommand):
+    help = 'AI分析・特徴の更新ジョブ（DBキュー）を取得して実行するワーカー'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=20,
+            help='1回に取得するジョブ数（デフォルト: 20）',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5.0,
+            help='ジョブがない時の待機秒数（デフォルト: 5）',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='実行可能なジョブを処理したら終了（cron 用）',
+        )
+        parser.add_argument(
+            '--purge-days',
+            type=int,
+            default=7,
+            help='完了ジョブを削除するまでの日数（0で削除しない。デフォルト: 7）',
+        )
+    
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        worker_id = default_worker_id()
+        
+        self.stdout.write(self.style.SUCCESS(f'AI分析ワーカーを開始します ({worker_id})'))
+        
+        if options['purge_days'] > 0:
+            purged = purge_finished_jobs(options['purge_days'])
+            if purged:
+                self.stdout.write(f'完了ジョブを削除: {purged}件')
+        
+        total = {'claimed': 0, 'done': 0, 'failed': 0}
+        try:
+            while True:
+                result = process_jobs(batch_size, worker_id)
+                for key in total:
+                    total[key] += result[key]
+                
+                if result['claimed']:
+                    self.stdout.write(
+                        f'  処理: {result["claimed"]}件 '
+                        f'(成功{result["done"]}件, 失敗{result["failed"]}件)'
+                    )
+                    continue
+                
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('ワーカーを停止します'))
+        
+        dead_count = AnalysisJob.objects.filter(status='dead').count()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'完了: {total["claimed"]}件処理 (成功{total["done"]}件, 失敗{total["failed"]}件)'
+            )
+        )
+        if dead_count:
+            self.stdout.write(
+                self.style.WARNING(f'再試行上限に達したジョブ: {dead_count}件（管理画面から再投入できます）')
+            )
@@ -0,0 +1,29 @@
+# notebooks/management/commands/rebuild_related_notebooks.py
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from notebooks.models import Notebook
+from notebooks.semantic_search import get_search_engine
+
+
+class Command(BaseCommand):
+    help = '関連ノート表を一括で再構築します（特徴が未作成のノートは特徴も作成）'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='特定のユーザーのみ処理（ユーザー名を指定）',
+        )
+    
+    def handle(self, *args, **options):
+        notebooks = Notebook.objects.all()
+        
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'ユーザー "{options["user"]}" が見つかりません')
+            notebooks = notebooks.filter(user=user)
+        
+        count = get_search_engine().rebuild_related_notebooks(notebooks)
+        self.stdout.write(self.style.SUCCESS(f'関連ノート表を再構築しました（{count}件）'))
@@ -0,0 +1,33 @@
+# notebooks/management/commands/rebuild_risk_factors.py
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from notebooks.models import Notebook
+
+
+class Command(BaseCommand):
+    help = 'ノートブックのリスク要因索引を再構築します（辞書変更後・既存データの初回投入用）'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='特定のユーザーのみ処理（ユーザー名を指定）',
+        )
+    
+    def handle(self, *args, **options):
+        notebooks = Notebook.objects.only('id', 'risk_factors').order_by('pk')
+        
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'ユーザー "{options["user"]}" が見つかりません')
+            notebooks = notebooks.filter(user=user)
+        
+        total = changed = 0
+        for notebook in notebooks.iterator(chunk_size=500):
+            total += 1
+            if notebook.refresh_risk_factor_index():
+                changed += 1
+        
+        self.stdout.write(self.style.SUCCESS(f'リスク要因索引を再構築しました（{total}件中 {changed}件を更新）'))
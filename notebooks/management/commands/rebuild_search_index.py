@@ -0,0 +1,41 @@
+# notebooks/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from notebooks.models import Notebook
+from notebooks.search_index import index_notebooks, BATCH_SIZE
+from notebooks.search_backends import get_search_backend
+from notebooks.utils import bump_user_data_version
+
+
+class Command(BaseCommand):
+    help = '検索インデックスを再構築します（既存データの初回投入・不整合の修復用）'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='特定のユーザーのみ処理（ユーザー名を指定）',
+        )
+    
+    def handle(self, *args, **options):
+        notebooks = Notebook.objects.order_by('pk')
+        
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'ユーザー "{options["user"]}" が見つかりません')
+            notebooks = notebooks.filter(user=user)
+        
+        get_search_backend().ensure_schema()
+        notebook_ids = list(notebooks.values_list('pk', flat=True))
+        changed = 0
+        for i in range(0, len(notebook_ids), BATCH_SIZE):
+            changed += index_notebooks(notebook_ids[i:i + BATCH_SIZE])
+        
+        # 検索結果が変わりうるため、キャッシュした検索順位・結果を無効化
+        bump_user_data_version(*notebooks.values_list('user_id', flat=True).distinct())
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'検索インデックスを再構築しました（{len(notebook_ids)}件、ポスティング {changed}件を更新）'
+        ))
@@ -1,5 +1,11 @@
 # notebooks/management/commands/run_ai_analysis.py
+import os
+import re
+from datetime import timedelta
+
 from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.contrib.auth.models import User
 from notebooks.models import Notebook, Entry
 from notebooks.views import batch_ai_analysis_for_user, perform_ai_analysis_for_notebook, perform_ai_analysis_for_entry
@@ -22,7 +28,7 @@ class Command(BaseCommand):
         parser.add_argument(
             '--force',
             action='store_true',
-            help='既にAI分析済みのデータも強制的に再分析',
+            help='既にAI分析済みのデータも強制的に再分析（内容・分析器が未変更のデータはハッシュ比較でスキップ）',
         )
         parser.add_argument(
             '--dry-run',
@@ -33,7 +39,40 @@ class Command(BaseCommand):
             '--limit',
             type=int,
             default=100,
-            help='処理するノートブック数の上限（デフォルト: 100）',
+            help='処理するノートブック数の上限（デフォルト: 100。--workers 指定時は無効）',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='一括モード: 指定数のプロセスで並列分析し、結果をまとめて書き込み（1で単一プロセス）',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='一括モードで1回に読み込む件数（デフォルト: 500）',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            type=str,
+            default='.run_ai_analysis.checkpoint.json',
+            help='一括モードのチェックポイントファイル（中断時はここから再開）',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='一括モードでチェックポイントを無視して最初から実行',
+        )
+        parser.add_argument(
+            '--stale',
+            action='store_true',
+            help='未分析・分析後に更新・分析器バージョンが古いデータのみ処理（一括モード）',
+        )
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='指定日時以降に更新されたデータのみ処理（例: 2024-06-01, 2024-06-01T09:00, 24h, 7d）',
         )
 
     def handle(self, *args, **options):
@@ -46,6 +85,19 @@ class Command(BaseCommand):
         if dry_run:
             self.stdout.write(self.style.WARNING('DRY RUN モード: 実際の処理は行いません'))
 
+        # 変更分のみ処理（一括モードで実行）
+        options['since'] = self.parse_since(options['since'])
+        if options['stale'] or options['since']:
+            options['workers'] = max(options['workers'], 1)
+            if dry_run:
+                self.show_incremental_summary(options)
+                return
+        
+        # 一括モード（並列・チャンク単位・再開可能）
+        if options['workers'] and not dry_run:
+            self.process_bulk(options)
+            return
+        
         # 特定のノートブック処理
         if options['notebook']:
             self.process_specific_notebook(options['notebook'], force_update, dry_run)
@@ -59,6 +111,81 @@ class Command(BaseCommand):
         # 全ユーザー処理
         self.process_all_users(force_update, dry_run, limit)
 
+    def parse_since(self, value):
+        """--since の解釈（日時・日付・相対指定 24h / 7d）"""
+        if not value:
+            return None
+        
+        relative = re.fullmatch(r'(\d+)([hd])', value.strip())
+        if relative:
+            amount = int(relative.group(1))
+            unit = 'hours' if relative.group(2) == 'h' else 'days'
+            return timezone.now() - timedelta(**{unit: amount})
+        
+        since = parse_datetime(value)
+        if since is None:
+            date = parse_date(value)
+            if date is None:
+                raise CommandError(f'--since の形式が不正です: "{value}"')
+            since = parse_datetime(f'{date.isoformat()}T00:00:00')
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+    
+    def build_runner(self, options, checkpoint_path=None):
+        """一括モードの実行器"""
+        from notebooks.batch_analysis import BatchAnalysisRunner
+        
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'ユーザー "{options["user"]}" が見つかりません')
+        
+        return BatchAnalysisRunner(
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            force=options['force'],
+            user=user,
+            notebook_id=options['notebook'],
+            checkpoint_path=checkpoint_path,
+            log=self.stdout.write,
+            stale=options['stale'],
+            since=options['since'],
+        )
+    
+    def show_incremental_summary(self, options):
+        """変更分の件数表示（DRY RUN用）"""
+        runner = self.build_runner(options)
+        self.stdout.write('変更分の対象サマリー:')
+        self.stdout.write(f'  ノートブック: {len(runner.candidate_pks(Notebook))}件')
+        self.stdout.write(f'  エントリー: {len(runner.candidate_pks(Entry))}件')
+    
+    def process_bulk(self, options):
+        """一括モード処理"""
+        if options['restart'] and os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+        
+        self.stdout.write(
+            f'一括モード: ワーカー{options["workers"]}プロセス, チャンク{options["chunk_size"]}件'
+        )
+        if options['stale'] or options['since']:
+            self.stdout.write(f'変更分のみ処理: stale={options["stale"]}, since={options["since"]}')
+        
+        runner = self.build_runner(options, options['checkpoint'])
+        try:
+            stats = runner.run()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('中断しました（次回はチェックポイントから再開します）'))
+            return
+        
+        for phase, label in [('entries', 'エントリー'), ('notebooks', 'ノートブック')]:
+            self.stdout.write(self.style.SUCCESS(
+                f'{label}: 分析{stats[phase]["analyzed"]}件, '
+                f'スキップ{stats[phase]["skipped"]}件, 失敗{stats[phase]["failed"]}件'
+            ))
+    
     def process_specific_notebook(self, notebook_id, force_update, dry_run):
         """特定のノートブック処理"""
         try:
@@ -0,0 +1,62 @@
+# notebooks/minhash.py
+"""
+関連ノート検索用の MinHash 署名と LSH バンド
+ノート特徴（タグ・キーワード・業界・投資スタイル）の集合から署名を作り、
+いずれかのバンドのバケットが一致するノートを関連ノートの候補にする
+"""
+import hashlib
+import random
+from typing import Dict, Iterable, List, Sequence, Set
+
+# NumPy のインポート（利用できない場合は同じ計算を Python で行う）
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 署名長とバンド分割（32バンド×2行。集合の Jaccard 係数がおよそ0.2以上なら高い確率で候補に入る）
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 32
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+
+# 署名に使うハッシュ関数 (a * x + b) mod p の係数（プロセス間で同じ値になるよう固定シード）
+_PRIME = (1 << 31) - 1
+_random = random.Random(0x5EED)
+_COEFFICIENTS = [
+    (_random.randrange(1, _PRIME), _random.randrange(0, _PRIME)) for _ in range(MINHASH_PERMUTATIONS)
+]
+
+
+def feature_set(features: Dict[str, Sequence], groups: Iterable[str]) -> Set[str]:
+    """特徴グループの値を1つの集合に（グループ名を接頭辞にして区別）"""
+    return {f'{group}:{value}' for group in groups for value in features.get(group) or []}
+
+
+def _base_hash(item: str) -> int:
+    return int.from_bytes(hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest(), 'big') % _PRIME
+
+
+def minhash_signature(items: Iterable[str]) -> List[int]:
+    """集合の MinHash 署名（空集合は空リスト）"""
+    values = sorted({_base_hash(item) for item in items})
+    if not values:
+        return []
+    
+    if np is not None:
+        a, b = (np.array(column, dtype=np.uint64) for column in zip(*_COEFFICIENTS))
+        hashed = (np.outer(np.array(values, dtype=np.uint64), a) + b) % _PRIME
+        return hashed.min(axis=0).tolist()
+    return [min((a * x + b) % _PRIME for x in values) for a, b in _COEFFICIENTS]
+
+
+def lsh_buckets(signature: Sequence[int]) -> List[int]:
+    """署名のバンドごとのバケット（バンド番号も含めた符号付き64bitハッシュ）"""
+    if not signature:
+        return []
+    
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        digest = hashlib.blake2b(f"{band}:{','.join(map(str, rows))}".encode(), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, 'big', signed=True))
+    return buckets
@@ -25,6 +25,9 @@ class Notebook(models.Model):
     ai_investment_strategy = models.CharField(max_length=50, blank=True, verbose_name="AI推定投資戦略")
     ai_analysis_score = models.IntegerField(default=0, verbose_name="AI分析スコア")
     ai_last_analyzed = models.DateTimeField(null=True, blank=True, verbose_name="AI最終分析日時")
+    ai_content_hash = models.CharField(max_length=64, blank=True, verbose_name="AI分析対象ハッシュ")
+    ai_analyzer_version = models.CharField(max_length=40, blank=True, verbose_name="AI分析バージョン")
+    ai_entries_aggregate = models.JSONField(default=dict, blank=True, verbose_name="エントリーAI部分集計の合計")
     
     # メタデータ
     created_at = models.DateTimeField(auto_now_add=True)
@@ -39,6 +42,14 @@ class Notebook(models.Model):
         ordering = ['-updated_at']
         verbose_name = "ノートブック"
         verbose_name_plural = "ノートブック"
+        indexes = [
+            models.Index(fields=['updated_at'], name='notebook_updated_idx'),
+            # run_ai_analysis --stale の対象選択用
+            models.Index(fields=['ai_last_analyzed'], name='notebook_ai_analyzed_idx'),
+            models.Index(fields=['ai_analyzer_version'], name='notebook_ai_version_idx'),
+            models.Index(fields=['id'], condition=models.Q(updated_at__gt=models.F('ai_last_analyzed')),
+                         name='notebook_ai_stale_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -54,13 +65,70 @@ class Notebook(models.Model):
             return float((self.target_price - self.current_price) / self.current_price * 100)
         return 0
     
-    def update_ai_analysis(self, analysis_data):
+    def get_ai_header_text(self):
+        """AI分析対象のノート本体テキスト（エントリーを除く）"""
+        return ' '.join(filter(None, [
+            self.title, self.subtitle, self.company_name,
+            self.investment_goal, self.risk_factors,
+        ]))
+    
+    def apply_entry_partial(self, old_partial, new_partial):
+        """エントリーの部分集計の差分をノート集計に反映（エントリー数によらず一定コスト）"""
+        from django.db import transaction
+        from .ai_analyzer import merge_partials, subtract_partial
+        
+        with transaction.atomic():
+            current = Notebook.objects.select_for_update().filter(
+                pk=self.pk
+            ).values_list('ai_entries_aggregate', flat=True).first()
+            if current is None:
+                return
+            
+            aggregate = subtract_partial(merge_partials(current, new_partial), old_partial)
+            # update() で保存し、updated_at は変更しない
+            Notebook.objects.filter(pk=self.pk).update(ai_entries_aggregate=aggregate)
+        
+        self.ai_entries_aggregate = aggregate
+    
+    def rebuild_ai_entries_aggregate(self):
+        """保存済みのエントリー部分集計からノート集計を再構築"""
+        from .ai_analyzer import merge_partials
+        
+        aggregate = merge_partials(*self.entries.values_list('ai_partial', flat=True))
+        Notebook.objects.filter(pk=self.pk).update(ai_entries_aggregate=aggregate)
+        self.ai_entries_aggregate = aggregate
+    
+    def get_ai_content_hash(self):
+        """AI分析対象（本体テキスト＋エントリー集計）のハッシュ"""
+        import json
+        from .utils import generate_content_hash
+        
+        return generate_content_hash(
+            self.title, self.get_ai_header_text(),
+            json.dumps(self.ai_entries_aggregate or {}, sort_keys=True, ensure_ascii=False)
+        )
+    
+    def is_ai_analysis_current(self, content_hash):
+        """保存済みAI分析が同じ内容・同じ分析器バージョンのものか"""
+        from .ai_analyzer import get_analyzer_version
+        
+        return (bool(self.ai_content_hash) and self.ai_content_hash == content_hash and
+                self.ai_analyzer_version == get_analyzer_version())
+    
+    def update_ai_analysis(self, analysis_data, content_hash=''):
         """AI分析結果を更新"""
+        self.save(update_fields=self.apply_ai_analysis(analysis_data, content_hash))
+    
+    def apply_ai_analysis(self, analysis_data, content_hash=''):
+        """AI分析結果をインスタンスに反映（保存はしない。更新フィールド名を返す）"""
         from django.utils import timezone
+        from .ai_analyzer import get_analyzer_version
         
         self.ai_analysis_cache = analysis_data
         self.ai_analysis_score = analysis_data.get('analysis_score', 0)
         self.ai_last_analyzed = timezone.now()
+        self.ai_content_hash = content_hash
+        self.ai_analyzer_version = get_analyzer_version()
         
         # 投資戦略の推定
         suggested_tags = analysis_data.get('suggested_tags', [])
@@ -77,8 +145,132 @@ class Notebook(models.Model):
         else:
             self.ai_investment_strategy = 'diversified'
         
-        self.save(update_fields=['ai_analysis_cache', 'ai_analysis_score', 
-                               'ai_last_analyzed', 'ai_investment_strategy'])
+        return ['ai_analysis_cache', 'ai_analysis_score',
+                'ai_last_analyzed', 'ai_investment_strategy',
+                'ai_content_hash', 'ai_analyzer_version']
+    
+    def refresh_risk_factor_index(self):
+        """リスク要因テキストから抽出したリスク項目で索引テーブルを更新（変化がなければ何もしない）"""
+        from django.db import transaction
+        from .ai_analyzer import extract_risk_factors
+        
+        factors = extract_risk_factors(self.risk_factors)
+        current = dict(self.risk_factor_index.values_list('term', 'mentions'))
+        if current == factors:
+            return False
+        
+        with transaction.atomic():
+            self.risk_factor_index.all().delete()
+            NotebookRiskFactor.objects.bulk_create([
+                NotebookRiskFactor(notebook=self, term=term, mentions=mentions)
+                for term, mentions in factors.items()
+            ])
+        return True
+
+
+class NotebookRiskFactor(models.Model):
+    """ノートブックのリスク要因索引（risk_factors から保存時に抽出）"""
+    notebook = models.ForeignKey(Notebook, on_delete=models.CASCADE, related_name='risk_factor_index')
+    term = models.CharField(max_length=50, verbose_name="リスク項目")
+    mentions = models.IntegerField(default=1, verbose_name="言及数")
+    
+    class Meta:
+        ordering = ['term']
+        verbose_name = "リスク要因索引"
+        verbose_name_plural = "リスク要因索引"
+        constraints = [
+            models.UniqueConstraint(fields=['notebook', 'term'], name='riskfactor_notebook_term_uniq'),
+        ]
+        indexes = [
+            # 「為替リスクのあるノート」をリスク項目から引く
+            models.Index(fields=['term', 'notebook'], name='riskfactor_term_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.notebook_id}: {self.term}"
+
+
+class NotebookFeatures(models.Model):
+    """関連コンテンツ推奨用のノート特徴（書き込み時にジョブで更新、未作成分は rebuild_related_notebooks で作成）"""
+    notebook = models.OneToOneField(Notebook, on_delete=models.CASCADE, related_name='features')
+    tags = models.JSONField(default=list, verbose_name="タグ")
+    keywords = models.JSONField(default=list, verbose_name="キーワード（上位5件）")
+    industry_features = models.JSONField(default=list, verbose_name="業界")
+    investment_style = models.JSONField(default=list, verbose_name="投資スタイル")
+    sentiment = models.CharField(max_length=20, default='neutral', verbose_name="センチメント")
+    minhash = models.JSONField(default=list, verbose_name="MinHash署名")
+    related_refreshed_at = models.DateTimeField(null=True, blank=True, verbose_name="関連ノート表の更新日時")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "ノート特徴"
+        verbose_name_plural = "ノート特徴"
+    
+    def __str__(self):
+        return f"{self.notebook_id}: features"
+
+
+class NotebookLSHBucket(models.Model):
+    """関連ノート検索用の LSH バケット（MinHash 署名のバンドごと。ノート特徴と同時に更新）"""
+    notebook = models.ForeignKey(Notebook, on_delete=models.CASCADE, related_name='lsh_buckets')
+    bucket = models.BigIntegerField(verbose_name="バケット")
+    
+    class Meta:
+        verbose_name = "LSHバケット"
+        verbose_name_plural = "LSHバケット"
+        indexes = [
+            # 対象ノートと同じバケットのノートを引く
+            models.Index(fields=['bucket', 'notebook'], name='lshbucket_lookup_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.notebook_id}: {self.bucket}"
+
+
+class RelatedNotebook(models.Model):
+    """関連ノート表（ノートごとの類似度上位。特徴の更新時に対象ノートと逆方向の関連ノートを更新）"""
+    source = models.ForeignKey(Notebook, on_delete=models.CASCADE, related_name='related_notebooks')
+    target = models.ForeignKey(Notebook, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField(verbose_name="類似度")
+    aspects = models.JSONField(default=list, verbose_name="共通要素")
+    
+    class Meta:
+        ordering = ['source', '-score', 'target']
+        verbose_name = "関連ノート"
+        verbose_name_plural = "関連ノート"
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'target'], name='relatednotebook_source_target_uniq'),
+        ]
+        indexes = [
+            # ノートの関連ノートを類似度順に引く
+            models.Index(fields=['source', '-score'], name='relatednotebook_source_idx'),
+            # 逆方向（このノートを関連ノートに持つノート）
+            models.Index(fields=['target'], name='relatednotebook_target_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.source_id} -> {self.target_id} ({self.score:.2f})"
+
+
+class SearchPosting(models.Model):
+    """検索用転置インデックス（ユーザー別の文字unigram/bigram → ノート。search_index で更新）"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    notebook = models.ForeignKey(Notebook, on_delete=models.CASCADE, related_name='search_postings')
+    token = models.CharField(max_length=2, verbose_name="トークン")
+    
+    class Meta:
+        verbose_name = "検索インデックス"
+        verbose_name_plural = "検索インデックス"
+        constraints = [
+            models.UniqueConstraint(fields=['notebook', 'token'], name='searchposting_notebook_token_uniq'),
+        ]
+        indexes = [
+            # トークンからノートを引く（インデックスのみで完結するよう notebook まで含める）
+            models.Index(fields=['user', 'token', 'notebook'], name='searchposting_lookup_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.token} → {self.notebook_id}"
 
 
 class Entry(models.Model):
@@ -103,6 +295,10 @@ class Entry(models.Model):
     ai_content_type = models.CharField(max_length=50, blank=True, verbose_name="AI推定コンテンツタイプ")
     ai_sentiment = models.CharField(max_length=20, blank=True, verbose_name="AI感情分析")
     ai_analysis_score = models.IntegerField(default=0, verbose_name="AI分析スコア")
+    ai_content_hash = models.CharField(max_length=64, blank=True, verbose_name="AI分析対象ハッシュ")
+    ai_analyzer_version = models.CharField(max_length=40, blank=True, verbose_name="AI分析バージョン")
+    ai_partial = models.JSONField(default=dict, blank=True, verbose_name="AI部分集計")
+    ai_last_analyzed = models.DateTimeField(null=True, blank=True, verbose_name="AI最終分析日時")
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -114,15 +310,54 @@ class Entry(models.Model):
         ordering = ['-created_at']
         verbose_name = "エントリー"
         verbose_name_plural = "エントリー"
+        indexes = [
+            models.Index(fields=['updated_at'], name='entry_updated_idx'),
+            # 検索のスコア計算で読むノートごとの最新エントリー
+            models.Index(fields=['notebook', '-created_at'], name='entry_notebook_recent_idx'),
+            # run_ai_analysis --stale の対象選択用
+            models.Index(fields=['ai_last_analyzed'], name='entry_ai_analyzed_idx'),
+            models.Index(fields=['ai_analyzer_version'], name='entry_ai_version_idx'),
+            models.Index(fields=['id'], condition=models.Q(updated_at__gt=models.F('ai_last_analyzed')),
+                         name='entry_ai_stale_idx'),
+        ]
     
     def __str__(self):
         return f"{self.notebook.title} - {self.title or 'エントリー'}"
     
-    def update_ai_analysis(self, analysis_data):
+    def get_ai_content_hash(self):
+        """AI分析対象（タイトル＋本文）のハッシュ"""
+        from .utils import generate_content_hash
+        
+        return generate_content_hash(self.title, self.content)
+    
+    def is_ai_analysis_current(self, content_hash):
+        """保存済みAI分析が同じ内容・同じ分析器バージョンのものか"""
+        from .ai_analyzer import get_analyzer_version
+        
+        return (bool(self.ai_content_hash) and self.ai_content_hash == content_hash and
+                self.ai_analyzer_version == get_analyzer_version())
+    
+    def update_ai_analysis(self, analysis_data, content_hash='', partial=None):
         """AI分析結果を更新"""
+        self.save(update_fields=self.apply_ai_analysis(analysis_data, content_hash, partial))
+    
+    def apply_ai_analysis(self, analysis_data, content_hash='', partial=None):
+        """AI分析結果をインスタンスに反映（保存はしない。更新フィールド名を返す）"""
+        from django.utils import timezone
+        from .ai_analyzer import get_analyzer_version
+        
+        update_fields = ['ai_analysis_cache', 'ai_analysis_score', 'ai_sentiment', 'ai_content_type',
+                         'ai_content_hash', 'ai_analyzer_version', 'ai_last_analyzed']
+        if partial is not None:
+            self.ai_partial = partial
+            update_fields.append('ai_partial')
+        
         self.ai_analysis_cache = analysis_data
         self.ai_analysis_score = analysis_data.get('analysis_score', 0)
         self.ai_sentiment = analysis_data.get('sentiment', 'neutral')
+        self.ai_last_analyzed = timezone.now()
+        self.ai_content_hash = content_hash
+        self.ai_analyzer_version = get_analyzer_version()
         
         # コンテンツタイプの推定
         suggested_tags = analysis_data.get('suggested_tags', [])
@@ -139,5 +374,110 @@ class Entry(models.Model):
         else:
             self.ai_content_type = 'general_memo'
         
-        self.save(update_fields=['ai_analysis_cache', 'ai_analysis_score', 
-                               'ai_sentiment', 'ai_content_type'])
\ No newline at end of file
+        return update_fields
+
+
+class AnalysisJob(models.Model):
+    """AI分析・特徴の更新ジョブ（DBキュー。analysis_worker コマンドで処理）"""
+    TARGET_TYPES = [
+        ('notebook', 'ノートブック'),
+        ('entry', 'エントリー'),
+        ('features', '特徴・関連ノート表'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', '待機中'),
+        ('running', '実行中'),
+        ('done', '完了'),
+        ('dead', '失敗（再試行上限）'),
+    ]
+    
+    target_type = models.CharField(max_length=20, choices=TARGET_TYPES, verbose_name="対象種別")
+    object_id = models.IntegerField(verbose_name="対象ID")
+    content_hash = models.CharField(max_length=64, blank=True, verbose_name="投入時の内容ハッシュ")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="状態")
+    
+    # 再試行
+    attempts = models.IntegerField(default=0, verbose_name="試行回数")
+    max_attempts = models.IntegerField(default=5, verbose_name="最大試行回数")
+    run_after = models.DateTimeField(verbose_name="実行可能日時")
+    last_error = models.TextField(blank=True, verbose_name="最終エラー")
+    
+    # ワーカーによる取得
+    locked_by = models.CharField(max_length=100, blank=True, verbose_name="処理ワーカー")
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name="取得日時")
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['run_after', 'id']
+        verbose_name = "AI分析ジョブ"
+        verbose_name_plural = "AI分析ジョブ"
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='analysisjob_queue_idx'),
+            models.Index(fields=['target_type', 'object_id', 'status'], name='analysisjob_target_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_target_type_display()} #{self.object_id} ({self.get_status_display()})"
+
+
+class SavedSearch(models.Model):
+    """保存した検索条件（新しいエントリーが一致したら SavedSearchMatch に記録。照合は percolator）"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='saved_searches')
+    name = models.CharField(max_length=200, blank=True, verbose_name="名前")
+    query = models.CharField(max_length=200, verbose_name="検索条件")
+    clauses = models.JSONField(default=list, verbose_name="コンパイル済み条件")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "保存した検索"
+        verbose_name_plural = "保存した検索"
+    
+    def __str__(self):
+        return self.name or self.query
+    
+    def save(self, *args, **kwargs):
+        from .percolator import compile_query
+        self.clauses = compile_query(self.query)
+        super().save(*args, **kwargs)
+
+
+class SavedSearchMatch(models.Model):
+    """保存した検索条件に一致したエントリー（ダッシュボードの通知）"""
+    saved_search = models.ForeignKey(SavedSearch, on_delete=models.CASCADE, related_name='matches')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    entry = models.ForeignKey(Entry, on_delete=models.CASCADE, related_name='+')
+    notebook = models.ForeignKey(Notebook, on_delete=models.CASCADE, related_name='+')
+    is_read = models.BooleanField(default=False, verbose_name="既読")
+    matched_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-matched_at', '-id']
+        verbose_name = "保存した検索の一致"
+        verbose_name_plural = "保存した検索の一致"
+        constraints = [
+            models.UniqueConstraint(fields=['saved_search', 'entry'], name='savedsearchmatch_search_entry_uniq'),
+        ]
+        indexes = [
+            # ダッシュボードで未読の一致を新しい順に引く
+            models.Index(fields=['user', 'is_read', '-matched_at'], name='savedsearchmatch_inbox_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.saved_search_id} ← {self.entry_id}"
+
+
+class UserDataVersion(models.Model):
+    """ユーザーデータの版数（結果キャッシュのキーに含める。全プロセスで共有するためDBに保存）"""
+    key = models.CharField(max_length=50, unique=True, verbose_name="ユーザーID（公開ノート全体は public）")
+    version = models.BigIntegerField(verbose_name="版数")
+    
+    class Meta:
+        verbose_name = "ユーザーデータの版数"
+        verbose_name_plural = "ユーザーデータの版数"
+    
+    def __str__(self):
+        return f"{self.key}: {self.version}"
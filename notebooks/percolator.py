@@ -0,0 +1,136 @@
+# notebooks/percolator.py
+"""
+保存した検索の逆引き照合（パーコレーション）
+保存した検索条件の語をユーザー別の多パターン照合オートマトンにまとめ、書き込まれたエントリーのテキストを
+1回走査して、語を共有する検索条件だけを評価する。一致は SavedSearchMatch に記録する
+照合器はプロセス内に保持し、DB 上の保存した検索の件数・最終更新日時が変わったら作り直す
+（他のプロセスでの追加・変更・削除も次の照合で反映される）
+"""
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Tuple
+
+from django.db.models import Count, Max
+
+from .autocomplete import normalize_term
+from .keyword_automaton import KeywordAutomaton
+from .models import SavedSearch, SavedSearchMatch
+
+# プロセス内に保持する照合器のユーザー数（超えたら最も使われていないものから破棄）
+PERCOLATOR_MAX_USERS = 32
+
+# 検索条件の演算子（正規化後の表記）
+OR_OPERATORS = ('or', '|')
+AND_OPERATORS = ('and', '&')
+NOT_OPERATORS = ('not',)
+
+
+def compile_query(query: str) -> List[List[List[str]]]:
+    """
+    検索条件を OR で区切った節の一覧 [[必須語, ...], [除外語, ...]] に変換
+    
+    空白区切りの語は AND（AND は省略可）。NOT または先頭の - を付けた語は除外語。
+    必須語のない節は照合の手がかりがないため含めない。
+    """
+    clauses = []
+    required, excluded = [], []
+    negate = False
+    for token in normalize_term(query).split():
+        if token in OR_OPERATORS:
+            if required:
+                clauses.append([required, excluded])
+            required, excluded, negate = [], [], False
+        elif token in AND_OPERATORS:
+            continue
+        elif token in NOT_OPERATORS:
+            negate = True
+        else:
+            if token.startswith('-') and len(token) > 1:
+                negate, token = True, token[1:]
+            (excluded if negate else required).append(token)
+            negate = False
+    
+    if required:
+        clauses.append([required, excluded])
+    return clauses
+
+
+class Percolator:
+    """ユーザーの保存した検索の照合器（必須語 → 検索条件のオートマトン）"""
+    
+    def __init__(self, saved_searches: Iterable[Tuple[int, list]]):
+        self.clauses = {pk: clauses for pk, clauses in saved_searches if clauses}
+        self.automaton = KeywordAutomaton(
+            (term, pk)
+            for pk, clauses in self.clauses.items()
+            for required, _ in clauses
+            for term in required
+        )
+    
+    def match(self, text: str) -> List[int]:
+        """テキストが一致する保存した検索のID（必須語が1つも現れない検索条件は評価しない）"""
+        text = normalize_term(text)
+        found = set()
+        candidates = set()
+        for _, keyword_index in self.automaton.iter_matches(text):
+            found.add(self.automaton.keywords[keyword_index])
+            candidates.update(self.automaton.payloads[keyword_index])
+        
+        return sorted(
+            pk for pk in candidates
+            if any(
+                found.issuperset(required) and not any(term in text for term in excluded)
+                for required, excluded in self.clauses[pk]
+            )
+        )
+
+
+_percolators: 'OrderedDict[int, Tuple[tuple, Percolator]]' = OrderedDict()
+_lock = threading.Lock()
+
+
+def _saved_search_version(user_id: int) -> tuple:
+    """保存した検索の版数（件数と最終更新日時。削除は件数、追加・変更は更新日時で変わる）"""
+    version = SavedSearch.objects.filter(user_id=user_id).aggregate(count=Count('pk'), latest=Max('updated_at'))
+    return version['count'], version['latest']
+
+
+def get_percolator(user_id: int) -> Percolator:
+    """ユーザーの照合器（保存した検索が変わっていなければプロセス内のものを再利用）"""
+    version = _saved_search_version(user_id)
+    with _lock:
+        cached = _percolators.get(user_id)
+        if cached and cached[0] == version:
+            _percolators.move_to_end(user_id)
+            return cached[1]
+    
+    percolator = Percolator(SavedSearch.objects.filter(user_id=user_id).values_list('pk', 'clauses'))
+    with _lock:
+        _percolators[user_id] = (version, percolator)
+        _percolators.move_to_end(user_id)
+        while len(_percolators) > PERCOLATOR_MAX_USERS:
+            _percolators.popitem(last=False)
+    return percolator
+
+
+def percolate_entry(entry) -> int:
+    """
+    エントリーを所有者の保存した検索と照合し、一致を記録。一致した検索条件の数を返す
+    
+    照合対象はエントリーのタイトル・本文と、所属ノートのタイトル・企業名・銘柄コード。
+    """
+    notebook = entry.notebook
+    percolator = get_percolator(notebook.user_id)
+    if not percolator.clauses:
+        return 0
+    
+    text = '\n'.join(filter(None, [
+        entry.title, entry.content, notebook.title, notebook.company_name, notebook.stock_code,
+    ]))
+    matches = [
+        SavedSearchMatch(saved_search_id=pk, user_id=notebook.user_id, entry_id=entry.pk, notebook_id=notebook.pk)
+        for pk in percolator.match(text)
+    ]
+    # 再保存で同じ検索条件に一致した場合は既存の記録を残す
+    SavedSearchMatch.objects.bulk_create(matches, ignore_conflicts=True)
+    return len(matches)
@@ -0,0 +1,153 @@
+# notebooks/profiling.py
+"""
+AI分析・検索処理の段階別計測（プロセス内ヒストグラム）
+settings.AI_PROFILING_ENABLED または enable() で有効化する。無効時はフラグ判定のみで計測しない
+"""
+import functools
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Dict
+
+# ヒストグラムの区切り（ミリ秒）
+BUCKET_BOUNDS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+def _configured_enabled() -> bool:
+    """設定による有効/無効"""
+    try:
+        from django.conf import settings
+        return bool(getattr(settings, 'AI_PROFILING_ENABLED', False))
+    except Exception:
+        return False
+
+
+_enabled = _configured_enabled()
+_lock = threading.Lock()
+_stages: Dict[str, 'StageStats'] = {}
+_NULL_STAGE = nullcontext()
+
+
+class StageStats:
+    """1段階分の集計（呼び出し回数・合計・最小・最大・ヒストグラム）"""
+    
+    __slots__ = ('count', 'total_ms', 'min_ms', 'max_ms', 'buckets')
+    
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+    
+    def add(self, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.min_ms = elapsed_ms if self.min_ms is None else min(self.min_ms, elapsed_ms)
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        
+        for i, bound in enumerate(BUCKET_BOUNDS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+    
+    def percentile(self, ratio: float) -> float:
+        """ヒストグラムからのパーセンタイル推定（該当区間の上限値）"""
+        threshold = self.count * ratio
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= threshold:
+                return BUCKET_BOUNDS_MS[i] if i < len(BUCKET_BOUNDS_MS) else self.max_ms
+        return self.max_ms
+    
+    def as_dict(self) -> Dict[str, Any]:
+        labels = [f'<={bound}ms' for bound in BUCKET_BOUNDS_MS] + [f'>{BUCKET_BOUNDS_MS[-1]}ms']
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0,
+            'min_ms': round(self.min_ms or 0, 3),
+            'max_ms': round(self.max_ms, 3),
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'histogram': {label: count for label, count in zip(labels, self.buckets) if count},
+        }
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable():
+    """計測の有効化"""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """計測の無効化"""
+    global _enabled
+    _enabled = False
+
+
+def record(name: str, elapsed_ms: float):
+    """計測値の記録"""
+    with _lock:
+        stats = _stages.get(name)
+        if stats is None:
+            stats = _stages[name] = StageStats()
+        stats.add(elapsed_ms)
+
+
+class _StageTimer:
+    """with 文用の計測区間"""
+    
+    __slots__ = ('name', 'start')
+    
+    def __init__(self, name: str):
+        self.name = name
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        record(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+def stage(name: str):
+    """計測区間（with stage('analyzer.rule_matching'): ...）"""
+    return _StageTimer(name) if _enabled else _NULL_STAGE
+
+
+def profiled(name: str):
+    """関数・メソッド単位の計測デコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorator
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    """段階別の集計結果（合計時間の降順）"""
+    with _lock:
+        items = [(name, stats.as_dict()) for name, stats in _stages.items()]
+    return dict(sorted(items, key=lambda item: item[1]['total_ms'], reverse=True))
+
+
+def reset_stats():
+    """集計結果の破棄"""
+    with _lock:
+        _stages.clear()
@@ -0,0 +1,205 @@
+# notebooks/relevance.py
+"""
+検索結果の関連度スコア（BM25）
+候補ノート集合の文書×語の疎行列を作り、BM25 を行列演算でまとめて計算する
+"""
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# NumPy / SciPy のインポート（利用できない場合は同じ計算を Python で行う）
+VECTORIZED_SCORING = False
+try:
+    import numpy as np
+    from scipy import sparse
+    VECTORIZED_SCORING = True
+except ImportError:
+    np = None
+    sparse = None
+
+# BM25 のパラメータ（語の出現回数の飽和・文書長の正規化の強さ）
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def query_term_weights(query: str, keywords) -> Dict[str, float]:
+    """
+    検索語ごとの重み（拡張キーワードは1、クエリ全体の一致は2を加算）
+    
+    keywords に {語: 重み} を渡すとその重みを使う（クエリ拡張の重み付き拡張語）。
+    """
+    weights = {}
+    for keyword in keywords:
+        weight = keywords[keyword] if isinstance(keywords, dict) else 1.0
+        keyword = keyword.lower().strip()
+        if keyword:
+            weights[keyword] = max(weights.get(keyword, 0.0), weight)
+    
+    query = query.lower().strip()
+    if query:
+        weights[query] = weights.get(query, 0.0) + 2.0
+    return weights
+
+
+def term_frequency_matrix(texts: Sequence[str], terms: Sequence[str]):
+    """
+    語の出現回数（部分一致）の疎行列（文書×語、CSR 形式）。texts は小文字化済みであること
+    
+    出現回数は語×文書ごとの str.count（走査自体は C 実装）で数える。
+    どの文書にも現れない語（拡張語に多い）は連結テキストの1回の走査で判定して文書ごとの走査を省く。
+    """
+    corpus = '\x00'.join(texts)
+    rows, cols, data = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+    for col, term in enumerate(terms):
+        if term not in corpus:
+            continue
+        counts = np.fromiter((text.count(term) for text in texts), dtype=np.float64, count=len(texts))
+        hits = np.flatnonzero(counts)
+        rows.append(hits)
+        cols.append(np.full(len(hits), col))
+        data.append(counts[hits])
+    
+    return sparse.csr_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(len(texts), len(terms))
+    )
+
+
+def bm25_scores(texts: Sequence[str], term_weights: Dict[str, float]) -> List[float]:
+    """
+    各文書の BM25 スコア（最大値を1とした相対値）
+    
+    texts は小文字化済みであること。IDF・平均文書長は渡された文書集合から求める。
+    """
+    if not texts or not term_weights:
+        return [0.0] * len(texts)
+    if not VECTORIZED_SCORING:
+        return _bm25_scores_python(texts, term_weights)
+    
+    terms = list(term_weights)
+    tf = term_frequency_matrix(texts, terms)
+    
+    doc_count = len(texts)
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.float64, count=doc_count)
+    avg_length = lengths.mean() or 1.0
+    
+    doc_freq = np.bincount(tf.indices, minlength=len(terms))
+    idf = np.log1p((doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+    
+    # 非ゼロ要素ごとに tf の飽和と文書長の正規化を適用し、語の重み×IDF との積で文書ごとに合計
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+    row_of = np.repeat(np.arange(doc_count), np.diff(tf.indptr))
+    tf.data = tf.data * (BM25_K1 + 1) / (tf.data + length_norm[row_of])
+    scores = tf @ (idf * np.fromiter(term_weights.values(), dtype=np.float64, count=len(terms)))
+    
+    peak = scores.max()
+    return (scores / peak).tolist() if peak > 0 else [0.0] * doc_count
+
+
+def _bm25_scores_python(texts: Sequence[str], term_weights: Dict[str, float]) -> List[float]:
+    """bm25_scores と同じ計算（NumPy / SciPy がない環境用）"""
+    doc_count = len(texts)
+    avg_length = (sum(len(text) for text in texts) / doc_count) or 1.0
+    counts = {term: [text.count(term) for text in texts] for term in term_weights}
+    
+    scores = [0.0] * doc_count
+    for term, weight in term_weights.items():
+        doc_freq = sum(1 for count in counts[term] if count)
+        idf = math.log1p((doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+        for i, count in enumerate(counts[term]):
+            if count:
+                length_norm = BM25_K1 * (1 - BM25_B + BM25_B * len(texts[i]) / avg_length)
+                scores[i] += weight * idf * count * (BM25_K1 + 1) / (count + length_norm)
+    
+    peak = max(scores)
+    return [score / peak for score in scores] if peak > 0 else scores
+
+
+def feature_matrix(feature_sets: Sequence):
+    """特徴集合の有無を表す疎行列（文書×特徴、CSR 形式）と特徴の列番号"""
+    vocabulary = {}
+    indptr, indices = [0], []
+    for features in feature_sets:
+        indices.extend(vocabulary.setdefault(feature, len(vocabulary)) for feature in set(features))
+        indptr.append(len(indices))
+    
+    matrix = sparse.csr_matrix(
+        (np.ones(len(indices)), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+        shape=(len(feature_sets), len(vocabulary))
+    )
+    return matrix, vocabulary
+
+
+def weighted_jaccard_scores(target: Dict[str, Sequence], candidates: Sequence[Dict[str, Sequence]],
+                            weights: Dict[str, float]) -> List[float]:
+    """
+    対象と各候補の特徴グループごとの Jaccard 係数の重み付き和
+    
+    グループごとに候補全体の特徴行列を作り、対象との共通数を1回の行列×ベクトル積で求める。
+    """
+    if not candidates:
+        return []
+    if not VECTORIZED_SCORING:
+        return _weighted_jaccard_scores_python(target, candidates, weights)
+    
+    scores = np.zeros(len(candidates))
+    for group, weight in weights.items():
+        matrix, vocabulary = feature_matrix([candidate[group] for candidate in candidates])
+        target_features = set(target[group])
+        
+        target_vector = np.zeros(len(vocabulary))
+        target_vector[[vocabulary[feature] for feature in target_features if feature in vocabulary]] = 1.0
+        
+        common = matrix @ target_vector
+        union = np.diff(matrix.indptr) + len(target_features) - common
+        scores += weight * common / np.maximum(union, 1)
+    return scores.tolist()
+
+
+def _weighted_jaccard_scores_python(target, candidates, weights) -> List[float]:
+    """weighted_jaccard_scores と同じ計算（NumPy / SciPy がない環境用）"""
+    scores = [0.0] * len(candidates)
+    for group, weight in weights.items():
+        target_features = set(target[group])
+        for i, candidate in enumerate(candidates):
+            features = set(candidate[group])
+            scores[i] += weight * len(features & target_features) / max(len(features | target_features), 1)
+    return scores
+
+
+def pairwise_top_k(features: Sequence[Dict[str, Sequence]], weights: Dict[str, float], k: int,
+                   threshold: float = 0.0, blocking_keys: Optional[Sequence[Sequence]] = None,
+                   block_size: int = 200) -> List[List[Tuple[int, float]]]:
+    """
+    各文書について weighted_jaccard_scores の上位 k 件 [(文書番号, 類似度)]（類似度順、自分自身を除く）
+    
+    行ブロックごとに全ペアの類似度を行列演算で求める。blocking_keys（LSH バケットなど）を渡すと、
+    キーを1つも共有しないペアは対象外にする。NumPy / SciPy が必要（VECTORIZED_SCORING）。
+    """
+    groups = []
+    for group, weight in weights.items():
+        matrix, _ = feature_matrix([item[group] for item in features])
+        groups.append((weight, matrix, matrix.T.tocsc(), np.diff(matrix.indptr)))
+    if blocking_keys is not None:
+        blocking, _ = feature_matrix(blocking_keys)
+        blocking_t = blocking.T.tocsc()
+    
+    results = []
+    for start in range(0, len(features), block_size):
+        stop = min(start + block_size, len(features))
+        scores = np.zeros((stop - start, len(features)))
+        for weight, matrix, transposed, sizes in groups:
+            common = (matrix[start:stop] @ transposed).toarray()
+            union = sizes[start:stop, None] + sizes[None, :] - common
+            scores += weight * common / np.maximum(union, 1)
+        
+        if blocking_keys is not None:
+            scores[(blocking[start:stop] @ blocking_t).toarray() == 0] = 0.0
+        scores[np.arange(stop - start), np.arange(start, stop)] = 0.0
+        
+        for row in scores:
+            top = np.argpartition(-row, k)[:k] if len(row) > k else np.arange(len(row))
+            results.append(sorted(
+                ((int(index), float(row[index])) for index in top if row[index] > threshold),
+                key=lambda item: (-item[1], item[0])
+            ))
+    return results
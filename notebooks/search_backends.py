@@ -0,0 +1,294 @@
+# notebooks/search_backends.py
+"""
+ノート検索バックエンド
+SQLite では FTS5（trigram）の仮想テーブルを bm25 順で引き、それ以外は転置インデックス（search_index）を使う
+エントリー単位の検索も同様に、FTS5 ではエントリーごとの仮想テーブルを引く
+"""
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Q
+
+from .models import Notebook, Entry
+from .relevance import bm25_scores
+from .search_index import (
+    SEARCH_COLUMNS, ENTRY_SEARCH_COLUMNS, load_search_fields, load_entry_search_fields, search_notebook_ids
+)
+
+FTS_TABLE = 'notebooks_search_fts'
+ENTRY_FTS_TABLE = 'notebooks_entry_search_fts'
+
+# bm25 の列の重み（SEARCH_COLUMNS と同じ順。タイトル・企業名・タグを本文より重視）
+FTS_WEIGHTS = (10.0, 8.0, 5.0, 2.0, 1.0)
+
+# エントリー検索の bm25 の列の重み（ENTRY_SEARCH_COLUMNS と同じ順）
+ENTRY_FTS_WEIGHTS = (5.0, 1.0, 3.0)
+
+# trigram トークナイザーで照合できる最短の語長（これより短い語は転置インデックスで引く）
+MIN_TRIGRAM_LENGTH = 3
+
+# 一覧・インクリメンタル検索の対象列（タイトル・企業名・銘柄コード・タグ）
+# title 列にはサブタイトルも含むため、以前の icontains 検索と違いサブタイトルにも一致する
+LIST_SEARCH_COLUMNS = ('title', 'company', 'tags')
+
+
+class PostingsSearchBackend:
+    """転置インデックスによる検索（更新日時順）"""
+    
+    name = 'postings'
+    
+    def search(self, user_id: int, terms: Sequence[str], limit: Optional[int] = None,
+               columns: Optional[Sequence[str]] = None) -> List[int]:
+        """いずれかの語を含むノートIDを順位順に返す（columns 指定時はその列のみ対象）"""
+        terms = [term.strip() for term in terms if term and term.strip()]
+        notebook_ids = search_notebook_ids(terms, user_id)
+        if columns and notebook_ids:
+            notebook_ids = self._filter_columns(notebook_ids, terms, columns)
+        
+        ordered = Notebook.objects.filter(pk__in=notebook_ids).values_list('pk', flat=True)
+        return list(ordered[:limit] if limit else ordered)
+    
+    @staticmethod
+    def _filter_columns(notebook_ids: Iterable[int], terms: Sequence[str], columns: Sequence[str]) -> set:
+        """指定列に語を含むノートのみに絞り込み"""
+        terms = [term.lower() for term in terms]
+        matched = set()
+        for pk, fields in load_search_fields(notebook_ids).items():
+            text = '\n'.join(fields[column] for column in columns).lower()
+            if any(term in text for term in terms):
+                matched.add(pk)
+        return matched
+    
+    def search_entries(self, user_id: int, terms: Sequence[str],
+                       limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        いずれかの語を含むエントリーを [(エントリーID, 関連度)] で順位順に返す
+        
+        関連度は最上位を1とした相対値。ポスティングで候補ノートを絞り、
+        そのエントリーのうち語を含むものだけを DB で取り出して BM25 で順位付けする。
+        """
+        terms = [term.strip() for term in terms if term and term.strip()]
+        notebook_ids = search_notebook_ids(terms, user_id)
+        if not notebook_ids:
+            return []
+        
+        condition = Q()
+        for term in terms:
+            condition |= Q(title__icontains=term) | Q(content__icontains=term) | Q(tags__name__icontains=term)
+        rows = list(Entry.objects.filter(
+            condition, notebook_id__in=notebook_ids
+        ).order_by().distinct().values_list('pk', 'title', 'content'))
+        
+        scores = bm25_scores(
+            [f'{title}\n{content}'.lower() for _, title, content in rows],
+            {term.lower(): 1.0 for term in terms}
+        )
+        ranked = sorted(
+            ((row[0], score) for row, score in zip(rows, scores)), key=lambda item: (-item[1], -item[0])
+        )
+        return ranked[:limit] if limit else ranked
+    
+    def sync(self, notebook_ids: Sequence[int], fields: Dict[int, Dict[str, Any]],
+             entry_ids: Optional[Sequence[int]] = None):
+        """索引の更新（ポスティングは search_index.index_notebooks が更新する。entry_ids 指定時はそのエントリーのみ）"""
+    
+    def remove(self, notebook_ids: Sequence[int]):
+        """削除されたノートの索引除去（ポスティングは外部キーで連鎖削除される）"""
+    
+    def remove_entries(self, entry_ids: Sequence[int]):
+        """削除されたエントリーの索引除去"""
+    
+    def ensure_schema(self, using: str = 'default'):
+        """索引テーブルの作成"""
+
+
+class FTS5SearchBackend(PostingsSearchBackend):
+    """SQLite FTS5（trigram）による全文検索。順位付けは bm25() で DB 内で行う"""
+    
+    name = 'fts5'
+    
+    def ensure_schema(self, using: str = 'default'):
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"{', '.join(SEARCH_COLUMNS)}, user_id UNINDEXED, tokenize='trigram')"
+            )
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {ENTRY_FTS_TABLE} USING fts5("
+                f"{', '.join(ENTRY_SEARCH_COLUMNS)}, user_id UNINDEXED, notebook_id UNINDEXED, tokenize='trigram')"
+            )
+    
+    def sync(self, notebook_ids, fields, entry_ids=None):
+        rows = [
+            [pk] + [values[column] for column in SEARCH_COLUMNS] + [values['user_id']]
+            for pk, values in fields.items()
+        ]
+        placeholders = ', '.join(['%s'] * (len(SEARCH_COLUMNS) + 2))
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in notebook_ids])
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)}, user_id) VALUES ({placeholders})",
+                rows
+            )
+        self._sync_entries(notebook_ids, entry_ids)
+    
+    def _sync_entries(self, notebook_ids, entry_ids=None):
+        """
+        ノートに属するエントリーの索引の更新（削除されたエントリーは remove_entries で除去する）
+        
+        entry_ids 指定時はそのエントリーの行のみ書き直す（エントリーの保存ごとにノートの全エントリーを書き直さない）。
+        """
+        if entry_ids is not None and not entry_ids:
+            return
+        entries = load_entry_search_fields(notebook_ids, entry_ids)
+        rows = [
+            [pk] + [values[column] for column in ENTRY_SEARCH_COLUMNS] + [values['user_id'], values['notebook_id']]
+            for pk, values in entries.items()
+        ]
+        placeholders = ', '.join(['%s'] * (len(ENTRY_SEARCH_COLUMNS) + 3))
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {ENTRY_FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in entries])
+            cursor.executemany(
+                f"INSERT INTO {ENTRY_FTS_TABLE} (rowid, {', '.join(ENTRY_SEARCH_COLUMNS)}, user_id, notebook_id) "
+                f"VALUES ({placeholders})",
+                rows
+            )
+    
+    def remove(self, notebook_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in notebook_ids])
+    
+    def remove_entries(self, entry_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {ENTRY_FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in entry_ids])
+    
+    def search(self, user_id, terms, limit=None, columns=None):
+        terms = [term.strip() for term in terms if term and term.strip()]
+        long_terms = [term for term in terms if len(term) >= MIN_TRIGRAM_LENGTH]
+        short_terms = [term for term in terms if len(term) < MIN_TRIGRAM_LENGTH]
+        
+        ranked = []
+        if long_terms:
+            try:
+                ranked = self._match(user_id, long_terms, limit, columns)
+            except Exception as e:
+                print(f"全文検索エラー: {str(e)}")
+                return super().search(user_id, terms, limit, columns)
+        
+        # trigram で引けない短い語は転置インデックスで補い、順位付きの結果の後ろに続ける
+        if short_terms and not (limit and len(ranked) >= limit):
+            seen = set(ranked)
+            extra_limit = limit + len(ranked) if limit else None
+            ranked += [pk for pk in super().search(user_id, short_terms, extra_limit, columns) if pk not in seen]
+        
+        return ranked[:limit] if limit else ranked
+    
+    def _match(self, user_id, terms, limit, columns) -> List[int]:
+        """FTS5 の MATCH と bm25 による順位付き検索"""
+        match = ' OR '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        if columns:
+            match = '{%s} : (%s)' % (' '.join(columns), match)
+        
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        sql = (
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND user_id = %s '
+            f'ORDER BY bm25({FTS_TABLE}, {weights})'
+        )
+        params = [match, user_id]
+        if limit:
+            sql += ' LIMIT %s'
+            params.append(limit)
+        
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+    
+    def search_entries(self, user_id, terms, limit=None):
+        terms = [term.strip() for term in terms if term and term.strip()]
+        long_terms = [term for term in terms if len(term) >= MIN_TRIGRAM_LENGTH]
+        short_terms = [term for term in terms if len(term) < MIN_TRIGRAM_LENGTH]
+        
+        ranked = []
+        if long_terms:
+            try:
+                ranked = self._match_entries(user_id, long_terms, limit)
+            except Exception as e:
+                print(f"エントリー全文検索エラー: {str(e)}")
+                return super().search_entries(user_id, terms, limit)
+        
+        # 短い語のみに一致するエントリーは、順位付きの結果の後ろに最下位の関連度以下で続ける
+        if short_terms and not (limit and len(ranked) >= limit):
+            seen = {pk for pk, _ in ranked}
+            scale = ranked[-1][1] if ranked else 1.0
+            extra_limit = limit + len(ranked) if limit else None
+            ranked += [
+                (pk, score * scale)
+                for pk, score in super().search_entries(user_id, short_terms, extra_limit) if pk not in seen
+            ]
+        
+        return ranked[:limit] if limit else ranked
+    
+    def _match_entries(self, user_id, terms, limit) -> List[Tuple[int, float]]:
+        """エントリー索引の MATCH と bm25 による順位付き検索（bm25 は最上位を1とした相対値に変換）"""
+        match = ' OR '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        weights = ', '.join(str(weight) for weight in ENTRY_FTS_WEIGHTS)
+        sql = (
+            f'SELECT rowid, bm25({ENTRY_FTS_TABLE}, {weights}) AS rank FROM {ENTRY_FTS_TABLE} '
+            f'WHERE {ENTRY_FTS_TABLE} MATCH %s AND user_id = %s ORDER BY rank, rowid DESC'
+        )
+        params = [match, user_id]
+        if limit:
+            sql += ' LIMIT %s'
+            params.append(limit)
+        
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        
+        # bm25() は一致度が高いほど小さい（負の）値
+        best = rows[0][1] if rows else 0.0
+        return [(pk, rank / best if best < 0 else 1.0) for pk, rank in rows]
+
+
+def fts5_available() -> bool:
+    """SQLite で FTS5 の trigram トークナイザーが使えるか"""
+    if connection.vendor != 'sqlite':
+        return False
+    try:
+        probe = sqlite3.connect(':memory:')
+        probe.execute("CREATE VIRTUAL TABLE probe USING fts5(text, tokenize='trigram')")
+        probe.close()
+        return True
+    except sqlite3.Error:
+        return False
+
+
+_backend = None
+
+
+def get_search_backend() -> PostingsSearchBackend:
+    """設定（SEARCH_BACKEND = 'fts5' / 'postings'）に応じた検索バックエンド。未設定時は自動選択"""
+    global _backend
+    if _backend is None:
+        name = getattr(settings, 'SEARCH_BACKEND', None) or ('fts5' if fts5_available() else 'postings')
+        _backend = FTS5SearchBackend() if name == 'fts5' else PostingsSearchBackend()
+    return _backend
+
+
+def search_notebooks(user_id: int, query: str, limit: Optional[int] = None,
+                     columns: Optional[Sequence[str]] = LIST_SEARCH_COLUMNS) -> List[Notebook]:
+    """検索語に一致するノートを順位順で取得（タグは先読み）"""
+    return load_notebooks(get_search_backend().search(user_id, [query], limit, columns))
+
+
+def load_notebooks(notebook_ids: Sequence[int]) -> List[Notebook]:
+    """ID順を保ったノートの読み込み"""
+    notebooks = Notebook.objects.prefetch_related('tags').in_bulk(notebook_ids)
+    return [notebooks[pk] for pk in notebook_ids if pk in notebooks]
+
+
+def create_search_schema(using='default', **kwargs):
+    """post_migrate で索引テーブルを作成"""
+    get_search_backend().ensure_schema(using)
@@ -0,0 +1,257 @@
+# notebooks/search_index.py
+"""
+検索用転置インデックス（ユーザー別の文字unigram/bigramポスティング）
+ノート・エントリー・タグの保存時にシグナルで差分更新し、部分一致検索の候補をインデックスから引く
+"""
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from taggit.models import TaggedItem
+
+from .models import Notebook, Entry, SearchPosting
+
+# 検索対象のフィールド（部分更新時に再索引が必要かの判定にも使う）
+NOTEBOOK_INDEX_FIELDS = ('title', 'subtitle', 'company_name', 'stock_code', 'investment_goal', 'risk_factors')
+ENTRY_INDEX_FIELDS = ('title', 'content')
+
+# 検索対象テキストの列（全文検索テーブルの列順）
+SEARCH_COLUMNS = ('title', 'company', 'tags', 'body', 'entries')
+
+# エントリー単位の検索対象テキストの列（エントリー検索テーブルの列順）
+ENTRY_SEARCH_COLUMNS = ('title', 'content', 'tags')
+
+# 1回の IN 句・一括作成で扱う件数
+BATCH_SIZE = 500
+
+
+def tokenize(text: str) -> Set[str]:
+    """文字unigram・bigramへの分割（小文字化。改行をまたぐbigramは作らない）"""
+    tokens = set()
+    for line in text.lower().split('\n'):
+        tokens.update(line)
+        tokens.update(line[i:i + 2] for i in range(len(line) - 1))
+    return tokens
+
+
+def query_tokens(keyword: str) -> Set[str]:
+    """キーワードを含む文書が必ず持つトークン"""
+    keyword = keyword.lower()
+    if len(keyword) == 1:
+        return {keyword}
+    return {keyword[i:i + 2] for i in range(len(keyword) - 1)}
+
+
+def _chunks(items: List, size: int = BATCH_SIZE) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def load_search_fields(notebook_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    ノートごとの検索対象テキストを列別に読み込み
+    
+    {notebook_id: {'user_id': ..., 'title': ..., 'company': ..., 'tags': ..., 'body': ..., 'entries': ...}}
+    エントリーのタグは entries 列に含める。
+    """
+    notebook_ids = list(notebook_ids)
+    parts = {}
+    owners = {}
+    entry_notebooks = {}
+    
+    for chunk in _chunks(notebook_ids):
+        notebooks = Notebook.objects.filter(pk__in=chunk).order_by()
+        for pk, user_id, title, subtitle, company_name, stock_code, investment_goal, risk_factors in (
+            notebooks.values_list('pk', 'user_id', *NOTEBOOK_INDEX_FIELDS)
+        ):
+            owners[pk] = user_id
+            parts[pk] = {
+                'title': [title, subtitle],
+                'company': [company_name, stock_code],
+                'tags': [],
+                'body': [investment_goal, risk_factors],
+                'entries': [],
+            }
+        
+        entries = Entry.objects.filter(notebook_id__in=chunk).order_by()
+        for entry_pk, notebook_id, title, content in entries.values_list('pk', 'notebook_id', *ENTRY_INDEX_FIELDS):
+            entry_notebooks[entry_pk] = notebook_id
+            parts[notebook_id]['entries'] += [title, content]
+        
+        for object_id, name in TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Notebook), object_id__in=chunk
+        ).values_list('object_id', 'tag__name'):
+            parts[object_id]['tags'].append(name)
+        
+        for object_id, name in TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Entry), object_id__in=entries.values('pk')
+        ).values_list('object_id', 'tag__name'):
+            parts[entry_notebooks[object_id]]['entries'].append(name)
+    
+    return {
+        pk: dict({column: '\n'.join(filter(None, values)) for column, values in columns.items()}, user_id=owners[pk])
+        for pk, columns in parts.items()
+    }
+
+
+def load_entry_search_fields(notebook_ids: Iterable[int],
+                             entry_ids: Optional[Iterable[int]] = None) -> Dict[int, Dict[str, Any]]:
+    """
+    ノートに属するエントリーごとの検索対象テキストを列別に読み込み（entry_ids 指定時はそのエントリーのみ）
+    
+    {entry_id: {'notebook_id': ..., 'user_id': ..., 'title': ..., 'content': ..., 'tags': ...}}
+    """
+    entries = {}
+    for chunk in _chunks(list(notebook_ids)):
+        chunk_entries = Entry.objects.filter(notebook_id__in=chunk)
+        if entry_ids is not None:
+            chunk_entries = chunk_entries.filter(pk__in=list(entry_ids))
+        for entry_pk, notebook_id, user_id, title, content in chunk_entries.order_by().values_list('pk', 'notebook_id', 'notebook__user_id', *ENTRY_INDEX_FIELDS):
+            entries[entry_pk] = {
+                'notebook_id': notebook_id,
+                'user_id': user_id,
+                'title': title or '',
+                'content': content or '',
+                'tags': [],
+            }
+        
+        for object_id, name in TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Entry), object_id__in=chunk_entries.values('pk')
+        ).values_list('object_id', 'tag__name'):
+            if object_id in entries:
+                entries[object_id]['tags'].append(name)
+    
+    for fields in entries.values():
+        fields['tags'] = '\n'.join(fields['tags'])
+    return entries
+
+
+def _document(fields: Dict[str, Any]) -> Tuple[int, str]:
+    """列別テキストを (user_id, 全列を結合したテキスト) に変換"""
+    return fields['user_id'], '\n'.join(filter(None, (fields[column] for column in SEARCH_COLUMNS)))
+
+
+def load_search_documents(notebook_ids: Iterable[int]) -> Dict[int, Tuple[int, str]]:
+    """ノートごとの検索対象テキスト {notebook_id: (user_id, text)}（ノート・エントリー・両方のタグ）"""
+    return {pk: _document(fields) for pk, fields in load_search_fields(notebook_ids).items()}
+
+
+def index_notebooks(notebook_ids: Iterable[int], entry_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    ノートの再索引。追加・削除したポスティング数を返す
+    
+    ポスティングは現在の内容との差分のみ書き込み、全文検索バックエンドの索引も合わせて更新する。
+    entry_ids 指定時は、エントリー単位の索引はそのエントリーのみ更新する（エントリーの保存時）。
+    """
+    from .search_backends import get_search_backend
+    
+    backend = get_search_backend()
+    notebook_ids = sorted(set(notebook_ids))
+    changed = 0
+    
+    for chunk in _chunks(notebook_ids):
+        fields = load_search_fields(chunk)
+        documents = {pk: _document(values) for pk, values in fields.items()}
+        backend.sync(chunk, fields, entry_ids)
+        
+        current = defaultdict(dict)
+        for posting_pk, notebook_id, user_id, token in SearchPosting.objects.filter(
+            notebook_id__in=chunk
+        ).values_list('pk', 'notebook_id', 'user_id', 'token'):
+            current[notebook_id][token] = (posting_pk, user_id)
+        
+        removed = []
+        added = []
+        for notebook_id in chunk:
+            user_id, text = documents.get(notebook_id, (None, ''))
+            tokens = tokenize(text) if user_id else set()
+            existing = current.get(notebook_id, {})
+            
+            for token, (posting_pk, posting_user_id) in existing.items():
+                if token not in tokens or posting_user_id != user_id:
+                    removed.append(posting_pk)
+            added += [
+                (user_id, notebook_id, token)
+                for token in tokens
+                if token not in existing or existing[token][1] != user_id
+            ]
+        
+        if not removed and not added:
+            continue
+        
+        with transaction.atomic():
+            for pks in _chunks(removed):
+                SearchPosting.objects.filter(pk__in=pks).delete()
+            _insert_postings(added)
+        changed += len(removed) + len(added)
+    
+    return changed
+
+
+def _insert_postings(rows: List[Tuple[int, int, str]]):
+    """ポスティングの一括追加（件数が多いためモデルを介さず executemany で書き込む）"""
+    if not rows:
+        return
+    table = connection.ops.quote_name(SearchPosting._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {table} (user_id, notebook_id, token) VALUES (%s, %s, %s)', rows)
+
+
+def index_notebook(notebook_id: int, entry_ids: Optional[Iterable[int]] = None) -> int:
+    """ノート1件の再索引"""
+    return index_notebooks([notebook_id], entry_ids)
+
+
+def covering_terms(terms: Iterable[str]) -> List[str]:
+    """
+    部分一致の OR 検索で同じ結果になる最小の語の一覧（他の語を含む語を除く。順序は保つ）
+    
+    例: ['配当', '高配当'] → ['配当']（'高配当' を含む文書は必ず '配当' も含む）
+    """
+    terms = list(dict.fromkeys(term.strip().lower() for term in terms if term and term.strip()))
+    return [
+        term for term in terms
+        if not any(other != term and other in term for other in terms)
+    ]
+
+
+def search_notebook_ids(keywords: Iterable[str], user_id: int) -> Set[int]:
+    """
+    いずれかのキーワードを部分一致で含むノートID
+    
+    ポスティングで候補を絞り、bigramの並びが一致しない候補のみ本文で確認する。
+    """
+    keyword_tokens = {}
+    for keyword in keywords:
+        tokens = query_tokens(keyword.strip())
+        if tokens:
+            keyword_tokens[keyword.strip().lower()] = tokens
+    if not keyword_tokens:
+        return set()
+    
+    all_tokens = sorted(set().union(*keyword_tokens.values()))
+    notebook_tokens = defaultdict(set)
+    for tokens in _chunks(all_tokens):
+        for notebook_id, token in SearchPosting.objects.filter(
+            user_id=user_id, token__in=tokens
+        ).values_list('notebook_id', 'token'):
+            notebook_tokens[notebook_id].add(token)
+    
+    matched = set()
+    unverified = defaultdict(list)
+    for notebook_id, found in notebook_tokens.items():
+        candidates = [keyword for keyword, tokens in keyword_tokens.items() if tokens <= found]
+        # 2文字以下はトークン一致＝部分一致
+        if any(len(keyword) <= 2 for keyword in candidates):
+            matched.add(notebook_id)
+        elif candidates:
+            unverified[notebook_id] = candidates
+    
+    if unverified:
+        for notebook_id, (_, text) in load_search_documents(unverified).items():
+            text = text.lower()
+            if any(keyword in text for keyword in unverified[notebook_id]):
+                matched.add(notebook_id)
+    
+    return matched
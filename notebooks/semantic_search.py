@@ -4,11 +4,154 @@
 """
 import re
 import json
-from typing import Dict, List, Any, Optional
+import base64
+import heapq
+from bisect import bisect_right
+from typing import Dict, List, Any, Optional, Tuple
 from collections import Counter
-from django.db.models import Q
-from .models import Notebook, Entry
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Count, Exists, F, Min, OuterRef, Q, QuerySet, Window
+from django.db.models.functions import RowNumber
+from taggit.models import TaggedItem
+from .models import Notebook, Entry, NotebookFeatures, NotebookLSHBucket, RelatedNotebook
 from .ai_analyzer import StockAnalysisAI
+from .keyword_automaton import register_keywords, find_keyword_hits, find_keyword_payloads
+from .search_backends import get_search_backend
+from .search_index import covering_terms
+from .profiling import profiled
+from .jobs import enqueue_feature_refresh
+from .utils import USER_RESULT_CACHE_TIMEOUT, entry_urls, generate_user_cache_key
+from .templatetags.notebook_extras import ai_sentiment_label, ai_strategy_label
+from .relevance import (
+    VECTORIZED_SCORING, bm25_scores, pairwise_top_k, query_term_weights, weighted_jaccard_scores
+)
+from .minhash import feature_set, lsh_buckets, minhash_signature
+
+
+# セマンティックキーワードマッピング
+SEMANTIC_MAPPINGS = {
+    '高配当': ['配当', '利回り', 'dividend', '分配金', 'インカムゲイン'],
+    '成長株': ['成長', 'グロース', '拡大', '売上増', '利益増', 'growth'],
+    '割安株': ['バリュー', '割安', 'PER', 'PBR', '割り負け', 'value'],
+    '長期投資': ['長期', 'ホールド', '保有', '継続', 'long term'],
+    '短期取引': ['短期', 'トレード', 'デイトレ', 'スイング', 'short term'],
+    '決算分析': ['決算', '業績', 'earnings', '売上', '利益', '四半期'],
+    'テクニカル': ['チャート', 'technical', 'ローソク足', '移動平均', 'RSI'],
+    'ファンダメンタル': ['fundamental', 'ROE', 'ROA', '財務', 'バランスシート'],
+    'リスク管理': ['リスク', 'risk', '危険', '注意', '懸念', 'リスクヘッジ'],
+}
+
+# 業界関連キーワード
+INDUSTRY_KEYWORDS = {
+    '自動車': ['車', 'automotive', 'EV', '電気自動車', 'トヨタ', 'ホンダ'],
+    'IT': ['テクノロジー', 'tech', 'ソフトウェア', 'AI', 'クラウド', 'DX'],
+    '金融': ['銀行', 'bank', '証券', '保険', 'フィンテック', '投資'],
+    '不動産': ['REIT', '不動産', 'real estate', 'マンション', 'オフィス'],
+    '製造業': ['製造', 'manufacturing', '工場', '生産', '素材', '部品'],
+    '小売': ['retail', '小売', '販売', '店舗', 'EC', 'eコマース'],
+    'エネルギー': ['energy', 'エネルギー', '電力', 'ガス', '再生可能'],
+    'ヘルスケア': ['healthcare', '医療', '製薬', 'バイオ', '病院'],
+}
+
+# 全文に含めるエントリー数（最新のものから）
+FULL_TEXT_ENTRY_LIMIT = 10
+
+# エントリー検索のスニペットに含める一致箇所の前後の文字数
+ENTRY_SNIPPET_CONTEXT = 50
+
+# スコア計算時に1回で読み込むノート数と、読み込むフィールド
+SCORING_CHUNK_SIZE = 500
+
+# 1ページ目でキャッシュする上位の順位の件数（これより後のページはカーソルの位置からヒープで選び直す）
+SEARCH_RANKING_CACHE_SIZE = 200
+
+# 特徴・LSH バケットの一括作成の件数
+BULK_CREATE_BATCH_SIZE = 2000
+SCORING_FIELDS = (
+    'id', 'user_id', 'title', 'subtitle', 'company_name', 'investment_goal', 'risk_factors',
+    'updated_at', 'entry_count',
+)
+
+# タグファセットで返す件数（件数の多い順）
+FACET_TAG_LIMIT = 20
+
+# クエリ拡張の重み（クエリの語・グループの見出し語・同義語は辞書の並び順に逓減）と拡張語の上限
+QUERY_TERM_WEIGHT = 1.0
+EXPANSION_HEAD_WEIGHT = 0.8
+EXPANSION_SYNONYM_WEIGHT = 0.5
+EXPANSION_WEIGHT_DECAY = 0.05
+QUERY_EXPANSION_LIMIT = 8
+
+# 総合スコアの重み（関連度・新しさ）
+RELEVANCE_WEIGHT = 0.7
+FRESHNESS_WEIGHT = 0.3
+
+# 関連コンテンツの類似度（特徴グループごとの Jaccard 係数の重み）と最小類似度
+SIMILARITY_WEIGHTS = {
+    'tags': 0.3,
+    'keywords': 0.2,
+    'investment_style': 0.3,
+    'industry_features': 0.2,
+}
+MIN_SIMILARITY = 0.1
+
+# LSH で引く関連ノート候補の上限（一致したバンド数の多い順）
+LSH_MAX_CANDIDATES = 500
+
+# 一致したバンド数を集計するバケットのノート数の上限
+# 同じ特徴のノートが多いバケット（公開ノート全体など）は集計せず、新しいノートから候補に加える
+LSH_MAX_BUCKET_SIZE = 200
+
+# 関連ノート表に保存するノートごとの関連ノート数
+RELATED_NOTEBOOK_LIMIT = 10
+
+# 保存する特徴（キーワードは類似度に使う上位のみ）
+FEATURE_FIELDS = ('tags', 'keywords', 'industry_features', 'investment_style', 'sentiment')
+FEATURE_KEYWORD_LIMIT = 5
+
+# 投資スタイルパターン
+STYLE_PATTERNS = {
+    '高配当投資': ['配当', '利回り', 'dividend'],
+    '成長投資': ['成長', 'グロース', 'growth'],
+    'バリュー投資': ['バリュー', '割安', 'value'],
+    '長期投資': ['長期', 'ホールド', 'long'],
+    '短期投資': ['短期', 'トレード', 'short'],
+}
+
+# 辞書を共有オートマトンへ登録（同義語グループ・業界は見出し語自体も対象）
+register_keywords('semantic', (
+    (keyword, group) for group, synonyms in SEMANTIC_MAPPINGS.items() for keyword in synonyms
+))
+register_keywords('industry', (
+    (keyword, industry) for industry, keywords in INDUSTRY_KEYWORDS.items()
+    for keyword in [industry] + keywords
+))
+register_keywords('style', (
+    (pattern, style) for style, patterns in STYLE_PATTERNS.items() for pattern in patterns
+))
+
+
+def build_query_expansions() -> Dict[Tuple[str, str], List[Tuple[str, float]]]:
+    """辞書ヒット (名前空間, グループ) ごとの拡張語と重み（重みの大きい順）"""
+    expansions = {}
+    for namespace, groups in (('semantic', SEMANTIC_MAPPINGS), ('industry', INDUSTRY_KEYWORDS)):
+        for group, synonyms in groups.items():
+            weights = {group.lower(): EXPANSION_HEAD_WEIGHT}
+            for position, synonym in enumerate(synonyms):
+                weights.setdefault(
+                    synonym.lower(), max(EXPANSION_SYNONYM_WEIGHT - EXPANSION_WEIGHT_DECAY * position, 0.1)
+                )
+            expansions[(namespace, group)] = sorted(weights.items(), key=lambda item: -item[1])
+    return expansions
+
+
+# クエリ拡張表（モジュール読み込み時に1回だけ作成）
+QUERY_EXPANSIONS = build_query_expansions()
 
 
 class SemanticSearchEngine:
@@ -17,99 +160,512 @@ class SemanticSearchEngine:
     def __init__(self):
         self.analyzer = StockAnalysisAI()
         
-        # セマンティックキーワードマッピング
-        self.semantic_mappings = {
-            '高配当': ['配当', '利回り', 'dividend', '分配金', 'インカムゲイン'],
-            '成長株': ['成長', 'グロース', '拡大', '売上増', '利益増', 'growth'],
-            '割安株': ['バリュー', '割安', 'PER', 'PBR', '割り負け', 'value'],
-            '長期投資': ['長期', 'ホールド', '保有', '継続', 'long term'],
-            '短期取引': ['短期', 'トレード', 'デイトレ', 'スイング', 'short term'],
-            '決算分析': ['決算', '業績', 'earnings', '売上', '利益', '四半期'],
-            'テクニカル': ['チャート', 'technical', 'ローソク足', '移動平均', 'RSI'],
-            'ファンダメンタル': ['fundamental', 'ROE', 'ROA', '財務', 'バランスシート'],
-            'リスク管理': ['リスク', 'risk', '危険', '注意', '懸念', 'リスクヘッジ'],
-        }
-        
-        # 業界関連キーワード
-        self.industry_keywords = {
-            '自動車': ['車', 'automotive', 'EV', '電気自動車', 'トヨタ', 'ホンダ'],
-            'IT': ['テクノロジー', 'tech', 'ソフトウェア', 'AI', 'クラウド', 'DX'],
-            '金融': ['銀行', 'bank', '証券', '保険', 'フィンテック', '投資'],
-            '不動産': ['REIT', '不動産', 'real estate', 'マンション', 'オフィス'],
-            '製造業': ['製造', 'manufacturing', '工場', '生産', '素材', '部品'],
-            '小売': ['retail', '小売', '販売', '店舗', 'EC', 'eコマース'],
-            'エネルギー': ['energy', 'エネルギー', '電力', 'ガス', '再生可能'],
-            'ヘルスケア': ['healthcare', '医療', '製薬', 'バイオ', '病院'],
-        }
+        # 辞書はモジュールレベルで共有（照合は共有オートマトンで一括実行）
+        self.semantic_mappings = SEMANTIC_MAPPINGS
+        self.industry_keywords = INDUSTRY_KEYWORDS
+        self.style_patterns = STYLE_PATTERNS
     
     def semantic_search(self, query: str, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
         """セマンティック検索実行"""
+        return self.semantic_search_page(query, user_id, limit)['results']
+    
+    @profiled('search.semantic_search')
+    def semantic_search_page(self, query: str, user_id: int, limit: int = 10,
+                             cursor: Optional[str] = None, facets: bool = False) -> Dict[str, Any]:
+        """
+        セマンティック検索（カーソルによるページ送り）
+        
+        {'results': [...], 'next_cursor': 次ページのカーソル（最終ページは None）}
+        cursor には前ページの next_cursor を渡す（不正なカーソルは ValueError）。
+        上位 SEARCH_RANKING_CACHE_SIZE 件の順位（スコア, ノートID）はユーザーデータの版数ごとにキャッシュし、
+        その範囲のページはスコアを再計算せず、そのページのノートだけ読み込む。
+        新しさスコアはカーソルに含めた基準時刻で計算するため、再計算したページも順位が連続する。
+        facets=True の場合は一致したノート全体のファセット件数（count_facets）を 'facets' に含める。
+        """
+        after = decode_search_cursor(cursor) if cursor else None
         try:
             # クエリの正規化
             normalized_query = self._normalize_query(query)
             
-            # 拡張キーワード生成
-            expanded_keywords = self._expand_query_keywords(normalized_query)
+            # 拡張キーワード生成（重み付き）
+            expanded_keywords = self._expand_query_terms(normalized_query)
             
-            # 基本検索
-            basic_results = self._basic_search(expanded_keywords, user_id)
+            # 新しさスコアの基準時刻（カーソルに含め、どのページも同じ基準でスコアを計算する）
+            reference = after[2] if after else None
+            position = after[:2] if after else None
             
-            # セマンティックスコア計算
-            scored_results = self._calculate_semantic_scores(
-                basic_results, normalized_query, expanded_keywords
-            )
+            # 上位の順位は基準時刻とともにデータが更新されるまでキャッシュ
+            # （カーソルの位置を二分探索できるよう、符号を反転した (-スコア, -ノートID) の昇順で保持）
+            cache_key = generate_user_cache_key('semantic_ranking', user_id, normalized_query)
+            ranking = cache.get(cache_key)
+            keys = None
+            if ranking and reference in (None, ranking['reference']):
+                reference = ranking['reference']
+                start = bisect_right(ranking['order'], (-position[0], -position[1])) if position else 0
+                keys = [(-score, -pk) for score, pk in ranking['order'][start:start + limit + 1]]
+                if len(keys) <= limit and not ranking['complete']:
+                    keys = None  # キャッシュした範囲より後のページ
+            
+            # 基本検索（他の語を含む語は一致範囲を広げないため除いて1回で引く）
+            if keys is None or facets:
+                basic_results = self._basic_search(covering_terms(expanded_keywords), user_id)
+            
+            # セマンティックスコア計算（次ページの有無を判定するため1件多く選ぶ）
+            candidates = None
+            if keys is None:
+                if reference is None:
+                    reference = timezone.now().timestamp()
+                size = limit + 1 if position else max(limit + 1, SEARCH_RANKING_CACHE_SIZE)
+                keys, candidates = self._calculate_semantic_scores(
+                    basic_results, normalized_query, expanded_keywords, size, position, reference
+                )
+                if not position:
+                    cache.set(cache_key, {
+                        'reference': reference,
+                        'order': [(-score, -pk) for score, pk in keys],
+                        'complete': len(keys) < size,
+                    }, USER_RESULT_CACHE_TIMEOUT)
+                keys = keys[:limit + 1]
             
-            # 結果の並び替えと制限
-            return sorted(scored_results, key=lambda x: x['relevance_score'], reverse=True)[:limit]
+            next_cursor = None
+            if len(keys) > limit:
+                keys = keys[:limit]
+                next_cursor = encode_search_cursor(*keys[-1], reference)
+            results = self._build_search_results(keys, normalized_query, candidates)
+            page = {'results': results, 'next_cursor': next_cursor}
+            if facets:
+                page['facets'] = self.count_facets(basic_results)
+            return page
         except Exception as e:
             print(f"セマンティック検索エラー: {str(e)}")
-            return []
+            return {'results': [], 'next_cursor': None}
+    
+    @profiled('search.count_facets')
+    def count_facets(self, notebooks) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        ファセット件数（タグ・AI推定投資戦略・センチメント・エントリータイプ）
+        
+        {ファセット: [{'value': 値, 'label': 表示名, 'count': ノート数}, ...]}（件数の多い順）
+        ファセットごとに1回の集計クエリで数え、一致したノートは読み込まない。
+        センチメントはエントリータイプと同様に、エントリーのAI感情分析ごとのノート数を数える。
+        """
+        if not isinstance(notebooks, QuerySet):
+            notebooks = Notebook.objects.filter(pk__in=[notebook.pk for notebook in notebooks])
+        matches = notebooks.order_by().values('pk')
+        
+        tag_counts = TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Notebook), object_id__in=matches
+        ).values_list('tag__name').annotate(count=Count('object_id', distinct=True)).order_by('-count', 'tag__name')
+        strategy_counts = Notebook.objects.filter(pk__in=matches).exclude(ai_investment_strategy='').values_list(
+            'ai_investment_strategy'
+        ).annotate(count=Count('pk')).order_by('-count', 'ai_investment_strategy')
+        sentiment_counts = Entry.objects.filter(notebook_id__in=matches).exclude(ai_sentiment='').values_list(
+            'ai_sentiment'
+        ).annotate(count=Count('notebook_id', distinct=True)).order_by('-count', 'ai_sentiment')
+        entry_type_counts = Entry.objects.filter(notebook_id__in=matches).values_list(
+            'entry_type'
+        ).annotate(count=Count('notebook_id', distinct=True)).order_by('-count', 'entry_type')
+        
+        entry_type_labels = dict(Entry.ENTRY_TYPES)
+        return {
+            'tags': [
+                {'value': name, 'label': name, 'count': count} for name, count in tag_counts[:FACET_TAG_LIMIT]
+            ],
+            'investment_strategy': [
+                {'value': strategy, 'label': ai_strategy_label(strategy), 'count': count}
+                for strategy, count in strategy_counts
+            ],
+            'sentiment': [
+                {'value': sentiment, 'label': ai_sentiment_label(sentiment), 'count': count}
+                for sentiment, count in sentiment_counts
+            ],
+            'entry_type': [
+                {'value': entry_type, 'label': entry_type_labels.get(entry_type, entry_type), 'count': count}
+                for entry_type, count in entry_type_counts
+            ],
+        }
     
-    def find_related_content(self, notebook_id: int, user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
-        """関連コンテンツ推奨"""
+    @profiled('search.search_entries')
+    def search_entries(self, query: str, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        エントリー単位の検索
+        
+        エントリー索引から一致したエントリーを関連度順に返す（ノートあたりのエントリー数の制限なし）。
+        snippet_start はエントリー本文内のスニペットの開始位置、highlights はスニペット内の一致箇所 [開始, 終了)。
+        url はノート詳細の該当ページのエントリーへのアンカー。
+        """
         try:
-            from .models import Notebook
-            target_notebook = Notebook.objects.get(pk=notebook_id, user_id=user_id)
-        except Notebook.DoesNotExist:
+            normalized_query = self._normalize_query(query)
+            terms = [normalized_query] + self._expand_query_keywords(normalized_query)
+            ranked = get_search_backend().search_entries(user_id, covering_terms(terms), limit)
+            
+            entries = {
+                row[0]: row for row in Entry.objects.filter(
+                    pk__in=[pk for pk, _ in ranked], notebook__user_id=user_id
+                ).values_list('pk', 'notebook_id', 'notebook__title', 'title', 'content', 'entry_type', 'created_at')
+            }
+            urls = entry_urls((pk, row[1]) for pk, row in entries.items())
+            keywords = [term.lower() for term in terms if term]
+            
+            results = []
+            for pk, score in ranked:
+                if pk not in entries:
+                    continue
+                _, notebook_id, notebook_title, title, content, entry_type, created_at = entries[pk]
+                snippet, snippet_start, highlights = self._entry_snippet(content or '', keywords)
+                
+                results.append({
+                    'entry_id': pk,
+                    'notebook_id': notebook_id,
+                    'notebook_title': notebook_title,
+                    'title': title,
+                    'entry_type': entry_type,
+                    'relevance_score': score,
+                    'snippet': snippet,
+                    'snippet_start': snippet_start,
+                    'highlights': highlights,
+                    'created_at': created_at.isoformat(),
+                    'url': urls[pk],
+                })
+            return results
+        except Exception as e:
+            print(f"エントリー検索エラー: {str(e)}")
             return []
+    
+    def _entry_snippet(self, content: str, keywords: List[str]) -> Tuple[str, int, List[List[int]]]:
+        """
+        エントリー本文のスニペット (スニペット, 本文内の開始位置, スニペット内の一致箇所)
         
-        # ターゲットノートの特徴抽出
-        target_features = self._extract_notebook_features(target_notebook)
-        
-        # 他のノートとの類似度計算
-        candidate_notebooks = Notebook.objects.filter(
-            user_id=user_id
-        ).exclude(pk=notebook_id)
-        
-        similarity_scores = []
-        for notebook in candidate_notebooks:
-            candidate_features = self._extract_notebook_features(notebook)
-            similarity = self._calculate_similarity(target_features, candidate_features)
-            
-            if similarity > 0.1:  # 最小類似度閾値
-                similarity_scores.append({
-                    'notebook': notebook,
-                    'similarity_score': similarity,
-                    'matching_aspects': self._identify_matching_aspects(
-                        target_features, candidate_features
-                    )
-                })
+        最初の一致箇所の前後を切り出す。本文に一致しない場合（タイトル・タグのみ一致）は先頭から。
+        """
+        content_lower = content.lower()
+        matches = sorted(
+            (match.start(), match.end())
+            for keyword in set(keywords)
+            for match in re.finditer(re.escape(keyword), content_lower)
+        )
+        if not matches:
+            return content[:ENTRY_SNIPPET_CONTEXT * 2], 0, []
+        
+        start = max(0, matches[0][0] - ENTRY_SNIPPET_CONTEXT)
+        end = min(len(content), matches[0][1] + ENTRY_SNIPPET_CONTEXT)
+        
+        # 重なる一致箇所はまとめる
+        highlights = []
+        for match_start, match_end in matches:
+            if match_end > end:
+                break
+            if highlights and match_start - start <= highlights[-1][1]:
+                highlights[-1][1] = max(highlights[-1][1], match_end - start)
+            else:
+                highlights.append([match_start - start, match_end - start])
+        return content[start:end], start, highlights
+    
+    @profiled('search.find_related_content')
+    def find_related_content(self, notebook_id: int, user_id: int, limit: int = 5,
+                             include_public: bool = False) -> List[Dict[str, Any]]:
+        """
+        関連コンテンツ推奨
+        
+        自分のノートの範囲は関連ノート表から読む（未作成ならここで計算して保存）。
+        ノートの特徴が未作成の場合は作成をジョブに登録し、作成されるまでは空の結果を返す。
+        include_public=True の場合は他のユーザーの公開ノートも対象に、その場で計算する。
+        """
+        if include_public:
+            return self._find_related_on_demand(notebook_id, user_id, limit)
+        
+        related = self._load_related_notebooks(notebook_id, user_id, limit)
+        if related or NotebookFeatures.objects.filter(
+            notebook_id=notebook_id, notebook__user_id=user_id, related_refreshed_at__isnull=False
+        ).exists():
+            return related
+        
+        if Notebook.objects.filter(pk=notebook_id, user_id=user_id).exists():
+            if not NotebookFeatures.objects.filter(notebook_id=notebook_id).exists():
+                # 特徴が未作成（一括作成など）なら作成をジョブに登録し、読み込みでは特徴を計算しない
+                enqueue_feature_refresh(notebook_id)
+                return related
+            self.refresh_related_notebooks([notebook_id], reverse=False)
+            related = self._load_related_notebooks(notebook_id, user_id, limit)
+        return related
+    
+    def _load_related_notebooks(self, notebook_id: int, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        """関連ノート表からの読み込み（1クエリ）"""
+        rows = RelatedNotebook.objects.filter(
+            source_id=notebook_id, source__user_id=user_id
+        ).select_related('target', 'target__features')[:limit]
+        
+        return [{
+            'notebook_id': row.target_id,
+            'title': row.target.title,
+            'subtitle': row.target.subtitle,
+            'similarity_score': row.score,
+            'matching_aspects': row.aspects,
+            'tags': getattr(getattr(row.target, 'features', None), 'tags', []),
+            'updated_at': row.target.updated_at.isoformat(),
+            'url': row.target.get_absolute_url(),
+        } for row in rows]
+    
+    def _rank_related(self, notebook_id: int, user_id: int, include_public: bool = False):
+        """
+        LSH 候補の類似度計算
+        
+        (ターゲットノートの特徴, 最小類似度を超える候補の [(類似度, ノートID)]（類似度順）, 候補の特徴) を返す。
+        """
+        visible = Notebook.objects.filter(
+            Q(user_id=user_id) | Q(is_public=True) if include_public else Q(user_id=user_id)
+        )
+        
+        # ターゲットノートのバケットと、ノート数が上限を超えるか（上限の位置に行があるかを索引で確認）
+        buckets = list(NotebookLSHBucket.objects.filter(notebook_id=notebook_id).annotate(
+            crowded=Exists(NotebookLSHBucket.objects.filter(bucket=OuterRef('bucket')).order_by()[LSH_MAX_BUCKET_SIZE:])
+        ).values_list('bucket', 'crowded'))
+        crowded = [bucket for bucket, is_crowded in buckets if is_crowded]
         
-        # 類似度順でソート
-        similarity_scores.sort(key=lambda x: x['similarity_score'], reverse=True)
+        # 関連ノート候補（ターゲットノートといずれかのバンドのバケットが一致。一致したバンド数の多い順）
+        candidate_ids = [row['notebook_id'] for row in NotebookLSHBucket.objects.filter(
+            bucket__in=[bucket for bucket, is_crowded in buckets if not is_crowded], notebook__in=visible,
+        ).exclude(notebook_id=notebook_id).values('notebook_id').annotate(
+            matches=Count('pk')
+        ).order_by('-matches', 'notebook_id')[:LSH_MAX_CANDIDATES]]
+        
+        # 混雑したバケットは全件を集計せず、1つのバケットから新しいノートを残りの件数だけ加える
+        if crowded and len(candidate_ids) < LSH_MAX_CANDIDATES:
+            seen = set(candidate_ids)
+            candidate_ids += [pk for pk in NotebookLSHBucket.objects.filter(
+                bucket=crowded[0], notebook__in=visible
+            ).exclude(notebook_id__in=seen | {notebook_id}).order_by('-notebook_id').values_list(
+                'notebook_id', flat=True
+            )[:LSH_MAX_CANDIDATES - len(candidate_ids)]]
+        
+        features = self._load_notebook_features(candidate_ids + [notebook_id])
+        target_features = features.pop(notebook_id, None)
+        if target_features is None:
+            return None, [], {}
+        
+        # 候補との類似度計算
+        candidate_ids = [pk for pk in candidate_ids if pk in features]
+        similarities = weighted_jaccard_scores(
+            target_features, [features[pk] for pk in candidate_ids], SIMILARITY_WEIGHTS
+        )
+        ranked = sorted(
+            ((similarity, pk) for similarity, pk in zip(similarities, candidate_ids) if similarity > MIN_SIMILARITY),
+            key=lambda item: (-item[0], item[1])
+        )
+        return target_features, ranked, features
+    
+    def _find_related_on_demand(self, notebook_id: int, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        """自分のノートと公開ノートを対象にした関連コンテンツ推奨（関連ノート表を使わず計算）"""
+        if not Notebook.objects.filter(Q(user_id=user_id) | Q(is_public=True), pk=notebook_id).exists():
+            return []
+        
+        target_features, ranked, features = self._rank_related(int(notebook_id), user_id, include_public=True)
+        top = ranked[:limit]
+        notebooks = Notebook.objects.in_bulk([pk for _, pk in top])
         
         # 結果フォーマット（notebook_idをintとして返す）
         return [{
-            'notebook_id': item['notebook'].pk,  # intとして返す
-            'title': item['notebook'].title,
-            'subtitle': item['notebook'].subtitle,
-            'similarity_score': item['similarity_score'],
-            'matching_aspects': item['matching_aspects'],
-            'tags': [tag.name for tag in item['notebook'].tags.all()],
-            'updated_at': item['notebook'].updated_at.isoformat(),
-            'url': item['notebook'].get_absolute_url(),
-        } for item in similarity_scores[:limit]]
+            'notebook_id': pk,  # intとして返す
+            'title': notebooks[pk].title,
+            'subtitle': notebooks[pk].subtitle,
+            'similarity_score': similarity,
+            'matching_aspects': self._identify_matching_aspects(target_features, features[pk]),
+            'tags': features[pk]['tags'],
+            'updated_at': notebooks[pk].updated_at.isoformat(),
+            'url': notebooks[pk].get_absolute_url(),
+        } for similarity, pk in top if pk in notebooks]
+    
+    @profiled('search.refresh_related_notebooks')
+    def refresh_related_notebooks(self, notebook_ids, reverse: bool = True):
+        """
+        関連ノート表の更新（ノートの特徴の更新後に呼ぶ）
+        
+        対象ノートの行を計算し直す。reverse=True の場合は、対象ノートを関連ノートに持っていたノートの行も
+        計算し直し、対象ノートが新たに上位に入るノートにはその1行のみ追加する。
+        """
+        owners = dict(Notebook.objects.filter(pk__in=list(notebook_ids)).values_list('pk', 'user_id'))
+        reverse_ids = set()
+        if reverse:
+            reverse_ids = set(
+                RelatedNotebook.objects.filter(target_id__in=list(owners)).values_list('source_id', flat=True)
+            ) - owners.keys()
+        
+        additions = []
+        for notebook_id, user_id in owners.items():
+            target_features, ranked, features = self._rank_related(notebook_id, user_id)
+            rows = [
+                RelatedNotebook(
+                    source_id=notebook_id, target_id=pk, score=similarity,
+                    aspects=self._identify_matching_aspects(target_features, features[pk])
+                )
+                for similarity, pk in ranked[:RELATED_NOTEBOOK_LIMIT]
+            ]
+            with transaction.atomic():
+                RelatedNotebook.objects.filter(source_id=notebook_id).delete()
+                RelatedNotebook.objects.bulk_create(rows)
+            
+            if reverse:
+                additions += [
+                    RelatedNotebook(
+                        source_id=pk, target_id=notebook_id, score=similarity,
+                        aspects=self._identify_matching_aspects(features[pk], target_features)
+                    )
+                    for similarity, pk in ranked if pk not in reverse_ids and pk not in owners
+                ]
+        
+        NotebookFeatures.objects.filter(notebook_id__in=list(owners)).update(related_refreshed_at=timezone.now())
+        
+        if reverse_ids:
+            self.refresh_related_notebooks(reverse_ids, reverse=False)
+        if additions:
+            self._add_related_notebooks(additions)
+    
+    def _add_related_notebooks(self, additions: List[RelatedNotebook]):
+        """関連ノート表への行の追加（各ノートの上位に入る行のみ追加し、上限を超えた行は削除）"""
+        sources = [row.source_id for row in additions]
+        # 関連ノート表が未作成のノートは読み込み時にまとめて計算する
+        refreshed = set(NotebookFeatures.objects.filter(
+            notebook_id__in=sources, related_refreshed_at__isnull=False
+        ).values_list('notebook_id', flat=True))
+        current = {
+            row['source_id']: row for row in RelatedNotebook.objects.filter(
+                source_id__in=sources
+            ).values('source_id').annotate(count=Count('pk'), lowest=Min('score'))
+        }
+        additions = [
+            row for row in additions if row.source_id in refreshed and (
+                row.source_id not in current
+                or current[row.source_id]['count'] < RELATED_NOTEBOOK_LIMIT
+                or row.score > current[row.source_id]['lowest']
+            )
+        ]
+        if not additions:
+            return
+        
+        with transaction.atomic():
+            RelatedNotebook.objects.bulk_create(additions, ignore_conflicts=True)
+            overflow = RelatedNotebook.objects.filter(
+                source_id__in={row.source_id for row in additions}
+            ).annotate(rank=Window(
+                RowNumber(), partition_by=F('source_id'), order_by=[F('score').desc(), F('target_id')]
+            )).filter(rank__gt=RELATED_NOTEBOOK_LIMIT).values_list('pk', flat=True)
+            RelatedNotebook.objects.filter(pk__in=list(overflow)).delete()
+    
+    def invalidate_related_notebooks(self, notebook_ids):
+        """関連ノート表の対象ノートと逆方向の関連ノートの行を破棄（次の読み込み時に計算）"""
+        notebook_ids = list(notebook_ids)
+        sources = set(notebook_ids) | set(
+            RelatedNotebook.objects.filter(target_id__in=notebook_ids).values_list('source_id', flat=True)
+        )
+        with transaction.atomic():
+            RelatedNotebook.objects.filter(source_id__in=sources).delete()
+            NotebookFeatures.objects.filter(notebook_id__in=sources).update(related_refreshed_at=None)
+    
+    @profiled('search.rebuild_related_notebooks')
+    def rebuild_related_notebooks(self, notebooks: QuerySet) -> int:
+        """
+        関連ノート表の一括再構築（対象ノートの所有者ごと）。作成した行数を返す
+        
+        ユーザーの全ノートの組について、LSH バケットを共有する組の類似度を行列演算でまとめて計算する。
+        """
+        self._ensure_notebook_features(notebooks)
         
+        total = 0
+        for user_id in notebooks.order_by().values_list('user_id', flat=True).distinct():
+            notebook_ids = list(Notebook.objects.filter(user_id=user_id).order_by('pk').values_list('pk', flat=True))
+            if not VECTORIZED_SCORING:
+                self.refresh_related_notebooks(notebook_ids, reverse=False)
+                total += RelatedNotebook.objects.filter(source__user_id=user_id).count()
+                continue
+            
+            features = self._load_notebook_features(notebook_ids)
+            notebook_ids = [pk for pk in notebook_ids if pk in features]
+            buckets = {}
+            for notebook_id, bucket in NotebookLSHBucket.objects.filter(
+                notebook__user_id=user_id
+            ).values_list('notebook_id', 'bucket'):
+                buckets.setdefault(notebook_id, []).append(bucket)
+            
+            neighbours = pairwise_top_k(
+                [features[pk] for pk in notebook_ids], SIMILARITY_WEIGHTS, RELATED_NOTEBOOK_LIMIT,
+                MIN_SIMILARITY, [buckets.get(pk, []) for pk in notebook_ids]
+            )
+            rows = [
+                RelatedNotebook(
+                    source_id=source, target_id=notebook_ids[index], score=similarity,
+                    aspects=self._identify_matching_aspects(features[source], features[notebook_ids[index]])
+                )
+                for source, top in zip(notebook_ids, neighbours) for index, similarity in top
+            ]
+            
+            with transaction.atomic():
+                RelatedNotebook.objects.filter(source__user_id=user_id).delete()
+                RelatedNotebook.objects.bulk_create(rows, batch_size=BULK_CREATE_BATCH_SIZE)
+                NotebookFeatures.objects.filter(notebook__user_id=user_id).update(related_refreshed_at=timezone.now())
+            total += len(rows)
+        return total
+    
+    def _ensure_notebook_features(self, notebooks: QuerySet):
+        """特徴が未作成のノートの特徴を作成"""
+        missing = list(notebooks.filter(features__isnull=True).values_list('pk', flat=True))
+        if missing:
+            self.refresh_notebook_features(missing)
+    
+    def _load_notebook_features(self, notebook_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """保存済みのノート特徴の読み込み"""
+        return {
+            values[0]: dict(zip(FEATURE_FIELDS, values[1:]))
+            for values in NotebookFeatures.objects.filter(notebook_id__in=notebook_ids).values_list(
+                'notebook_id', *FEATURE_FIELDS
+            )
+        }
+    
+    @profiled('search.refresh_notebook_features')
+    def refresh_notebook_features(self, notebook_ids) -> Dict[int, Dict[str, Any]]:
+        """
+        関連コンテンツ推奨用の特徴を計算して保存（特徴の更新ジョブ・一括処理から呼ぶ）
+        
+        特徴の MinHash 署名と LSH バケットも合わせて更新する。
+        保存済みの特徴・署名と同じノートは書き込まず、特徴が変わったノートの {ノートID: 特徴} を返す。
+        """
+        notebook_ids = sorted(set(notebook_ids))
+        changed = {}
+        for start in range(0, len(notebook_ids), SCORING_CHUNK_SIZE):
+            chunk = notebook_ids[start:start + SCORING_CHUNK_SIZE]
+            tags = self._load_tag_names(chunk)
+            stored = {
+                values[0]: values[1:]
+                for values in NotebookFeatures.objects.filter(notebook_id__in=chunk).values_list(
+                    'notebook_id', *FEATURE_FIELDS, 'minhash'
+                )
+            }
+            rows = []
+            buckets = []
+            for notebook, entries in self._iter_scoring_data(Notebook.objects.filter(pk__in=chunk)):
+                extracted = self._extract_notebook_features(notebook, tags.get(notebook.pk, []), entries)
+                extracted['keywords'] = extracted['keywords'][:FEATURE_KEYWORD_LIMIT]
+                features = {field: extracted[field] for field in FEATURE_FIELDS}
+                
+                signature = minhash_signature(feature_set(extracted, SIMILARITY_WEIGHTS))
+                if stored.get(notebook.pk) == (*features.values(), signature):
+                    continue  # 特徴が変わっていない（LSH バケット・関連ノート表もそのまま）
+                changed[notebook.pk] = features
+                rows.append(NotebookFeatures(notebook_id=notebook.pk, minhash=signature, **features))
+                buckets += [
+                    NotebookLSHBucket(notebook_id=notebook.pk, bucket=bucket) for bucket in lsh_buckets(signature)
+                ]
+            
+            if not rows:
+                continue
+            refreshed = [row.notebook_id for row in rows]
+            with transaction.atomic():
+                NotebookFeatures.objects.filter(notebook_id__in=refreshed).delete()
+                NotebookLSHBucket.objects.filter(notebook_id__in=refreshed).delete()
+                NotebookFeatures.objects.bulk_create(rows)
+                NotebookLSHBucket.objects.bulk_create(buckets, batch_size=BULK_CREATE_BATCH_SIZE)
+        return changed
+    
+    @profiled('search.auto_categorize_content')
     def auto_categorize_content(self, content: str, title: str = "") -> Dict[str, Any]:
         """コンテンツ自動分類"""
         try:
@@ -151,100 +707,183 @@ class SemanticSearchEngine:
     
     def _normalize_query(self, query: str) -> str:
         """クエリ正規化"""
-        # 記号除去、小文字変換
-        normalized = re.sub(r'[^\w\s]', ' ', query.lower())
-        return ' '.join(normalized.split())
+        return normalize_query(query)
     
     def _expand_query_keywords(self, query: str) -> List[str]:
         """クエリキーワード拡張"""
-        keywords = set(query.split())
+        return list(self._expand_query_terms(query))
+    
+    @profiled('search.expand_query_keywords')
+    def _expand_query_terms(self, query: str) -> Dict[str, float]:
+        """
+        重み付きのクエリ拡張 {語: 重み}
         
-        # セマンティックマッピングによる拡張
-        for main_keyword, synonyms in self.semantic_mappings.items():
-            if any(keyword in query for keyword in synonyms):
-                keywords.add(main_keyword)
-                keywords.update(synonyms)
+        辞書（セマンティックマッピング・業界）のヒットを1回の走査で求め、拡張表から拡張語を引く。
+        クエリの語はすべて残し、拡張語は重みの大きい順に QUERY_EXPANSION_LIMIT 件まで。
+        """
+        terms = {word: QUERY_TERM_WEIGHT for word in query.lower().split()}
         
-        # 業界キーワード拡張
-        for industry, industry_keywords in self.industry_keywords.items():
-            if any(keyword in query for keyword in industry_keywords):
-                keywords.add(industry)
-                keywords.update(industry_keywords)
+        expansions = {}
+        for hit in find_keyword_hits(query.lower(), ('semantic', 'industry')):
+            for term, weight in QUERY_EXPANSIONS[hit]:
+                if term not in terms:
+                    expansions[term] = max(expansions.get(term, 0.0), weight)
         
-        return list(keywords)
+        terms.update(sorted(expansions.items(), key=lambda item: -item[1])[:QUERY_EXPANSION_LIMIT])
+        return terms
     
+    @profiled('search.basic_search')
     def _basic_search(self, keywords: List[str], user_id: int) -> List:
-        """基本検索実行"""
+        """基本検索実行（検索バックエンドで該当ノートを特定）"""
         try:
-            query_filter = Q()
-            
-            for keyword in keywords:
-                query_filter |= (
-                    Q(title__icontains=keyword) |
-                    Q(subtitle__icontains=keyword) |
-                    Q(company_name__icontains=keyword) |
-                    Q(stock_code__icontains=keyword) |
-                    Q(investment_goal__icontains=keyword) |
-                    Q(risk_factors__icontains=keyword) |
-                    Q(tags__name__icontains=keyword) |
-                    Q(entries__title__icontains=keyword) |
-                    Q(entries__content__icontains=keyword) |
-                    Q(entries__tags__name__icontains=keyword)
-                )
+            notebook_ids = get_search_backend().search(user_id, keywords)
             
             return Notebook.objects.filter(
-                user_id=user_id
-            ).filter(query_filter).distinct()
+                user_id=user_id, pk__in=notebook_ids
+            )
         except Exception as e:
             print(f"基本検索エラー: {str(e)}")
             return []
     
-    def _calculate_semantic_scores(self, notebooks: List, 
-                                 original_query: str, expanded_keywords: List[str]) -> List[Dict[str, Any]]:
-        """セマンティックスコア計算"""
-        scored_results = []
+    @profiled('search.calculate_semantic_scores')
+    def _calculate_semantic_scores(self, notebooks: List, original_query: str,
+                                   expanded_keywords: Dict[str, float], limit: int,
+                                   after: Optional[Tuple[float, int]] = None,
+                                   reference: Optional[float] = None) -> Tuple[List[Tuple[float, int]], Dict]:
+        """
+        セマンティックスコア計算（エントリーは候補をまとめて先読み）
+        
+        関連度は候補全体で BM25 をまとめて計算し、スコア上位 limit 件のみヒープで選ぶ。
+        after に (スコア, ノートID) を渡すと、その順位より後の候補のみ対象にする。
+        reference は新しさスコアの基準時刻（UNIX 時刻。省略時は現在時刻）。
+        (スコア順の (総合スコア, ノートID) 一覧, {ノートID: (ノート, 全文)}) を返す。
+        """
+        now = datetime.fromtimestamp(reference, dt_timezone.utc) if reference else timezone.now()
+        
+        # ノート全体のテキスト結合
+        candidates = [
+            (notebook, self._extract_full_text(notebook, entries))
+            for notebook, entries in self._iter_scoring_data(notebooks)
+        ]
         
-        for notebook in notebooks:
+        # 関連度スコア計算
+        relevance_scores = self._calculate_relevance_scores(
+            [full_text for _, full_text in candidates], original_query, expanded_keywords
+        )
+        
+        # 新しさスコア（関連度は最大1のため、新しさの高い順に見れば総合スコアの上限が決まる）
+        freshness_scores = [self._calculate_freshness_score(notebook, now) for notebook, _ in candidates]
+        order = sorted(range(len(candidates)), key=freshness_scores.__getitem__, reverse=True)
+        
+        # (総合スコア, ノートID) の大きい順に上位 limit 件をヒープで保持
+        heap = []
+        for index in order:
+            if len(heap) >= limit and heap[0][0] > (
+                RELEVANCE_WEIGHT + FRESHNESS_WEIGHT * freshness_scores[index], float('inf')
+            ):
+                break  # 以降の候補は上限スコアでも上位に入らない
+            
+            notebook = candidates[index][0]
             try:
-                # ノート全体のテキスト結合
-                full_text = self._extract_full_text(notebook)
-                
-                # 関連度スコア計算
-                relevance_score = self._calculate_relevance_score(
-                    full_text, original_query, expanded_keywords
-                )
-                
-                # 新しさスコア
-                freshness_score = self._calculate_freshness_score(notebook)
-                
                 # 総合スコア
-                final_score = (relevance_score * 0.7) + (freshness_score * 0.3)
+                final_score = relevance_scores[index] * RELEVANCE_WEIGHT + freshness_scores[index] * FRESHNESS_WEIGHT
+                key = (final_score, notebook.pk)
+                if after and key >= after:
+                    continue
                 
-                scored_results.append({
-                    'notebook_id': notebook.pk,  # intに変更
-                    'title': notebook.title,
-                    'subtitle': notebook.subtitle,
-                    'relevance_score': final_score,
-                    'content_preview': self._generate_content_preview(full_text, original_query),
-                    'tags': [tag.name for tag in notebook.tags.all()],
-                    'updated_at': notebook.updated_at.isoformat(),
-                    'url': notebook.get_absolute_url(),
-                    'entry_count': notebook.entry_count,
-                })
+                if len(heap) < limit:
+                    heapq.heappush(heap, (key, index))
+                elif key > heap[0][0]:
+                    heapq.heapreplace(heap, (key, index))
             except Exception as e:
                 print(f"スコア計算エラー: {str(e)}")
                 continue
         
-        return scored_results
+        heap.sort(reverse=True)
+        return [key for key, _ in heap], {key[1]: candidates[index] for key, index in heap}
+    
+    def _build_search_results(self, keys: List[Tuple[float, int]], original_query: str,
+                              candidates: Optional[Dict] = None) -> List[Dict[str, Any]]:
+        """
+        順位の一覧から結果を組み立て（candidates にないノートは全文をまとめて読み込む）
+        """
+        if candidates is None:
+            candidates = {
+                notebook.pk: (notebook, self._extract_full_text(notebook, entries))
+                for notebook, entries in self._iter_scoring_data(
+                    Notebook.objects.filter(pk__in=[pk for _, pk in keys])
+                )
+            }
+        
+        # タグは結果に残ったノートの分だけ1クエリで取得
+        tags = self._load_tag_names([pk for _, pk in keys])
+        
+        results = []
+        for final_score, pk in keys:
+            if pk not in candidates:
+                continue  # 順位の作成後に削除されたノート
+            notebook, full_text = candidates[pk]
+            results.append({
+                'notebook_id': notebook.pk,  # intに変更
+                'title': notebook.title,
+                'subtitle': notebook.subtitle,
+                'relevance_score': final_score,
+                'content_preview': self._generate_content_preview(full_text, original_query),
+                'tags': tags.get(notebook.pk, []),
+                'updated_at': notebook.updated_at.isoformat(),
+                'url': notebook.get_absolute_url(),
+                'entry_count': notebook.entry_count,
+            })
+        return results
+    
+    def _iter_scoring_data(self, notebooks):
+        """
+        スコア計算用に (ノート, 最新エントリーの (タイトル, 本文) 一覧) を列挙
+        
+        候補はチャンク単位で読み、エントリーはチャンクごとに1クエリでまとめて取得する。
+        """
+        if isinstance(notebooks, QuerySet):
+            notebooks = notebooks.only(*SCORING_FIELDS).iterator(chunk_size=SCORING_CHUNK_SIZE)
+        notebooks = iter(notebooks)
+        
+        while True:
+            chunk = list(islice(notebooks, SCORING_CHUNK_SIZE))
+            if not chunk:
+                return
+            notebook_ids = [notebook.pk for notebook in chunk]
+            
+            # ノートごとの最新エントリー（ウィンドウ関数で件数を絞る）
+            entries = {}
+            for notebook_id, title, content in Entry.objects.filter(notebook_id__in=notebook_ids).annotate(
+                recency=Window(RowNumber(), partition_by=F('notebook_id'), order_by=F('created_at').desc())
+            ).filter(recency__lte=FULL_TEXT_ENTRY_LIMIT).order_by('notebook_id', '-created_at').values_list(
+                'notebook_id', 'title', 'content'
+            ):
+                entries.setdefault(notebook_id, []).append((title, content))
+            
+            for notebook in chunk:
+                yield notebook, entries.get(notebook.pk, [])
+    
+    def _load_tag_names(self, notebook_ids: List[int]) -> Dict[int, List[str]]:
+        """ノートごとのタグ名（1クエリで取得）"""
+        tags = {}
+        for object_id, name in TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Notebook),
+            object_id__in=notebook_ids
+        ).values_list('object_id', 'tag__name'):
+            tags.setdefault(object_id, []).append(name)
+        return tags
     
-    def _extract_notebook_features(self, notebook) -> Dict[str, Any]:
-        """ノート特徴抽出"""
+    @profiled('search.extract_notebook_features')
+    def _extract_notebook_features(self, notebook, tags=None, entries=None) -> Dict[str, Any]:
+        """ノート特徴抽出（tags・entries を渡せば読み込まない）"""
         try:
             # タグ特徴
-            tags = [tag.name for tag in notebook.tags.all()]
+            if tags is None:
+                tags = [tag.name for tag in notebook.tags.all()]
             
             # テキスト特徴
-            full_text = self._extract_full_text(notebook)
+            full_text = self._extract_full_text(notebook, entries)
             analysis = self.analyzer.analyze_content(full_text, notebook.title)
             
             # 業界・セクター特徴
@@ -271,38 +910,6 @@ class SemanticSearchEngine:
                 'stock_mentions': [], 'entry_count': 0
             }
     
-    def _calculate_similarity(self, features1: Dict[str, Any], features2: Dict[str, Any]) -> float:
-        """特徴ベース類似度計算"""
-        try:
-            scores = []
-            
-            # タグ類似度
-            tags1, tags2 = set(features1['tags']), set(features2['tags'])
-            if tags1 or tags2:
-                tag_similarity = len(tags1 & tags2) / len(tags1 | tags2) if (tags1 | tags2) else 0
-                scores.append(tag_similarity * 0.3)
-            
-            # キーワード類似度
-            keywords1 = set(features1['keywords'][:5])
-            keywords2 = set(features2['keywords'][:5])
-            if keywords1 or keywords2:
-                keyword_similarity = len(keywords1 & keywords2) / max(len(keywords1 | keywords2), 1)
-                scores.append(keyword_similarity * 0.2)
-            
-            # 投資スタイル類似度
-            style1, style2 = features1['investment_style'], features2['investment_style']
-            style_similarity = len(set(style1) & set(style2)) / max(len(set(style1) | set(style2)), 1)
-            scores.append(style_similarity * 0.3)
-            
-            # 業界類似度
-            industry1, industry2 = features1['industry_features'], features2['industry_features']
-            industry_similarity = len(set(industry1) & set(industry2)) / max(len(set(industry1) | set(industry2)), 1)
-            scores.append(industry_similarity * 0.2)
-            
-            return sum(scores) if scores else 0.0
-        except Exception:
-            return 0.0
-    
     def _classify_investment_strategy(self, content: str, analysis: Dict[str, Any]) -> str:
         """投資戦略分類"""
         try:
@@ -448,8 +1055,9 @@ class SemanticSearchEngine:
         except Exception:
             return 0.0
     
-    def _extract_full_text(self, notebook) -> str:
-        """ノート全文抽出"""
+    @profiled('search.extract_full_text')
+    def _extract_full_text(self, notebook, entries=None) -> str:
+        """ノート全文抽出（entries に (タイトル, 本文) 一覧を渡せばエントリーを読み込まない）"""
         try:
             text_parts = [
                 notebook.title or '',
@@ -460,45 +1068,32 @@ class SemanticSearchEngine:
             ]
             
             # エントリーのテキスト追加
-            for entry in notebook.entries.all()[:10]:  # 最新10件
+            if entries is None:
+                entries = notebook.entries.values_list('title', 'content')[:FULL_TEXT_ENTRY_LIMIT]  # 最新10件
+            
+            for title, content in entries:
                 text_parts.extend([
-                    entry.title or '',
-                    entry.content or '',
+                    title or '',
+                    content or '',
                 ])
             
             return ' '.join(filter(None, text_parts))
         except Exception:
             return ''
     
-    def _calculate_relevance_score(self, text: str, query: str, keywords: List[str]) -> float:
-        """関連度スコア計算"""
+    @profiled('search.relevance_scoring')
+    def _calculate_relevance_scores(self, texts: List[str], query: str, keywords) -> List[float]:
+        """関連度スコア計算（候補全体の BM25。最上位を1とした相対値。keywords は語の一覧か {語: 重み}）"""
         try:
-            text_lower = text.lower()
-            query_lower = query.lower()
-            
-            # 完全一致スコア
-            exact_match_score = text_lower.count(query_lower) * 2
-            
-            # キーワードマッチスコア
-            keyword_score = sum(text_lower.count(keyword.lower()) for keyword in keywords)
-            
-            # 文字数による正規化
-            text_length = len(text)
-            if text_length > 0:
-                normalized_score = (exact_match_score + keyword_score) / (text_length / 1000)
-            else:
-                normalized_score = 0
-            
-            return min(normalized_score, 1.0)
-        except Exception:
-            return 0.0
+            return bm25_scores([text.lower() for text in texts], query_term_weights(query, keywords))
+        except Exception as e:
+            print(f"関連度計算エラー: {str(e)}")
+            return [0.0] * len(texts)
     
-    def _calculate_freshness_score(self, notebook) -> float:
-        """新しさスコア計算"""
+    def _calculate_freshness_score(self, notebook, now=None) -> float:
+        """新しさスコア計算（now は基準時刻。省略時は現在時刻）"""
         try:
-            from django.utils import timezone
-            
-            now = timezone.now()
+            now = now or timezone.now()
             days_ago = (now - notebook.updated_at).days
             
             if days_ago <= 7:
@@ -534,39 +1129,24 @@ class SemanticSearchEngine:
     def _extract_industry_features(self, text: str, tags: List[str]) -> List[str]:
         """業界特徴抽出"""
         try:
-            industries = []
-            text_lower = text.lower()
-            
-            for industry, keywords in self.industry_keywords.items():
-                if (industry.lower() in text_lower or 
-                    any(keyword.lower() in text_lower for keyword in keywords) or
-                    any(industry.lower() in tag.lower() for tag in tags)):
-                    industries.append(industry)
+            found = set(find_keyword_payloads(text.lower(), 'industry'))
             
-            return industries
+            return [
+                industry for industry in self.industry_keywords
+                if industry in found or any(industry.lower() in tag.lower() for tag in tags)
+            ]
         except Exception:
             return []
     
     def _extract_investment_style(self, text: str, tags: List[str]) -> List[str]:
         """投資スタイル特徴抽出"""
         try:
-            styles = []
-            text_lower = text.lower()
-            
-            style_patterns = {
-                '高配当投資': ['配当', '利回り', 'dividend'],
-                '成長投資': ['成長', 'グロース', 'growth'],
-                'バリュー投資': ['バリュー', '割安', 'value'],
-                '長期投資': ['長期', 'ホールド', 'long'],
-                '短期投資': ['短期', 'トレード', 'short'],
-            }
-            
-            for style, patterns in style_patterns.items():
-                if (any(pattern in text_lower for pattern in patterns) or
-                    any(style.lower() in tag.lower() for tag in tags)):
-                    styles.append(style)
+            found = set(find_keyword_payloads(text.lower(), 'style'))
             
-            return styles
+            return [
+                style for style in self.style_patterns
+                if style in found or any(style.lower() in tag.lower() for tag in tags)
+            ]
         except Exception:
             return []
     
@@ -596,4 +1176,40 @@ class SemanticSearchEngine:
             
             return matching_aspects
         except Exception:
-            return []
\ No newline at end of file
+            return []
+
+
+_search_engine = None
+
+
+def get_search_engine() -> SemanticSearchEngine:
+    """セマンティック検索エンジン（リクエスト・シグナル間で共有）"""
+    global _search_engine
+    if _search_engine is None:
+        _search_engine = SemanticSearchEngine()
+    return _search_engine
+
+
+def normalize_query(query: str) -> str:
+    """クエリ正規化（記号除去、小文字変換）"""
+    normalized = re.sub(r'[^\w\s]', ' ', query.lower())
+    return ' '.join(normalized.split())
+
+
+def encode_search_cursor(score: float, notebook_id: int, reference: float) -> str:
+    """検索結果のページ送り用カーソル（最後に返した結果のスコアとノートID、新しさスコアの基準時刻）"""
+    payload = json.dumps([score, notebook_id, reference], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int, Optional[float]]:
+    """カーソルの復元（不正な値は ValueError。基準時刻のない以前のカーソルは基準時刻 None）"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        score, notebook_id, *reference = json.loads(payload)
+        if len(reference) > 1:
+            raise ValueError
+        return float(score), int(notebook_id), float(reference[0]) if reference else None
+    except Exception:
+        raise ValueError('不正なカーソルです')
+
@@ -0,0 +1,213 @@
+# notebooks/signals.py
+"""
+モデルシグナルハンドラ
+"""
+from django.db.models.signals import post_delete, post_save, pre_delete, m2m_changed
+from django.dispatch import receiver
+from taggit.models import TaggedItem
+from .models import Notebook, Entry, RelatedNotebook
+from .search_index import NOTEBOOK_INDEX_FIELDS, ENTRY_INDEX_FIELDS, index_notebook
+from .search_backends import get_search_backend
+from .semantic_search import get_search_engine
+from .percolator import percolate_entry
+from .jobs import enqueue_feature_refresh
+from .utils import bump_user_data_version, PUBLIC_DATA_VERSION
+
+
+@receiver(post_delete, sender=Entry)
+def remove_entry_partial(sender, instance, origin=None, **kwargs):
+    """エントリー削除時にノートのAI部分集計から差し引く"""
+    # ノートごと削除される場合は不要
+    if isinstance(origin, Notebook) or getattr(origin, 'model', None) is Notebook:
+        return
+    if not instance.ai_partial:
+        return
+    
+    notebook = Notebook.objects.filter(pk=instance.notebook_id).first()
+    if notebook:
+        notebook.apply_entry_partial(instance.ai_partial, None)
+
+
+@receiver(post_save, sender=Notebook)
+def index_notebook_risk_factors(sender, instance, raw=False, update_fields=None, **kwargs):
+    """ノート保存時にリスク要因索引を更新"""
+    if raw:
+        return
+    # リスク要因を含まない部分更新（AI分析結果の保存など）では不要
+    if update_fields is not None and 'risk_factors' not in update_fields:
+        return
+    
+    try:
+        instance.refresh_risk_factor_index()
+    except Exception as e:
+        print(f"リスク要因索引エラー: {str(e)}")
+
+
+def _reindex_notebook(notebook_id, entry_ids=None):
+    """検索インデックスの更新（失敗しても保存処理は止めない。entry_ids はエントリー単位の索引の更新対象）"""
+    try:
+        index_notebook(notebook_id, entry_ids)
+    except Exception as e:
+        print(f"検索インデックス更新エラー: {str(e)}")
+
+
+@receiver(post_save, sender=Notebook)
+def index_notebook_for_search(sender, instance, raw=False, update_fields=None, **kwargs):
+    """ノート保存時に検索インデックスを更新"""
+    if raw:
+        return
+    # 検索対象を含まない部分更新（AI分析結果・エントリー数の保存など）では不要
+    if update_fields is not None and not set(update_fields) & set(NOTEBOOK_INDEX_FIELDS):
+        return
+    _reindex_notebook(instance.pk)
+
+
+@receiver(post_delete, sender=Notebook)
+def unindex_notebook_for_search(sender, instance, **kwargs):
+    """ノート削除時に全文検索の索引から除去"""
+    try:
+        get_search_backend().remove([instance.pk])
+    except Exception as e:
+        print(f"全文検索索引の除去エラー: {str(e)}")
+
+
+@receiver(post_save, sender=Entry)
+def index_entry_for_search(sender, instance, raw=False, update_fields=None, **kwargs):
+    """エントリー保存時に所属ノートの検索インデックスを更新（エントリー単位の索引はこのエントリーのみ）"""
+    if raw:
+        return
+    if update_fields is not None and not set(update_fields) & set(ENTRY_INDEX_FIELDS):
+        return
+    _reindex_notebook(instance.notebook_id, [instance.pk])
+
+
+@receiver(post_delete, sender=Entry)
+def unindex_entry_for_search(sender, instance, origin=None, **kwargs):
+    """エントリー削除時に所属ノートの検索インデックスを更新"""
+    # エントリー単位の索引はノートごと削除される場合も除去する
+    try:
+        get_search_backend().remove_entries([instance.pk])
+    except Exception as e:
+        print(f"エントリー検索索引の除去エラー: {str(e)}")
+    
+    # ノートごと削除される場合はポスティングも連鎖削除される
+    if isinstance(origin, Notebook) or getattr(origin, 'model', None) is Notebook:
+        return
+    _reindex_notebook(instance.notebook_id, [])
+
+
+@receiver(m2m_changed, sender=TaggedItem)
+def index_tags_for_search(sender, instance, action, reverse=False, **kwargs):
+    """タグの追加・削除時に検索インデックスを更新"""
+    if reverse or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, Notebook):
+        _reindex_notebook(instance.pk)
+    elif isinstance(instance, Entry):
+        _reindex_notebook(instance.notebook_id, [instance.pk])
+
+
+def _bump_owner_data_version(user_id, is_public):
+    """所有者（公開ノートなら公開ノート対象も）の結果キャッシュを無効化"""
+    bump_user_data_version(*([user_id, PUBLIC_DATA_VERSION] if is_public else [user_id]))
+
+
+@receiver(post_save, sender=Notebook)
+@receiver(post_delete, sender=Notebook)
+def bump_notebook_data_version(sender, instance, raw=False, **kwargs):
+    """ノートの書き込み時に所有者・公開ノート対象の結果キャッシュを無効化"""
+    # 公開設定の変更も含むため、公開ノート対象の結果は非公開ノートの書き込みでも無効化
+    if not raw:
+        bump_user_data_version(instance.user_id, PUBLIC_DATA_VERSION)
+
+
+@receiver(post_save, sender=Entry)
+@receiver(post_delete, sender=Entry)
+def bump_entry_data_version(sender, instance, raw=False, origin=None, **kwargs):
+    """エントリーの書き込み時に所有者の結果キャッシュを無効化"""
+    # ノートごと削除される場合はノート側で無効化される
+    if raw or isinstance(origin, Notebook) or getattr(origin, 'model', None) is Notebook:
+        return
+    owner = Notebook.objects.filter(pk=instance.notebook_id).values_list('user_id', 'is_public').first()
+    if owner:
+        _bump_owner_data_version(*owner)
+
+
+@receiver(m2m_changed, sender=TaggedItem)
+def bump_tag_data_version(sender, instance, action, reverse=False, **kwargs):
+    """タグの追加・削除時に所有者の結果キャッシュを無効化"""
+    if reverse or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, Notebook):
+        _bump_owner_data_version(instance.user_id, instance.is_public)
+    elif isinstance(instance, Entry):
+        bump_entry_data_version(Entry, instance)
+
+
+def _refresh_notebook_features(notebook_id):
+    """関連コンテンツ推奨用の特徴・関連ノート表の更新をジョブに登録（失敗しても保存処理は止めない）"""
+    try:
+        enqueue_feature_refresh(notebook_id)
+    except Exception as e:
+        print(f"特徴抽出エラー: {str(e)}")
+
+
+@receiver(post_save, sender=Notebook)
+def refresh_notebook_features(sender, instance, raw=False, update_fields=None, **kwargs):
+    """ノート保存時に特徴を更新"""
+    if raw:
+        return
+    if update_fields is not None and not set(update_fields) & set(NOTEBOOK_INDEX_FIELDS):
+        return
+    _refresh_notebook_features(instance.pk)
+
+
+@receiver(post_save, sender=Entry)
+@receiver(post_delete, sender=Entry)
+def refresh_entry_notebook_features(sender, instance, raw=False, update_fields=None, origin=None, **kwargs):
+    """エントリーの保存・削除時に所属ノートの特徴を更新"""
+    if raw or isinstance(origin, Notebook) or getattr(origin, 'model', None) is Notebook:
+        return
+    if update_fields is not None and not set(update_fields) & set(ENTRY_INDEX_FIELDS):
+        return
+    _refresh_notebook_features(instance.notebook_id)
+
+
+@receiver(m2m_changed, sender=TaggedItem)
+def refresh_tag_notebook_features(sender, instance, action, reverse=False, **kwargs):
+    """ノートのタグの追加・削除時に特徴を更新"""
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Notebook):
+        _refresh_notebook_features(instance.pk)
+
+
+@receiver(pre_delete, sender=Notebook)
+def collect_related_sources(sender, instance, **kwargs):
+    """ノート削除前に、このノートを関連ノートに持つノートを記録"""
+    instance._related_sources = list(
+        RelatedNotebook.objects.filter(target=instance).values_list('source_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Notebook)
+def refresh_related_sources(sender, instance, **kwargs):
+    """ノート削除時に、このノートを関連ノートに持っていたノートの関連ノート表を更新"""
+    sources = [pk for pk in getattr(instance, '_related_sources', []) if pk != instance.pk]
+    if not sources:
+        return
+    try:
+        get_search_engine().refresh_related_notebooks(sources, reverse=False)
+    except Exception as e:
+        print(f"関連ノート表の更新エラー: {str(e)}")
+
+
+@receiver(post_save, sender=Entry)
+def percolate_saved_searches(sender, instance, raw=False, update_fields=None, **kwargs):
+    """エントリー保存時に保存した検索と照合"""
+    if raw:
+        return
+    if update_fields is not None and not set(update_fields) & set(ENTRY_INDEX_FIELDS):
+        return
+    try:
+        percolate_entry(instance)
+    except Exception as e:
+        print(f"保存した検索の照合エラー: {str(e)}")
@@ -0,0 +1,166 @@
+# notebooks/stock_master.py
+"""
+上場銘柄マスタ（東証全銘柄の銘柄コード・企業名・別名）
+銘柄コードはハッシュ参照、企業名・別名はトライ（キーワードオートマトン）で検出する
+"""
+import csv
+import hashlib
+import json
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from .keyword_automaton import KeywordAutomaton
+
+# 同梱の最小マスタ（全銘柄版は settings.STOCK_MASTER_PATH で指定）
+DEFAULT_MASTER_PATH = Path(__file__).resolve().parent / 'data' / 'stock_master.csv'
+DEFAULT_CONFIDENCE = 0.9
+
+# 銘柄コード（4桁。2024年以降の英字入りコードにも対応）
+CODE_PATTERN = re.compile(r'(?<![0-9a-z])[0-9][0-9a-z][0-9][0-9a-z](?![0-9a-z])')
+
+
+class StockRecord(NamedTuple):
+    """銘柄レコード"""
+    code: str
+    name: str
+    label: str
+    confidence: float
+
+
+class StockMaster:
+    """銘柄マスタと銘柄検出"""
+    
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.records: List[StockRecord] = []
+        self._by_code: Dict[str, int] = {}
+        name_entries = []
+        
+        for row in rows:
+            code = str(row.get('code', '')).strip().lower()
+            name = str(row.get('name', '')).strip()
+            if not code or not name or code in self._by_code:
+                continue
+            
+            short_name = str(row.get('short_name') or '').strip() or name
+            aliases = row.get('aliases') or []
+            if isinstance(aliases, str):
+                aliases = aliases.split('|')
+            
+            index = len(self.records)
+            self.records.append(StockRecord(
+                code=code.upper(),
+                name=name,
+                label=f"{code.upper()}{short_name}",
+                confidence=float(row.get('confidence') or DEFAULT_CONFIDENCE),
+            ))
+            self._by_code[code] = index
+            
+            for term in [name] + [alias.strip() for alias in aliases]:
+                if term:
+                    name_entries.append((term, index))
+        
+        self._name_automaton = KeywordAutomaton(name_entries)
+        
+        # マスタ内容の指紋（分析バージョンに含め、マスタ更新時に再分析させる）
+        digest = hashlib.sha256()
+        for record in self.records:
+            digest.update(f"{record.code}|{record.label}|{record.confidence}\n".encode('utf-8'))
+        for term, index in name_entries:
+            digest.update(f"{index}|{term}\n".encode('utf-8'))
+        self.fingerprint = digest.hexdigest()[:12]
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def get(self, code: str) -> Optional[StockRecord]:
+        """銘柄コードからレコード取得"""
+        index = self._by_code.get(str(code).strip().lower())
+        return self.records[index] if index is not None else None
+    
+    def detect(self, text: str) -> List[Dict[str, Any]]:
+        """
+        テキスト中の銘柄メンション検出（テキストは小文字化済みであること）
+        
+        同じ銘柄の重なったヒット（企業名と別名など）は1件として数える。
+        """
+        # (開始位置, -一致長, 銘柄番号)
+        hits = []
+        for match in CODE_PATTERN.finditer(text):
+            index = self._by_code.get(match.group())
+            if index is not None:
+                hits.append((match.start(), -4, index))
+        
+        automaton = self._name_automaton
+        for start, keyword_index in automaton.iter_matches(text):
+            length = len(automaton.keywords[keyword_index])
+            for index in automaton.payloads[keyword_index]:
+                hits.append((start, -length, index))
+        
+        if not hits:
+            return []
+        
+        hits.sort()
+        mentions: Dict[int, int] = {}
+        next_pos: Dict[int, int] = {}
+        for start, negative_length, index in hits:
+            if start >= next_pos.get(index, 0):
+                mentions[index] = mentions.get(index, 0) + 1
+                next_pos[index] = start - negative_length
+        
+        return [{
+            'stock': self.records[index].label,
+            'confidence': self.records[index].confidence,
+            'mentions': mentions[index],
+        } for index in sorted(mentions)]
+
+
+def load_stock_master(path: Path) -> StockMaster:
+    """CSV / JSON ファイルからマスタを読み込み"""
+    path = Path(path)
+    if path.suffix.lower() == '.json':
+        with path.open(encoding='utf-8') as f:
+            rows = json.load(f)
+    else:
+        with path.open(encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.DictReader(f))
+    return StockMaster(rows)
+
+
+def _configured_master_path() -> Path:
+    """設定されたマスタファイルのパス"""
+    try:
+        from django.conf import settings
+        path = getattr(settings, 'STOCK_MASTER_PATH', None)
+    except Exception:
+        path = None
+    return Path(path) if path else DEFAULT_MASTER_PATH
+
+
+# プロセス内で共有するマスタ（初回利用時に一度だけ読み込み）
+_stock_master: Optional[StockMaster] = None
+_stock_master_lock = threading.Lock()
+
+
+def get_stock_master() -> StockMaster:
+    """共有銘柄マスタ取得（遅延読み込み）"""
+    global _stock_master
+    master = _stock_master
+    if master is None:
+        with _stock_master_lock:
+            if _stock_master is None:
+                try:
+                    _stock_master = load_stock_master(_configured_master_path())
+                except (OSError, ValueError) as e:
+                    print(f"銘柄マスタ読み込みエラー: {str(e)}")
+                    _stock_master = StockMaster([])
+            master = _stock_master
+    return master
+
+
+def reset_stock_master():
+    """共有銘柄マスタの破棄（次回利用時に再読み込み）"""
+    global _stock_master
+    with _stock_master_lock:
+        _stock_master = None
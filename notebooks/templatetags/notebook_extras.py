@@ -224,16 +224,17 @@ def truncate_smart(value, length=100):
 
 @register.simple_tag
 def related_content_count(notebook):
-    """関連コンテンツ数を取得"""
-    # 実際の実装では SemanticSearchEngine を使用
-    # ここでは簡易版
-    from ..semantic_search import SemanticSearchEngine
+    """
+    関連コンテンツ数を取得（最大5件）
+    
+    関連ノート表（書き込み後に特徴の更新ジョブで更新）の件数を1クエリで数える。
+    ジョブの実行前で関連ノート表が未作成の間は0。
+    """
+    from ..models import RelatedNotebook
     
     try:
-        search_engine = SemanticSearchEngine()
-        related = search_engine.find_related_content(str(notebook.pk), notebook.user.id, 5)
-        return len(related)
-    except:
+        return min(RelatedNotebook.objects.filter(source_id=notebook.pk).count(), 5)
+    except Exception:
         return 0
 
 
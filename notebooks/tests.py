@@ -5,7 +5,11 @@ from django.urls import reverse
 from django.utils import timezone
 from decimal import Decimal
 import json
-from .models import Notebook, Entry
+import os
+from .models import (
+    Notebook, Entry, NotebookRiskFactor, NotebookFeatures, RelatedNotebook, SearchPosting, SavedSearch,
+    SavedSearchMatch,
+)
 from .ai_analyzer import StockAnalysisAI
 from .calculators import InvestmentCalculator
 from .semantic_search import SemanticSearchEngine
@@ -123,6 +127,904 @@ class EntryModelTest(TestCase):
         self.assertEqual(entry.ai_content_type, 'earnings_analysis')
 
 
+class AIAnalysisMemoizationTest(TestCase):
+    """AI分析のコンテンツハッシュによる再分析スキップのテスト"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.notebook = Notebook.objects.create(
+            user=self.user,
+            title='7203 トヨタ自動車',
+            investment_goal='安定配当を重視した長期投資戦略'
+        )
+        self.entry = Entry.objects.create(
+            notebook=self.notebook,
+            title='決算分析',
+            content='売上高は前年同期比12%増。配当も増配予定。'
+        )
+    
+    def test_unchanged_content_skips_analysis(self):
+        """内容が変わらなければ再分析も書き込みもしないテスト"""
+        from unittest import mock
+        from .views import perform_ai_analysis_for_entry, perform_ai_analysis_for_notebook
+        
+        perform_ai_analysis_for_entry(self.entry)
+        perform_ai_analysis_for_notebook(self.notebook)
+        self.assertTrue(self.entry.ai_content_hash)
+        self.assertTrue(self.notebook.ai_analyzer_version)
+        
+        with mock.patch.object(StockAnalysisAI, 'analyze_partial') as analyze, \
+                mock.patch.object(Entry, 'save') as entry_save, \
+                mock.patch.object(Notebook, 'save') as notebook_save:
+            perform_ai_analysis_for_entry(Entry.objects.get(pk=self.entry.pk))
+            perform_ai_analysis_for_notebook(Notebook.objects.get(pk=self.notebook.pk))
+        
+        analyze.assert_not_called()
+        entry_save.assert_not_called()
+        notebook_save.assert_not_called()
+    
+    def test_changed_content_or_version_reanalyzes(self):
+        """内容または分析器バージョンが変われば再分析するテスト"""
+        from unittest import mock
+        from .views import perform_ai_analysis_for_entry
+        
+        perform_ai_analysis_for_entry(self.entry)
+        
+        self.entry.content += 'EV移行リスクに注意。'
+        perform_ai_analysis_for_entry(self.entry)
+        self.assertIn('リスク管理', self.entry.ai_analysis_cache['suggested_tags'])
+        
+        with mock.patch('notebooks.ai_analyzer.RULESET_VERSION', 999), \
+                mock.patch.object(StockAnalysisAI, 'analyze_partial', return_value={}) as analyze:
+            perform_ai_analysis_for_entry(self.entry)
+        analyze.assert_called_once()
+
+
+class IncrementalNotebookAnalysisTest(TestCase):
+    """エントリー部分集計の合算によるノート分析のテスト"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.notebook = Notebook.objects.create(
+            user=self.user,
+            title='7203 トヨタ自動車',
+            investment_goal='長期保有'
+        )
+    
+    def _add_entry(self, content):
+        from .views import perform_ai_analysis_for_entry
+        
+        entry = Entry.objects.create(notebook=self.notebook, title='メモ', content=content)
+        perform_ai_analysis_for_entry(entry)
+        return entry
+    
+    def test_partial_merge_matches_full_analysis(self):
+        """部分集計の合算が連結テキストの分析と一致するテスト"""
+        from .ai_analyzer import merge_partials
+        
+        analyzer = StockAnalysisAI()
+        first, second = '配当利回りが高く安定。', '決算は好調で業績も上昇。'
+        
+        merged = analyzer.analysis_from_partial(merge_partials(
+            analyzer.analyze_partial(first), analyzer.analyze_partial(second)
+        ))
+        full = analyzer.analyze_content(f"{first} {second}")
+        
+        for key in ['suggested_tags', 'sentiment', 'confidence', 'risk_level', 'keywords']:
+            self.assertEqual(merged[key], full[key], key)
+    
+    def test_notebook_analysis_covers_all_entries(self):
+        """最新10件より古いエントリーもノート分析に含まれるテスト"""
+        from .views import perform_ai_analysis_for_notebook
+        
+        self._add_entry('株主優待の内容を確認しておく。')
+        for i in range(11):
+            self._add_entry(f'決算メモ{i}。売上は前年同期比で増加。')
+        
+        self.notebook.refresh_from_db()
+        perform_ai_analysis_for_notebook(self.notebook)
+        
+        self.assertIn('株主優待', self.notebook.ai_entries_aggregate['tags'])
+        self.assertIn('株主優待', self.notebook.ai_analysis_cache['suggested_tags'])
+    
+    def test_entry_edit_and_delete_update_aggregate(self):
+        """エントリー更新・削除で集計が差分更新されるテスト"""
+        from .ai_analyzer import merge_partials
+        from .views import perform_ai_analysis_for_entry
+        
+        keep = self._add_entry('配当利回りが魅力的な銘柄。')
+        edited = self._add_entry('為替リスクが心配な銘柄。')
+        
+        edited.content = '株主優待が魅力的な銘柄。'
+        perform_ai_analysis_for_entry(edited)
+        self.notebook.refresh_from_db()
+        self.assertEqual(self.notebook.ai_entries_aggregate['risk'], 0)
+        self.assertIn('株主優待', self.notebook.ai_entries_aggregate['tags'])
+        self.assertEqual(
+            self.notebook.ai_entries_aggregate,
+            merge_partials(keep.ai_partial, edited.ai_partial)
+        )
+        
+        edited.delete()
+        self.notebook.refresh_from_db()
+        self.assertEqual(self.notebook.ai_entries_aggregate, merge_partials(keep.ai_partial))
+    
+    def test_entry_shortened_below_minimum_is_subtracted(self):
+        """分析対象外の長さに短縮したエントリーの部分集計が差し引かれるテスト"""
+        from .ai_analyzer import merge_partials
+        from .views import perform_ai_analysis_for_entry
+        
+        keep = self._add_entry('配当利回りが魅力的な銘柄。')
+        shortened = self._add_entry('7203トヨタの決算分析。営業利益は増益。')
+        
+        shortened.content = '短い'
+        shortened.save()
+        perform_ai_analysis_for_entry(shortened)
+        
+        self.notebook.refresh_from_db()
+        shortened.refresh_from_db()
+        self.assertEqual(shortened.ai_partial, {})
+        self.assertEqual(self.notebook.ai_entries_aggregate, merge_partials(keep.ai_partial))
+
+
+class AnalysisJobQueueTest(TestCase):
+    """AI分析ジョブキューのテスト"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.notebook = Notebook.objects.create(
+            user=self.user,
+            title='7203 トヨタ自動車',
+            investment_goal='長期保有で配当を受け取る'
+        )
+    
+    def test_entry_create_enqueues_and_worker_analyzes(self):
+        """エントリー作成はジョブ登録のみで、ワーカーが分析するテスト"""
+        from .jobs import process_jobs
+        from .models import AnalysisJob
+        
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.post(reverse('entry_create', args=[self.notebook.pk]), {
+            'entry_type': 'memo',
+            'title': '配当メモ',
+            'content': '配当利回りが高く、株主優待も魅力的。',
+        })
+        self.assertEqual(response.status_code, 302)
+        
+        entry = Entry.objects.get(notebook=self.notebook)
+        self.assertEqual(entry.ai_analysis_cache, {})
+        self.assertEqual(AnalysisJob.objects.filter(target_type='entry', status='pending').count(), 1)
+        
+        # エントリーの分析と、ノートの特徴・関連ノート表の更新
+        self.assertEqual(process_jobs(), {'claimed': 2, 'done': 2, 'failed': 0})
+        
+        entry.refresh_from_db()
+        self.notebook.refresh_from_db()
+        self.assertIn('高配当', entry.ai_analysis_cache['suggested_tags'])
+        self.assertEqual(self.notebook.ai_entries_aggregate, entry.ai_partial)
+        self.assertTrue(self.notebook.ai_last_analyzed)
+        self.assertEqual(AnalysisJob.objects.get(target_type='entry').status, 'done')
+    
+    def test_enqueue_deduplicates_by_object_and_hash(self):
+        """同じ対象・内容のジョブは重複登録しないテスト"""
+        from .jobs import enqueue_notebook_analysis
+        from .models import AnalysisJob
+        
+        first = enqueue_notebook_analysis(self.notebook)
+        self.assertEqual(enqueue_notebook_analysis(self.notebook).pk, first.pk)
+        
+        # 内容が変われば待機中のジョブを最新の内容で置き換える
+        self.notebook.investment_goal = '成長性を重視'
+        replaced = enqueue_notebook_analysis(self.notebook)
+        self.assertEqual(replaced.pk, first.pk)
+        self.assertNotEqual(replaced.content_hash, first.content_hash)
+        self.assertEqual(AnalysisJob.objects.filter(target_type='notebook').count(), 1)
+    
+    def test_failed_job_backs_off_then_dead_letters(self):
+        """失敗ジョブのバックオフ再試行と上限到達時の dead 化テスト"""
+        from datetime import timedelta
+        from unittest import mock
+        from .jobs import enqueue_notebook_analysis, process_jobs
+        
+        job = enqueue_notebook_analysis(self.notebook)
+        job.max_attempts = 2
+        job.save()
+        
+        with mock.patch('notebooks.views.perform_ai_analysis_for_notebook',
+                        side_effect=RuntimeError('boom')):
+            self.assertEqual(process_jobs()['failed'], 1)
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'pending')
+            self.assertIn('boom', job.last_error)
+            self.assertGreater(job.run_after, timezone.now())
+            
+            # バックオフ中は取得されない
+            self.assertEqual(process_jobs()['claimed'], 0)
+            
+            job.run_after = timezone.now() - timedelta(seconds=1)
+            job.save()
+            process_jobs()
+        
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'dead')
+        self.assertEqual(job.attempts, 2)
+
+
+class BatchAnalysisTest(TestCase):
+    """AI分析一括モード（run_ai_analysis --workers）のテスト"""
+    
+    def setUp(self):
+        import tempfile
+        
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.notebook = Notebook.objects.create(
+            user=self.user,
+            title='7203 トヨタ自動車',
+            investment_goal='長期保有で配当を受け取る'
+        )
+        self.entries = [
+            Entry.objects.create(
+                notebook=self.notebook, title=f'メモ{i}',
+                content=f'決算メモ{i}。配当利回りが高く、売上は前年同期比で増加。'
+            )
+            for i in range(12)
+        ]
+        self.checkpoint_path = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+    
+    def test_bulk_run_matches_per_object_analysis(self):
+        """一括モードの結果が1件ずつの分析と一致するテスト"""
+        from .ai_analyzer import merge_partials
+        from .batch_analysis import BatchAnalysisRunner
+        from .views import perform_ai_analysis_for_entry
+        
+        stats = BatchAnalysisRunner(chunk_size=5, checkpoint_path=self.checkpoint_path, log=lambda msg: None).run()
+        self.assertEqual(stats['entries']['analyzed'], 12)
+        self.assertEqual(stats['notebooks']['analyzed'], 1)
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+        
+        entries = list(Entry.objects.filter(notebook=self.notebook))
+        self.notebook.refresh_from_db()
+        self.assertEqual(
+            self.notebook.ai_entries_aggregate,
+            merge_partials(*[entry.ai_partial for entry in entries])
+        )
+        self.assertTrue(self.notebook.is_ai_analysis_current(self.notebook.get_ai_content_hash()))
+        self.assertIn('高配当', self.notebook.tags.names())
+        
+        bulk_cache = entries[0].ai_analysis_cache
+        Entry.objects.filter(pk=entries[0].pk).update(ai_content_hash='')
+        entry = Entry.objects.get(pk=entries[0].pk)
+        perform_ai_analysis_for_entry(entry)
+        self.assertEqual(entry.ai_analysis_cache, bulk_cache)
+    
+    def test_resume_from_checkpoint(self):
+        """チェックポイント位置から再開するテスト"""
+        from .batch_analysis import BatchAnalysisRunner
+        
+        runner = BatchAnalysisRunner(chunk_size=5, checkpoint_path=self.checkpoint_path, log=lambda msg: None)
+        runner.checkpoint.save('entries', self.entries[4].pk)
+        
+        resumed = BatchAnalysisRunner(chunk_size=5, checkpoint_path=self.checkpoint_path, log=lambda msg: None)
+        self.assertTrue(resumed.checkpoint.resumed)
+        self.assertEqual(resumed.run()['entries']['analyzed'], 7)
+        self.assertEqual(Entry.objects.filter(ai_analysis_cache={}).count(), 5)
+    
+    def test_stale_mode_selects_only_changed_rows(self):
+        """--stale は未分析・分析後に更新・旧バージョンの行のみ対象にするテスト"""
+        from .batch_analysis import BatchAnalysisRunner
+        
+        BatchAnalysisRunner(checkpoint_path=self.checkpoint_path, log=lambda msg: None).run()
+        stale_runner = BatchAnalysisRunner(stale=True, checkpoint_path=self.checkpoint_path, log=lambda msg: None)
+        self.assertEqual(stale_runner.candidate_pks(Entry), [])
+        self.assertEqual(stale_runner.candidate_pks(Notebook), [])
+        
+        edited = Entry.objects.get(pk=self.entries[3].pk)
+        edited.content = '為替リスクと競合激化が懸念材料。'
+        edited.save()
+        Entry.objects.get(pk=self.entries[5].pk).save()  # 内容は変えずに保存
+        Entry.objects.filter(pk=self.entries[7].pk).update(ai_analyzer_version='old')
+        self.assertEqual(
+            stale_runner.candidate_pks(Entry),
+            [self.entries[3].pk, self.entries[5].pk, self.entries[7].pk]
+        )
+        
+        stats = stale_runner.run()
+        self.assertEqual(stats['entries']['analyzed'], 2)
+        self.assertEqual(stats['entries']['skipped'], 1)  # 内容未変更のためハッシュ比較でスキップ
+        self.assertEqual(stale_runner.candidate_pks(Entry), [])
+        
+        # 集計が変わったノートも再分析される
+        self.notebook.refresh_from_db()
+        self.assertIn('リスク管理', self.notebook.ai_entries_aggregate['tags'])
+        self.assertTrue(self.notebook.is_ai_analysis_current(self.notebook.get_ai_content_hash()))
+    
+    def test_since_window(self):
+        """--since は指定日時以降に更新された行のみ対象にするテスト"""
+        from datetime import timedelta
+        from .batch_analysis import BatchAnalysisRunner
+        
+        Entry.objects.exclude(pk=self.entries[0].pk).update(updated_at=timezone.now() - timedelta(days=3))
+        runner = BatchAnalysisRunner(
+            since=timezone.now() - timedelta(days=1), checkpoint_path=self.checkpoint_path, log=lambda msg: None
+        )
+        self.assertEqual(runner.candidate_pks(Entry), [self.entries[0].pk])
+    
+    def test_command_with_worker_processes(self):
+        """--workers 指定でプロセスプールを使って分析するテスト"""
+        from io import StringIO
+        from django.core.management import call_command
+        
+        call_command(
+            'run_ai_analysis', workers=2, chunk_size=5,
+            checkpoint=self.checkpoint_path, stdout=StringIO()
+        )
+        self.assertFalse(Entry.objects.filter(ai_analysis_cache={}).exists())
+        self.assertEqual(Entry.objects.exclude(ai_partial={}).count(), 12)
+
+
+class ProfilingTest(TestCase):
+    """段階別計測のテスト"""
+    
+    def setUp(self):
+        from . import profiling
+        
+        self.profiling = profiling
+        profiling.reset_stats()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.notebook = Notebook.objects.create(
+            user=self.user,
+            title='7203 トヨタ自動車',
+            investment_goal='長期保有で配当を受け取る'
+        )
+    
+    def tearDown(self):
+        self.profiling.disable()
+        self.profiling.reset_stats()
+    
+    def test_stages_recorded_only_when_enabled(self):
+        """有効時のみ段階別に記録されるテスト"""
+        analyzer = StockAnalysisAI()
+        analyzer.analyze_content('トヨタの決算は好調で配当も増加。', '決算')
+        self.assertEqual(self.profiling.get_stats(), {})
+        
+        self.profiling.enable()
+        analyzer.analyze_content('トヨタの決算は好調で配当も増加。', '決算')
+        analyzer.analyze_content('為替リスクに注意。', 'メモ')
+        stats = self.profiling.get_stats()
+        
+        for name in ['analyzer.analyze_content', 'analyzer.rule_matching', 'analyzer.stock_matching',
+                     'analyzer.tag_extraction', 'analyzer.keyword_counting']:
+            self.assertEqual(stats[name]['count'], 2, name)
+        self.assertEqual(sum(stats['analyzer.analyze_content']['histogram'].values()), 2)
+    
+    def test_stats_endpoint_is_staff_only(self):
+        """計測結果APIはスタッフのみ利用できるテスト"""
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(reverse('profiling_stats_api'))
+        self.assertEqual(response.status_code, 403)
+        
+        self.user.is_staff = True
+        self.user.save()
+        self.profiling.enable()
+        self.client.get(reverse('ai_insights_api', args=[self.notebook.pk]))
+        
+        data = self.client.get(reverse('profiling_stats_api')).json()
+        self.assertTrue(data['enabled'])
+        self.assertIn('api.ai_insights', data['stages'])
+        self.assertIn('search.extract_full_text', data['stages'])
+        self.assertIn('search.find_related_content', data['stages'])
+    
+    def test_profile_command(self):
+        """計測コマンドのテスト"""
+        from io import StringIO
+        from django.core.management import call_command
+        
+        out = StringIO()
+        call_command('ai_profile', notebook=self.notebook.pk, json=True, stdout=out)
+        stats = json.loads(out.getvalue())
+        self.assertEqual(stats['api.ai_insights']['count'], 1)
+        self.assertFalse(self.profiling.is_enabled())
+
+
+class RiskFactorIndexTest(TestCase):
+    """リスク要因索引のテスト"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.toyota = Notebook.objects.create(
+            user=self.user,
+            title='トヨタ自動車',
+            risk_factors='円高による為替差損、EV化の遅れ、半導体不足による減産。規制強化も懸念'
+        )
+        self.sony = Notebook.objects.create(
+            user=self.user,
+            title='ソニー',
+            risk_factors='ドル円の変動'
+        )
+    
+    def terms(self, notebook):
+        return dict(notebook.risk_factor_index.values_list('term', 'mentions'))
+    
+    def test_extracted_on_save(self):
+        """保存時に正規化されたリスク項目が索引されるテスト"""
+        self.assertEqual(self.terms(self.toyota), {'為替': 2, 'EV移行': 1, '半導体不足': 1, '規制': 1})
+        self.assertEqual(self.terms(self.sony), {'為替': 1})
+        
+        exposed = Notebook.objects.filter(user=self.user, risk_factor_index__term='為替')
+        self.assertEqual(set(exposed), {self.toyota, self.sony})
+    
+    def test_index_follows_updates(self):
+        """リスク要因の変更・部分更新への追従テスト"""
+        self.sony.risk_factors = '金利上昇'
+        self.sony.save()
+        self.assertEqual(self.terms(self.sony), {'金利': 1})
+        
+        # リスク要因を含まない部分更新では索引を読み直さない（ノートと版数の更新のみ）
+        with self.assertNumQueries(2):
+            self.sony.save(update_fields=['current_price'])
+        
+        self.toyota.delete()
+        self.assertFalse(NotebookRiskFactor.objects.filter(notebook_id=self.toyota.pk).exists())
+    
+    def test_exposure_api(self):
+        """リスクエクスポージャーAPIのテスト"""
+        self.client.login(username='testuser', password='testpass123')
+        
+        data = self.client.get(reverse('risk_exposure_api'), {'term': '円安'}).json()
+        self.assertEqual(data['term'], '為替')
+        self.assertEqual([n['id'] for n in data['notebooks']], [self.toyota.pk, self.sony.pk])
+        
+        data = self.client.get(reverse('risk_exposure_api')).json()
+        self.assertEqual(data['exposure'][0], {'term': '為替', 'notebook_count': 2, 'mentions': 3})
+    
+    def test_rebuild_command(self):
+        """索引再構築コマンドのテスト"""
+        from io import StringIO
+        from django.core.management import call_command
+        
+        NotebookRiskFactor.objects.all().delete()
+        call_command('rebuild_risk_factors', stdout=StringIO())
+        self.assertEqual(self.terms(self.toyota), {'為替': 2, 'EV移行': 1, '半導体不足': 1, '規制': 1})
+
+
+class SearchIndexTest(TestCase):
+    """検索インデックスのテスト"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.other = User.objects.create_user(
+            username='otheruser',
+            password='testpass123'
+        )
+        self.notebook = Notebook.objects.create(
+            user=self.user,
+            title='トヨタ自動車',
+            investment_goal='長期保有'
+        )
+        self.entry = Entry.objects.create(
+            notebook=self.notebook,
+            title='決算メモ',
+            content='ハイブリッド車の販売が好調'
+        )
+        Notebook.objects.create(user=self.other, title='ハイブリッド車メーカー')
+    
+    def search(self, *keywords):
+        from .search_index import search_notebook_ids
+        return search_notebook_ids(keywords, self.user.id)
+    
+    def test_postings_follow_content_changes(self):
+        """ノート・エントリー・タグの変更がインデックスに反映されるテスト"""
+        self.assertEqual(self.search('ハイブリッド'), {self.notebook.pk})
+        self.assertEqual(self.search('トヨタ', '存在しない語'), {self.notebook.pk})
+        # bigramはすべて含むが連続していない語は除外
+        self.assertEqual(self.search('好調車'), set())
+        
+        self.entry.tags.add('自動車株')
+        self.assertEqual(self.search('自動車株'), {self.notebook.pk})
+        
+        self.entry.content = '電気自動車へ移行'
+        self.entry.save()
+        self.assertEqual(self.search('ハイブリッド'), set())
+        self.assertEqual(self.search('電気'), {self.notebook.pk})
+        
+        self.entry.delete()
+        self.assertEqual(self.search('電気'), set())
+        
+        self.notebook.delete()
+        self.assertFalse(SearchPosting.objects.filter(user=self.user).exists())
+    
+    def test_semantic_search_uses_index(self):
+        """セマンティック検索がインデックスの結果を返すテスト"""
+        engine = SemanticSearchEngine()
+        results = engine.semantic_search('ハイブリッド', self.user.id)
+        self.assertEqual([r['notebook_id'] for r in results], [self.notebook.pk])
+        
+        # インデックスが空なら（再構築前）ヒットしない
+        from django.core.cache import cache
+        from .search_backends import get_search_backend
+        SearchPosting.objects.all().delete()
+        get_search_backend().remove([self.notebook.pk])
+        cache.clear()  # インデックスを直接消したため、キャッシュした検索順位も捨てる
+        self.assertEqual(engine.semantic_search('ハイブリッド', self.user.id), [])
+        
+        from io import StringIO
+        from django.core.management import call_command
+        call_command('rebuild_search_index', stdout=StringIO())
+        results = engine.semantic_search('ハイブリッド', self.user.id)
+        self.assertEqual([r['notebook_id'] for r in results], [self.notebook.pk])
+
+
+class SearchBackendTest(TestCase):
+    """検索バックエンド（FTS5 / 転置インデックス）のテスト"""
+    
+    def setUp(self):
+        from .search_backends import FTS5SearchBackend, PostingsSearchBackend
+        
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.in_entry = Notebook.objects.create(user=self.user, title='自動車セクター')
+        Entry.objects.create(notebook=self.in_entry, title='メモ', content='トヨタ自動車の決算を確認')
+        self.in_title = Notebook.objects.create(user=self.user, title='トヨタ自動車', stock_code='7203')
+        Notebook.objects.create(
+            user=User.objects.create_user(username='otheruser', password='testpass123'),
+            title='トヨタ自動車'
+        )
+        self.backends = [FTS5SearchBackend(), PostingsSearchBackend()]
+    
+    def test_backends_agree_on_matches(self):
+        """両バックエンドが同じノートを返すテスト（短い語・列指定を含む）"""
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                self.assertEqual(set(backend.search(self.user.id, ['トヨタ'])), {self.in_entry.pk, self.in_title.pk})
+                self.assertEqual(set(backend.search(self.user.id, ['72'])), {self.in_title.pk})
+                self.assertEqual(backend.search(self.user.id, ['トヨタ'], columns=['title']), [self.in_title.pk])
+                self.assertEqual(backend.search(self.user.id, ['決算を確認', 'ホンダ']), [self.in_entry.pk])
+    
+    def test_fts5_ranks_title_matches_first(self):
+        """bm25 でタイトル一致が本文一致より上位になるテスト"""
+        fts5 = self.backends[0]
+        self.assertEqual(fts5.search(self.user.id, ['トヨタ自動車']), [self.in_title.pk, self.in_entry.pk])
+        self.assertEqual(fts5.search(self.user.id, ['トヨタ自動車'], limit=1), [self.in_title.pk])
+    
+    def test_list_view_search(self):
+        """ノート一覧の検索が検索バックエンドを使うテスト"""
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(reverse('notebook_list'), {'search': 'トヨタ'})
+        self.assertEqual([n.pk for n in response.context['page_obj']], [self.in_title.pk])
+        
+        data = self.client.get(reverse('search_api'), {'q': '7203'}).json()
+        self.assertEqual([r['id'] for r in data['results']], [str(self.in_title.pk)])
+    
+    def test_list_search_matches_subtitle(self):
+        """一覧・インクリメンタル検索がサブタイトルにも一致するテスト（本文のみの一致は対象外）"""
+        subtitled = Notebook.objects.create(user=self.user, title='7267', subtitle='ホンダの二輪事業')
+        Notebook.objects.create(user=self.user, title='メモ', investment_goal='ホンダと比較する')
+        self.client.login(username='testuser', password='testpass123')
+        
+        response = self.client.get(reverse('notebook_list'), {'search': 'ホンダ'})
+        self.assertEqual([n.pk for n in response.context['page_obj']], [subtitled.pk])
+        data = self.client.get(reverse('search_api'), {'q': 'ホンダ'}).json()
+        self.assertEqual([r['id'] for r in data['results']], [str(subtitled.pk)])
+    
+    def test_backends_agree_on_entry_matches(self):
+        """両バックエンドがエントリー単位で同じ結果を返し、削除したエントリーを除くテスト"""
+        entry = self.in_entry.entries.get()
+        tagged = Entry.objects.create(notebook=self.in_title, title='決算', content='増益')
+        tagged.tags.add('トヨタ')
+        
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                ranked = backend.search_entries(self.user.id, ['決算を確認'])
+                self.assertEqual([pk for pk, _ in ranked], [entry.pk])
+                self.assertEqual(ranked[0][1], 1.0)
+                self.assertEqual(
+                    {pk for pk, _ in backend.search_entries(self.user.id, ['トヨタ'])}, {entry.pk, tagged.pk}
+                )
+        
+        entry.delete()
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                self.assertEqual(backend.search_entries(self.user.id, ['決算を確認']), [])
+    
+    def test_entry_save_rewrites_only_its_fts_row(self):
+        """エントリーの保存はそのエントリーの索引行のみ書き直し、ノートの保存では全エントリーを書き直すテスト"""
+        from django.db import connection
+        from .search_backends import ENTRY_FTS_TABLE
+        
+        fts5 = self.backends[0]
+        entry = self.in_entry.entries.get()
+        # 既存のエントリーの行を直接消し、書き直されたかで確認する
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {ENTRY_FTS_TABLE} WHERE rowid = %s', [entry.pk])
+        
+        added = Entry.objects.create(notebook=self.in_entry, title='追記', content='ホンダの新型車')
+        added.tags.add('二輪')
+        self.assertEqual([pk for pk, _ in fts5.search_entries(self.user.id, ['ホンダの新型'])], [added.pk])
+        self.assertEqual([pk for pk, _ in fts5.search_entries(self.user.id, ['二輪'])], [added.pk])
+        self.assertEqual(fts5.search_entries(self.user.id, ['決算を確認']), [])
+        
+        self.in_entry.save()
+        self.assertEqual([pk for pk, _ in fts5.search_entries(self.user.id, ['決算を確認'])], [entry.pk])
+    
+    def test_entry_search_finds_older_entries(self):
+        """最新10件より古いエントリーもスニペット・アンカー付きで見つかるテスト"""
+        from datetime import timedelta
+        from .semantic_search import get_search_engine
+        
+        notebook = Notebook.objects.create(user=self.user, title='長期保有')
+        old = Entry.objects.create(notebook=notebook, title='初回分析', content='前期は半導体不足で減産。今期は回復')
+        Entry.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=30))
+        for i in range(12):
+            Entry.objects.create(notebook=notebook, title=f'メモ{i}', content='特記事項なし')
+        
+        results = get_search_engine().search_entries('半導体不足', self.user.id)
+        self.assertEqual([r['entry_id'] for r in results], [old.pk])
+        result = results[0]
+        self.assertEqual(result['notebook_id'], notebook.pk)
+        start, end = result['highlights'][0]
+        self.assertEqual(result['snippet'][start:end], '半導体不足')
+        self.assertEqual(result['snippet_start'], 0)
+        self.assertEqual(result['url'], f"{notebook.get_absolute_url()}?page=2#entry-{old.pk}")
+        
+        self.client.login(username='testuser', password='testpass123')
+        data = self.client.get(reverse('semantic_search_api'), {'q': '半導体不足', 'mode': 'entries'}).json()
+        self.assertEqual(data['mode'], 'entries')
+        self.assertEqual([r['entry_id'] for r in data['results']], [old.pk])
+
+
+class AutocompleteTest(TestCase):
+    """入力補完（前方一致インデックス）のテスト"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.toyota = Notebook.objects.create(
+            user=self.user, title='7203 トヨタ自動車', stock_code='7203', company_name='トヨタ自動車'
+        )
+        self.toyota.tags.add('高配当', '自動車')
+        self.sony = Notebook.objects.create(
+            user=self.user, title='6758 ソニー', stock_code='6758', company_name='ソニーグループ'
+        )
+        self.sony.tags.add('高成長')
+        self.client.login(username='testuser', password='testpass123')
+    
+    def suggest(self, query):
+        return self.client.get(reverse('autocomplete_api'), {'q': query}).json()
+    
+    def test_prefix_matches(self):
+        """タイトルの語・銘柄コード（全角入力）・企業名・タグ名の前方一致テスト"""
+        self.assertEqual([r['id'] for r in self.suggest('トヨ')['results']], [str(self.toyota.pk)])
+        self.assertEqual([r['id'] for r in self.suggest('７２')['results']], [str(self.toyota.pk)])
+        self.assertEqual([r['id'] for r in self.suggest('ソニーグ')['results']], [str(self.sony.pk)])
+        
+        data = self.suggest('高')
+        self.assertEqual([r['id'] for r in data['results']], [str(self.sony.pk), str(self.toyota.pk)])
+        self.assertEqual({tag['name'] for tag in data['tags']}, {'高配当', '高成長'})
+        self.assertEqual(self.suggest('自動車')['results'][0]['url'], self.toyota.get_absolute_url())
+        self.assertEqual(self.suggest('ホンダ')['results'], [])
+    
+    def test_index_is_reused_until_data_changes(self):
+        """データが変わるまでインデックスを作り直さないテスト"""
+        from .autocomplete import get_prefix_index
+        
+        index = get_prefix_index(self.user.id)
+        # 版数の読み込みのみ
+        with self.assertNumQueries(1):
+            self.assertIs(get_prefix_index(self.user.id), index)
+        
+        Notebook.objects.create(user=self.user, title='7267 ホンダ', stock_code='7267')
+        self.assertEqual(len(self.suggest('ホンダ')['results']), 1)
+        self.assertEqual(len(self.suggest('72')['results']), 2)
+    
+    def test_substring_fallback(self):
+        """前方一致が足りない場合に部分一致で補うテスト（前方一致の後ろに新しい順）"""
+        self.assertEqual([r['id'] for r in self.suggest('ニーグ')['results']], [str(self.sony.pk)])
+        
+        honda = Notebook.objects.create(user=self.user, title='7267 ホンダ', company_name='本田技研工業')
+        daihatsu = Notebook.objects.create(user=self.user, title='ダイハツ工業')
+        self.assertEqual(
+            [r['id'] for r in self.suggest('工業')['results']], [str(daihatsu.pk), str(honda.pk)]
+        )
+        self.assertEqual(
+            [r['id'] for r in self.suggest('ダイハツ')['results']], [str(daihatsu.pk)]
+        )
+        # 1文字の入力は前方一致のみ
+        self.assertEqual(self.suggest('業')['results'], [])
+    
+    def test_index_expires_after_max_age(self):
+        """版数が変わらなくても最大保持時間を過ぎたら作り直すテスト（他のプロセスでの書き込みの反映）"""
+        import time
+        from unittest import mock
+        from .autocomplete import AUTOCOMPLETE_MAX_AGE, get_prefix_index
+        
+        index = get_prefix_index(self.user.id)
+        expired = time.monotonic() + AUTOCOMPLETE_MAX_AGE
+        with mock.patch('notebooks.autocomplete.time.monotonic', return_value=expired):
+            self.assertIsNot(get_prefix_index(self.user.id), index)
+    
+    def test_invalid_limit(self):
+        """件数が数値でない場合は400を返すテスト"""
+        response = self.client.get(reverse('autocomplete_api'), {'q': 'トヨ', 'limit': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('autocomplete_api'), {'q': 'トヨ', 'limit': '-1'})
+        self.assertEqual(len(response.json()['results']), 1)
+
+
+class SavedSearchTest(TestCase):
+    """保存した検索の逆引き照合（パーコレーション）のテスト"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.notebook = Notebook.objects.create(user=self.user, title='7203 トヨタ自動車')
+        self.client.login(username='testuser', password='testpass123')
+    
+    def test_compile_query(self):
+        """AND・OR・除外語（NOT / -）の解釈テスト"""
+        from .percolator import compile_query
+        
+        self.assertEqual(compile_query('決算 AND 自動車'), [[['決算', '自動車'], []]])
+        self.assertEqual(compile_query('トヨタ OR ホンダ -ＥＶ'), [[['トヨタ'], []], [['ホンダ'], ['ev']]])
+        self.assertEqual(compile_query('増益 NOT 一時的'), [[['増益'], ['一時的']]])
+        self.assertEqual(compile_query('NOT 赤字'), [])
+    
+    def test_new_entries_are_matched(self):
+        """新しいエントリーの一致を記録し、ダッシュボード・APIで読めるテスト"""
+        saved_search = SavedSearch.objects.create(user=self.user, query='決算 AND 自動車')
+        excluded = SavedSearch.objects.create(user=self.user, query='決算 -下方修正')
+        other_user = User.objects.create_user(username='otheruser', password='testpass123')
+        SavedSearch.objects.create(user=other_user, query='決算')
+        
+        matched = Entry.objects.create(notebook=self.notebook, title='決算メモ', content='増収増益')
+        Entry.objects.create(notebook=self.notebook, title='ニュース', content='新型車を発表')
+        revised = Entry.objects.create(notebook=self.notebook, title='決算', content='通期予想を下方修正')
+        
+        self.assertEqual(
+            set(SavedSearchMatch.objects.values_list('saved_search_id', 'entry_id')),
+            {(saved_search.pk, matched.pk), (excluded.pk, matched.pk), (saved_search.pk, revised.pk)}
+        )
+        
+        # 再保存しても重複して記録しない
+        matched.content = '増収増益（確定）'
+        matched.save()
+        self.assertEqual(SavedSearchMatch.objects.filter(entry=matched).count(), 2)
+        
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(len(response.context['saved_search_matches']), 3)
+        
+        data = self.client.get(reverse('saved_searches_api')).json()
+        self.assertEqual(
+            {s['id']: s['unread_count'] for s in data['saved_searches']}, {saved_search.pk: 2, excluded.pk: 1}
+        )
+        
+        self.client.post(reverse('saved_search_matches_api'), '{}', content_type='application/json')
+        self.assertEqual(self.client.get(reverse('saved_search_matches_api')).json()['matches'], [])
+    
+    def test_match_url_points_to_entry_page(self):
+        """一致したエントリーへのリンクがノート詳細の該当ページを指すテスト"""
+        from datetime import timedelta
+        
+        SavedSearch.objects.create(user=self.user, query='決算')
+        matched = Entry.objects.create(notebook=self.notebook, title='決算メモ', content='増収増益')
+        Entry.objects.filter(pk=matched.pk).update(created_at=timezone.now() - timedelta(days=30))
+        for i in range(10):
+            Entry.objects.create(notebook=self.notebook, title=f'メモ{i}', content='特記事項なし')
+        
+        url = f"{self.notebook.get_absolute_url()}?page=2#entry-{matched.pk}"
+        data = self.client.get(reverse('saved_search_matches_api')).json()
+        self.assertEqual([match['url'] for match in data['matches']], [url])
+        
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual([match.url for match in response.context['saved_search_matches']], [url])
+        self.assertContains(response, f'href="{url}"')
+    
+    def test_only_candidates_sharing_a_term_are_evaluated(self):
+        """必須語を含まないエントリーの書き込みでは照合器を再利用し、一致を記録しないテスト"""
+        from .percolator import get_percolator
+        
+        response = self.client.post(
+            reverse('saved_searches_api'), json.dumps({'query': '半導体 OR 決算'}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        percolator = get_percolator(self.user.id)
+        self.assertEqual(percolator.match('半導体不足'), [response.json()['saved_search']['id']])
+        self.assertEqual(percolator.match('配当'), [])
+        
+        entry = Entry.objects.create(notebook=self.notebook, title='メモ', content='配当方針')
+        self.assertIs(get_percolator(self.user.id), percolator)
+        self.assertFalse(SavedSearchMatch.objects.filter(entry=entry).exists())
+        
+        bad = self.client.post(reverse('saved_searches_api'), json.dumps({'query': 'NOT'}), content_type='application/json')
+        self.assertEqual(bad.status_code, 400)
+    
+    def test_percolator_follows_database(self):
+        """DB 上の保存した検索が変われば（他のプロセスでの書き込みや一括作成でも）照合器を作り直すテスト"""
+        from .percolator import compile_query, get_percolator
+        
+        saved_search = SavedSearch.objects.create(user=self.user, query='決算')
+        self.assertEqual(get_percolator(self.user.id).match('半導体'), [])
+        
+        added, = SavedSearch.objects.bulk_create([
+            SavedSearch(user=self.user, query='半導体', clauses=compile_query('半導体'))
+        ])
+        self.assertEqual(get_percolator(self.user.id).match('半導体と決算'), [saved_search.pk, added.pk])
+        
+        saved_search.delete()
+        self.assertEqual(get_percolator(self.user.id).match('半導体と決算'), [added.pk])
+
+
+class RelevanceScoringTest(TestCase):
+    """BM25 関連度スコアのテスト"""
+    
+    def setUp(self):
+        self.texts = [
+            '配当 利回り 配当 配当',
+            '配当の話。' + '業績メモ ' * 50,
+            '成長株の分析',
+            '配当 利回り',
+        ]
+        self.weights = {'配当': 1.0, '利回り': 1.0, '高配当': 2.0}
+    
+    def test_scores_are_ordered_and_normalized(self):
+        """出現頻度・文書長に応じた順序で、最上位が1になるテスト"""
+        from .relevance import bm25_scores
+        
+        scores = bm25_scores(self.texts, self.weights)
+        self.assertEqual(scores[0], 1.0)
+        self.assertEqual(scores[2], 0.0)
+        # 同じ語を含んでも、回数が多い・文書が短い方が上位（1.0 で並ばない）
+        self.assertGreater(scores[0], scores[3])
+        self.assertGreater(scores[3], scores[1])
+        self.assertGreater(scores[1], 0.0)
+    
+    def test_python_fallback_matches_vectorized(self):
+        """NumPy / SciPy なしの計算結果が一致するテスト"""
+        from .relevance import bm25_scores, _bm25_scores_python
+        
+        for expected, actual in zip(bm25_scores(self.texts, self.weights),
+                                    _bm25_scores_python(self.texts, self.weights)):
+            self.assertAlmostEqual(expected, actual)
+    
+    def test_weighted_jaccard_scores(self):
+        """特徴グループ別 Jaccard 係数の重み付き和のテスト"""
+        from .relevance import weighted_jaccard_scores, _weighted_jaccard_scores_python
+        
+        target = {'tags': ['配当', '金融'], 'style': ['長期投資']}
+        candidates = [
+            {'tags': ['配当', '金融'], 'style': ['長期投資']},
+            {'tags': ['配当', '成長'], 'style': []},
+            {'tags': [], 'style': []},
+        ]
+        weights = {'tags': 0.6, 'style': 0.4}
+        
+        scores = weighted_jaccard_scores(target, candidates, weights)
+        for expected, actual in zip([1.0, 0.2, 0.0], scores):
+            self.assertAlmostEqual(expected, actual)
+        self.assertEqual(scores, _weighted_jaccard_scores_python(target, candidates, weights))
+
+
 class ViewsTest(TestCase):
     """ビューのテスト"""
     
@@ -230,6 +1132,104 @@ class AIAnalyzerTest(TestCase):
         # 詳細分析の方がスコアが高いはず
         self.assertGreater(detailed_analysis['analysis_score'], basic_analysis['analysis_score'])
         self.assertGreater(detailed_analysis['analysis_score'], 50)
+    
+    def test_rule_matcher_matches_findall(self):
+        """一括マッチャーがルール別 findall と同じ件数を返すテスト"""
+        import re
+        from .ai_analyzer import RuleMatcher
+        
+        rules = [
+            ('positive', r'安定|成長|利益'),
+            ('negative', r'不安定|損失'),
+            ('risk', r'リスク|競合激化|不安定'),
+            ('competition', r'競合|比較'),
+            ('us', r'米国|us|usa'),
+            ('long', r'長期|long.term'),
+        ]
+        matcher = RuleMatcher(rules)
+        text = '不安定な相場でも成長と利益は安定。競合激化リスク、usaとbusiness、long-term 長期保有。'.lower()
+        
+        counts = matcher.count(text)
+        for key, pattern in rules:
+            self.assertEqual(counts[key], len(re.findall(pattern, text, re.IGNORECASE)), key)
+
+
+class KeywordAutomatonTest(TestCase):
+    """キーワードオートマトンのテスト"""
+    
+    def test_overlapping_matches(self):
+        """重なり・入れ子の一致を全て返すテスト"""
+        from .keyword_automaton import KeywordAutomaton
+        
+        automaton = KeywordAutomaton([
+            ('リスク', 'risk'), ('リスクヘッジ', 'hedge'), ('安定', 'stable'), ('不安定', 'unstable'),
+        ])
+        matches = sorted(
+            (start, automaton.keywords[index])
+            for start, index in automaton.iter_matches('不安定なリスクヘッジ')
+        )
+        
+        self.assertEqual(matches, [(0, '不安定'), (1, '安定'), (4, 'リスク'), (4, 'リスクヘッジ')])
+    
+    def test_shared_dictionary_features(self):
+        """共有辞書による業界・投資スタイル抽出テスト"""
+        search_engine = SemanticSearchEngine()
+        text = 'EV普及で自動車メーカーの配当利回りに注目。長期ホールド予定。'
+        
+        self.assertEqual(search_engine._extract_industry_features(text, []), ['自動車'])
+        self.assertEqual(
+            search_engine._extract_investment_style(text, []), ['高配当投資', '長期投資']
+        )
+        self.assertIn('高配当', search_engine._expand_query_keywords('配当'))
+    
+    def test_weighted_query_expansion(self):
+        """拡張語は重みの大きい順に上限まで、検索にはほかの語を含む語を除いて使うテスト"""
+        from .search_index import covering_terms
+        from .semantic_search import QUERY_EXPANSION_LIMIT
+        
+        terms = SemanticSearchEngine()._expand_query_terms('高配当 自動車')
+        self.assertEqual(terms['高配当'], 1.0)
+        self.assertEqual(terms['自動車'], 1.0)
+        self.assertEqual(len(terms), 2 + QUERY_EXPANSION_LIMIT)
+        # 同義語は辞書の並び順で重みが下がり、上限を超えた分は落ちる
+        self.assertGreater(terms['配当'], terms['利回り'])
+        self.assertNotIn('インカムゲイン', terms)
+        
+        self.assertEqual(covering_terms(['配当', '高配当', '自動車', '車', '配当']), ['配当', '車'])
+
+
+class StockMasterTest(TestCase):
+    """銘柄マスタのテスト"""
+    
+    def test_load_json_master_and_detect(self):
+        """JSONマスタの読み込みと銘柄検出テスト"""
+        import tempfile
+        from pathlib import Path
+        from .stock_master import load_stock_master
+        
+        rows = [
+            {'code': '7267', 'name': '本田技研工業', 'short_name': 'ホンダ', 'aliases': ['ホンダ', 'honda']},
+            {'code': '130A', 'name': 'ベリテ', 'aliases': []},
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / 'master.json'
+            path.write_text(json.dumps(rows, ensure_ascii=False), encoding='utf-8')
+            master = load_stock_master(path)
+        
+        self.assertEqual(len(master), 2)
+        self.assertEqual(master.get('130a').label, '130Aベリテ')
+        
+        detected = master.detect('本田技研工業（7267）はhondaブランド。172670は別の数字。130aも注目。')
+        self.assertEqual(
+            [(d['stock'], d['mentions']) for d in detected],
+            [('7267ホンダ', 3), ('130Aベリテ', 1)]
+        )
+    
+    def test_default_master_feeds_stock_mentions(self):
+        """同梱マスタによる stock_mentions テスト"""
+        analysis = StockAnalysisAI().analyze_content('ソニーとKDDIを比較。9984も検討。')
+        
+        self.assertEqual(analysis['stock_mentions'], ['6758ソニー', '9984ソフトバンク', '9433KDDI'])
 
 
 class SemanticSearchTest(TestCase):
@@ -259,6 +1259,11 @@ class SemanticSearchTest(TestCase):
         )
         self.notebook2.tags.add('成長株', 'IT', 'エンタメ')
     
+    def run_feature_jobs(self):
+        """特徴・関連ノート表の更新ジョブを実行（ワーカーの代わり）"""
+        from .jobs import process_jobs
+        process_jobs(batch_size=100)
+    
     def test_semantic_search(self):
         """セマンティック検索テスト"""
         results = self.search_engine.semantic_search(
@@ -287,6 +1292,7 @@ class SemanticSearchTest(TestCase):
             investment_goal='配当利回りの高い金融株'
         )
         similar_notebook.tags.add('高配当', '金融', '長期投資')
+        self.run_feature_jobs()
         
         related = self.search_engine.find_related_content(
             str(self.notebook1.pk), self.user.id, 3
@@ -294,6 +1300,197 @@ class SemanticSearchTest(TestCase):
         
         self.assertGreater(len(related), 0)
     
+    def test_related_content_uses_stored_features(self):
+        """関連コンテンツ推奨が保存済みの特徴を使うテスト"""
+        self.assertFalse(NotebookFeatures.objects.exists())
+        self.run_feature_jobs()
+        features = NotebookFeatures.objects.get(notebook=self.notebook1)
+        self.assertEqual(sorted(features.tags), ['自動車', '長期投資', '高配当'])
+        self.assertIn('自動車', features.industry_features)
+        
+        # タグの追加で特徴が更新される
+        self.notebook2.tags.add('高配当')
+        self.run_feature_jobs()
+        self.assertIn('高配当', NotebookFeatures.objects.get(notebook=self.notebook2).tags)
+        
+        for i in range(5):
+            notebook = Notebook.objects.create(user=self.user, title=f'高配当株{i}', investment_goal='長期保有')
+            notebook.tags.add('高配当', '長期投資')
+        self.run_feature_jobs()
+        
+        related = self.search_engine.find_related_content(self.notebook1.pk, self.user.id, 3)
+        self.assertEqual(len(related), 3)
+        self.assertTrue(all('共通タグ' in item['matching_aspects'][0] for item in related))
+        
+        # 特徴が未作成のノート（一括作成など）は推奨時に特徴を計算せず、作成をジョブに登録する
+        from django.core.management import call_command
+        from io import StringIO
+        from .models import AnalysisJob
+        NotebookFeatures.objects.all().delete()
+        RelatedNotebook.objects.all().delete()
+        self.assertEqual(self.search_engine.find_related_content(self.notebook1.pk, self.user.id, 3), [])
+        self.assertFalse(NotebookFeatures.objects.exists())
+        self.assertTrue(AnalysisJob.objects.filter(
+            target_type='features', object_id=self.notebook1.pk, status='pending'
+        ).exists())
+        
+        # 一括作成は管理コマンドで補完する
+        call_command('rebuild_related_notebooks', stdout=StringIO())
+        self.assertEqual(NotebookFeatures.objects.count(), 7)
+        self.assertEqual(
+            self.search_engine.find_related_content(self.notebook1.pk, self.user.id, 3), related
+        )
+    
+    def test_related_notebook_table(self):
+        """関連ノート表の読み込み・差分更新・一括再構築のテスト"""
+        similar = []
+        for i in range(3):
+            notebook = Notebook.objects.create(user=self.user, title=f'高配当株{i}', investment_goal='長期保有')
+            notebook.tags.add('高配当', '長期投資')
+            similar.append(notebook)
+        self.run_feature_jobs()
+        
+        # 作成済みの関連ノートは1クエリで読む
+        with self.assertNumQueries(1):
+            related = self.search_engine.find_related_content(self.notebook1.pk, self.user.id, 5)
+        self.assertEqual({item['notebook_id'] for item in related}, {notebook.pk for notebook in similar})
+        
+        # 新しい類似ノートは既存の関連ノート表に追加される（特徴・関連ノート表の更新はジョブで実行）
+        closest = Notebook.objects.create(user=self.user, title='7267 ホンダ', investment_goal='配当')
+        closest.tags.add('高配当', '自動車', '長期投資')
+        self.assertNotIn(closest.pk, [item['notebook_id'] for item in self.search_engine.find_related_content(
+            self.notebook1.pk, self.user.id, 5
+        )])
+        self.run_feature_jobs()
+        related = self.search_engine.find_related_content(self.notebook1.pk, self.user.id, 5)
+        self.assertEqual(related[0]['notebook_id'], closest.pk)
+        
+        # 特徴が変わったノートは逆方向の関連ノートからも外れる
+        closest.tags.set(['成長株'])
+        closest.title = 'メモ'
+        closest.save()
+        self.run_feature_jobs()
+        related = self.search_engine.find_related_content(self.notebook1.pk, self.user.id, 5)
+        self.assertNotIn(closest.pk, [item['notebook_id'] for item in related])
+        
+        # 削除されたノートを関連ノートに持っていたノートは再計算される
+        similar[0].delete()
+        self.assertEqual(RelatedNotebook.objects.filter(source=self.notebook1).count(), 2)
+        
+        # 一括再構築は差分更新と同じ結果
+        incremental = sorted(RelatedNotebook.objects.values_list('source_id', 'target_id', 'score'))
+        from django.core.management import call_command
+        from io import StringIO
+        call_command('rebuild_related_notebooks', stdout=StringIO())
+        rebuilt = sorted(RelatedNotebook.objects.values_list('source_id', 'target_id', 'score'))
+        self.assertEqual([row[:2] for row in rebuilt], [row[:2] for row in incremental])
+        for expected, actual in zip(incremental, rebuilt):
+            self.assertAlmostEqual(expected[2], actual[2])
+    
+    def test_unchanged_features_skip_related_refresh(self):
+        """書き込みは特徴の更新をジョブに登録するだけで、特徴が変わらないジョブは関連ノート表を更新しないテスト"""
+        from unittest import mock
+        from .models import AnalysisJob
+        
+        self.run_feature_jobs()
+        with mock.patch.object(SemanticSearchEngine, 'refresh_notebook_features') as refresh_features:
+            self.notebook1.save()
+            Entry.objects.create(notebook=self.notebook1, title='メモ', content='短い')
+        refresh_features.assert_not_called()
+        self.assertEqual(
+            list(AnalysisJob.objects.filter(status='pending').values_list('target_type', 'object_id')),
+            [('features', self.notebook1.pk)]
+        )
+        
+        with mock.patch.object(SemanticSearchEngine, 'refresh_related_notebooks') as refresh:
+            self.run_feature_jobs()
+        refresh.assert_not_called()
+        
+        self.notebook1.tags.add('金融')
+        with mock.patch.object(SemanticSearchEngine, 'refresh_related_notebooks') as refresh:
+            self.run_feature_jobs()
+        refresh.assert_called_once_with([self.notebook1.pk], reverse=True)
+    
+    def test_related_content_count_tag(self):
+        """関連コンテンツ数タグが関連ノート表から1クエリで数えるテスト（ジョブの実行前は0）"""
+        from django.template import Context, Template
+        
+        for i in range(7):
+            notebook = Notebook.objects.create(user=self.user, title=f'高配当株{i}', investment_goal='長期保有')
+            notebook.tags.add('高配当', '自動車', '長期投資')
+        template = Template('{% load notebook_extras %}{% related_content_count notebook %}')
+        self.assertEqual(template.render(Context({'notebook': self.notebook1})), '0')
+        
+        self.run_feature_jobs()
+        with self.assertNumQueries(1):
+            self.assertEqual(template.render(Context({'notebook': self.notebook1})), '5')
+        with self.assertNumQueries(1):
+            self.assertEqual(template.render(Context({'notebook': self.notebook2})), '0')
+    
+    def test_related_content_includes_public_notebooks(self):
+        """他のユーザーの公開ノートを関連コンテンツに含めるテスト"""
+        other = User.objects.create_user(username='other', password='testpass123')
+        public = Notebook.objects.create(
+            user=other, title='8306 三菱UFJ', investment_goal='配当重視の長期保有', is_public=True
+        )
+        public.tags.add('高配当', '自動車', '長期投資')
+        private = Notebook.objects.create(user=other, title='非公開', investment_goal='配当重視の長期保有')
+        private.tags.add('高配当', '自動車', '長期投資')
+        self.run_feature_jobs()
+        
+        related = self.search_engine.find_related_content(self.notebook1.pk, self.user.id, 5)
+        self.assertNotIn(public.pk, [item['notebook_id'] for item in related])
+        
+        related = self.search_engine.find_related_content(self.notebook1.pk, self.user.id, 5, include_public=True)
+        related_ids = [item['notebook_id'] for item in related]
+        self.assertEqual(related_ids[0], public.pk)
+        self.assertNotIn(private.pk, related_ids)
+    
+    def test_crowded_lsh_buckets_are_not_aggregated(self):
+        """同じ特徴の公開ノートが多いバケットは集計せず、新しいノートから上限件数だけ候補にするテスト"""
+        from unittest import mock
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        other = User.objects.create_user(username='other', password='testpass123')
+        public = []
+        for i in range(12):
+            notebook = Notebook.objects.create(
+                user=other, title='8306 三菱UFJ', investment_goal='配当重視の長期保有', is_public=True
+            )
+            notebook.tags.add('高配当', '金融', '長期投資')
+            public.append(notebook)
+        self.run_feature_jobs()
+        
+        with mock.patch('notebooks.semantic_search.LSH_MAX_BUCKET_SIZE', 5), \
+                mock.patch('notebooks.semantic_search.LSH_MAX_CANDIDATES', 4), \
+                CaptureQueriesContext(connection) as queries:
+            related = self.search_engine.find_related_content(public[0].pk, self.user.id, 3, include_public=True)
+        
+        # すべてのバケットが混雑しているため、一致したバンド数の集計（GROUP BY）は行わない
+        self.assertEqual([item['similarity_score'] for item in related], [1.0] * 3)
+        self.assertTrue({item['notebook_id'] for item in related} <= {notebook.pk for notebook in public[-4:]})
+        self.assertFalse(any(
+            'GROUP BY' in query['sql'] and 'notebooklshbucket' in query['sql'] and ' IN (' in query['sql']
+            for query in queries.captured_queries
+        ))
+    
+    def test_minhash_signature(self):
+        """MinHash 署名と LSH バケットのテスト"""
+        from .minhash import LSH_BANDS, MINHASH_PERMUTATIONS, feature_set, lsh_buckets, minhash_signature
+        
+        items = feature_set({'tags': ['高配当', '金融'], 'industry_features': ['金融']}, ['tags', 'industry_features'])
+        self.assertEqual(items, {'tags:高配当', 'tags:金融', 'industry_features:金融'})
+        
+        signature = minhash_signature(items)
+        self.assertEqual(len(signature), MINHASH_PERMUTATIONS)
+        self.assertEqual(signature, minhash_signature(sorted(items)))
+        self.assertEqual(minhash_signature([]), [])
+        
+        buckets = lsh_buckets(signature)
+        self.assertEqual(len(set(buckets)), LSH_BANDS)
+        self.assertFalse(set(buckets) & set(lsh_buckets(minhash_signature({'tags:成長株', 'tags:IT'}))))
+    
     def test_auto_categorization(self):
         """自動分類テスト"""
         content = "配当利回り5%の高配当株を長期保有する戦略"
@@ -430,6 +1627,84 @@ class APITest(TestCase):
         data = response.json()
         self.assertTrue(data['success'])
         self.assertIn('results', data)
+        self.assertIn('next_cursor', data)
+        
+        response = self.client.get('/api/search/semantic/?q=配当&cursor=%21%21')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/search/semantic/?q=配当&limit=abc')
+        self.assertEqual(response.status_code, 400)
+        
+        # 0件以下の件数は1件として扱う（空の結果をキャッシュしない）
+        for limit in ('0', '-1'):
+            response = self.client.get('/api/search/semantic/', {'q': '配当', 'limit': limit})
+            self.assertEqual(len(response.json()['results']), 1)
+    
+    def test_semantic_search_api_cache(self):
+        """検索結果のキャッシュと書き込み時の無効化テスト"""
+        self.client.login(username='testuser', password='testpass123')
+        notebook = Notebook.objects.create(user=self.user, title='高配当株投資', investment_goal='配当利回り重視')
+        url = '/api/search/semantic/?q=配当'
+        
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['results']), 1)
+        
+        # 2回目はセッション・ユーザー・版数の読み込みのみ
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(url).json(), first)
+        
+        # 版数はDBで共有するため、キャッシュが別のプロセスの書き込みも反映される
+        from unittest import mock
+        from django.core.cache.backends.locmem import LocMemCache
+        with mock.patch('notebooks.utils.cache', LocMemCache('other-process', {})):
+            Notebook.objects.create(user=self.user, title='配当貴族株')
+        self.assertEqual(len(self.client.get(url).json()['results']), 2)
+        
+        # タグ・ノートの書き込みでキャッシュが無効になる
+        notebook.tags.add('インカム')
+        self.assertEqual(self.client.get(url).json()['results'][0]['tags'], ['インカム'])
+        
+        Notebook.objects.create(user=self.user, title='配当再投資')
+        self.assertEqual(len(self.client.get(url).json()['results']), 3)
+    
+    def test_semantic_search_facets(self):
+        """一致したノート全体のファセット件数をファセットごとに1クエリで集計するテスト"""
+        from .semantic_search import get_search_engine
+        
+        self.client.login(username='testuser', password='testpass123')
+        for i in range(3):
+            notebook = Notebook.objects.create(user=self.user, title=f'高配当株{i}')
+            notebook.tags.add('配当', f'銘柄{i}')
+            Entry.objects.create(notebook=notebook, title='決算', content='増配', entry_type='earnings')
+            Entry.objects.create(notebook=notebook, title='決算', content='増配', entry_type='earnings')
+        Notebook.objects.filter(title='高配当株0').update(ai_investment_strategy='dividend_income')
+        Notebook.objects.create(user=self.user, title='グロース株').tags.add('成長')
+        Entry.objects.filter(notebook__title__in=['高配当株0', '高配当株1']).update(ai_sentiment='positive')
+        Entry.objects.filter(pk=Entry.objects.filter(notebook__title='高配当株1').first().pk).update(
+            ai_sentiment='negative'
+        )
+        
+        data = self.client.get('/api/search/semantic/', {'q': '高配当', 'limit': 1}).json()
+        facets = data['facets']
+        self.assertEqual(facets['tags'][0], {'value': '配当', 'label': '配当', 'count': 3})
+        self.assertEqual(len(facets['tags']), 4)
+        self.assertEqual(facets['investment_strategy'], [
+            {'value': 'dividend_income', 'label': '配当収入', 'count': 1}
+        ])
+        # センチメントはエントリーのAI感情分析から数える（特徴が未作成のノートも対象。未分析のエントリーは除く）
+        self.assertFalse(NotebookFeatures.objects.exists())
+        self.assertEqual(facets['sentiment'], [
+            {'value': 'positive', 'label': 'ポジティブ', 'count': 2},
+            {'value': 'negative', 'label': 'ネガティブ', 'count': 1},
+        ])
+        self.assertEqual(facets['entry_type'], [{'value': 'earnings', 'label': '決算情報', 'count': 3}])
+        
+        # 次ページでは集計しない
+        self.assertIsNone(self.client.get(
+            '/api/search/semantic/', {'q': '高配当', 'limit': 1, 'cursor': data['next_cursor']}
+        ).json()['facets'])
+        
+        with self.assertNumQueries(4):
+            get_search_engine().count_facets(Notebook.objects.filter(title__startswith='高配当'))
     
     def test_auto_categorize_api(self):
         """自動分類APIテスト"""
@@ -553,29 +1828,143 @@ class IntegrationTest(TestCase):
 class PerformanceTest(TestCase):
     """パフォーマンステスト"""
     
-    def setUp(self):
-        self.user = User.objects.create_user(
+    NOTEBOOK_COUNT = 10000
+    
+    @classmethod
+    def setUpTestData(cls):
+        from .batch_analysis import bulk_add_tags
+        from .search_index import index_notebooks
+        
+        cls.user = User.objects.create_user(
             username='testuser',
             password='testpass123'
         )
         
-        # 大量のテストデータ作成
-        for i in range(50):
-            notebook = Notebook.objects.create(
-                user=self.user,
+        # 大量のテストデータ作成（シグナルを通さず一括作成し、検索インデックスはまとめて構築）
+        Notebook.objects.bulk_create([
+            Notebook(
+                user=cls.user,
                 title=f'テストノート{i}',
                 subtitle=f'テスト投資戦略{i}',
                 investment_goal=f'投資目標{i}の説明文'
             )
-            notebook.tags.add(f'タグ{i}', f'カテゴリ{i % 5}')
-            
-            # エントリー作成
-            for j in range(5):
-                Entry.objects.create(
-                    notebook=notebook,
-                    title=f'エントリー{j}',
-                    content=f'テスト内容{j} ' * 20  # ある程度の長さ
+            for i in range(cls.NOTEBOOK_COUNT)
+        ], batch_size=1000)
+        notebook_ids = list(Notebook.objects.filter(user=cls.user).order_by('pk').values_list('pk', flat=True))
+        bulk_add_tags(Notebook, {pk: [f'タグ{i}', f'カテゴリ{i % 5}'] for i, pk in enumerate(notebook_ids)})
+        
+        # エントリー作成
+        Entry.objects.bulk_create([
+            Entry(
+                notebook_id=pk,
+                title=f'エントリー{j}',
+                content=f'テスト内容{j} ' * 20  # ある程度の長さ
+            )
+            for pk in notebook_ids for j in range(5)
+        ], batch_size=1000)
+        index_notebooks(notebook_ids)
+    
+    def setUp(self):
+        # データはテスト間で共有するため、検索順位のキャッシュをテストごとに捨てる
+        from django.core.cache import cache
+        from .utils import get_user_data_version
+        cache.clear()
+        get_user_data_version(self.user.id)
+    
+    def test_search_query_count_is_fixed(self):
+        """スコア計算のクエリ数がヒット件数に依存しないテスト"""
+        search_engine = SemanticSearchEngine()
+        
+        # 版数・検索・候補ノート・結果のタグの読み込み各1回 + 500件ごとにエントリー1回
+        with self.assertNumQueries(5):
+            results = search_engine.semantic_search('テストノート9999', self.user.id)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(sorted(results[0]['tags']), ['カテゴリ4', 'タグ9999'])
+        
+        with self.assertNumQueries(5):
+            results = search_engine.semantic_search('テストノート999', self.user.id, 20)
+        self.assertEqual(len(results), 11)
+        
+        # 1111件（テストノート1, 10〜19, 100〜199, 1000〜1999）は3チャンク
+        with self.assertNumQueries(4 + 3):
+            results = search_engine.semantic_search('テストノート1', self.user.id, 20)
+        self.assertEqual(len(results), 20)
+    
+    def test_search_cursor_pagination(self):
+        """カーソルでのページ送りが一括取得と同じ順序になるテスト"""
+        search_engine = SemanticSearchEngine()
+        expected = [r['notebook_id'] for r in search_engine.semantic_search('テストノート999', self.user.id, 20)]
+        
+        pages = []
+        cursor = None
+        while True:
+            page = search_engine.semantic_search_page('テストノート999', self.user.id, 4, cursor)
+            pages.append([r['notebook_id'] for r in page['results']])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        
+        self.assertEqual([len(ids) for ids in pages], [4, 4, 3])
+        self.assertEqual(sum(pages, []), expected)
+        
+        with self.assertRaises(ValueError):
+            search_engine.semantic_search_page('テストノート999', self.user.id, 4, '不正')
+    
+    def test_search_cursor_reuses_ranking(self):
+        """2ページ目以降はキャッシュした順位を使い、そのページのノートだけ読み込むテスト"""
+        from unittest import mock
+        
+        search_engine = SemanticSearchEngine()
+        first = search_engine.semantic_search_page('テストノート1', self.user.id, 20)
+        
+        # 版数・ページのノート・エントリー・タグ各1回（基本検索と1111件の再スコア計算はしない）
+        with mock.patch.object(search_engine, '_calculate_semantic_scores') as calculate:
+            with self.assertNumQueries(4):
+                second = search_engine.semantic_search_page(
+                    'テストノート1', self.user.id, 20, first['next_cursor']
                 )
+        calculate.assert_not_called()
+        self.assertEqual(len(second['results']), 20)
+        self.assertFalse(
+            {r['notebook_id'] for r in first['results']} & {r['notebook_id'] for r in second['results']}
+        )
+        self.assertLessEqual(second['results'][0]['relevance_score'], first['results'][-1]['relevance_score'])
+        self.assertTrue(all(r['content_preview'] for r in second['results']))
+    
+    def test_search_cursor_without_cached_ranking(self):
+        """キャッシュがない（他のプロセス・期限切れ）ページもカーソルの基準時刻で同じ順位を返すテスト"""
+        from datetime import timedelta
+        from unittest import mock
+        from django.core.cache import cache
+        
+        search_engine = SemanticSearchEngine()
+        
+        def read_pages(cursor=None, clear_cache=False):
+            results = []
+            for _ in range(10):
+                page = search_engine.semantic_search_page('テストノート1', self.user.id, 300, cursor)
+                results += [(r['notebook_id'], r['relevance_score']) for r in page['results']]
+                cursor = page['next_cursor']
+                if cursor is None:
+                    break
+                if clear_cache:
+                    cache.clear()
+            return results
+        
+        cached = read_pages()
+        self.assertEqual(len(cached), 1111)
+        self.assertEqual(len(set(cached)), 1111)
+        
+        # 1ページ目の後に時間が経過し、以降のページはキャッシュなしで計算し直す
+        cache.clear()
+        first = search_engine.semantic_search_page('テストノート1', self.user.id, 300)
+        cache.clear()
+        later = timezone.now() + timedelta(days=40)
+        with mock.patch('notebooks.semantic_search.timezone.now', return_value=later):
+            rest = read_pages(first['next_cursor'], clear_cache=True)
+        pages = [(r['notebook_id'], r['relevance_score']) for r in first['results']] + rest
+        # 1111件の差分表示は重いため一致のみ判定
+        self.assertTrue(pages == cached, '再計算したページの順位が1ページ目と連続していません')
     
     def test_search_performance(self):
         """検索パフォーマンステスト"""
@@ -584,12 +1973,20 @@ class PerformanceTest(TestCase):
         search_engine = SemanticSearchEngine()
         
         start_time = time.time()
-        results = search_engine.semantic_search('テスト', self.user.id, 10)
+        results = search_engine.semantic_search('テストノート123', self.user.id, 10)
         end_time = time.time()
         
         # 1秒以内に完了することを確認
         self.assertLess(end_time - start_time, 1.0)
         self.assertGreater(len(results), 0)
+        
+        # 1万件すべてがヒットする検索も2秒以内
+        start_time = time.time()
+        results = search_engine.semantic_search('テスト', self.user.id, 10)
+        end_time = time.time()
+        
+        self.assertLess(end_time - start_time, 2.0)
+        self.assertEqual(len(results), 10)
     
     def test_ai_analysis_performance(self):
         """AI分析パフォーマンステスト"""
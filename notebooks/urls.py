@@ -22,13 +22,19 @@ urlpatterns = [
     # API エンドポイント（intに変更）
     path('api/search/', api_views.search_notebooks_api, name='search_api'),
     path('api/search/semantic/', api_views.semantic_search_api, name='semantic_search_api'),
+    path('api/search/autocomplete/', api_views.autocomplete_api, name='autocomplete_api'),
     path('api/ai/analyze/', api_views.ai_analyze_content_api, name='ai_analyze_api'),
     path('api/ai/categorize/', api_views.auto_categorize_api, name='auto_categorize_api'),
     path('api/related/<int:notebook_id>/', api_views.related_content_api, name='related_content_api'),
     path('api/insights/<int:notebook_id>/', api_views.ai_insights_api, name='ai_insights_api'),
     path('api/calculate/', api_views.calculate_investment_api, name='calculate_api'),
     path('api/stats/', api_views.dashboard_stats_api, name='stats_api'),
-    
+    path('api/risk-exposure/', api_views.risk_exposure_api, name='risk_exposure_api'),
+    path('api/saved-searches/', api_views.saved_searches_api, name='saved_searches_api'),
+    path('api/saved-searches/<int:saved_search_id>/', api_views.saved_search_delete_api, name='saved_search_delete_api'),
+    path('api/saved-searches/matches/', api_views.saved_search_matches_api, name='saved_search_matches_api'),
+    path('api/profiling/', api_views.profiling_stats_api, name='profiling_stats_api'),
+
     # 認証
     path('accounts/register/', views.register_view, name='register'),
     path('accounts/login/', views.CustomLoginView.as_view(), name='login'),
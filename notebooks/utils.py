@@ -7,12 +7,94 @@ from django.utils import timezone
 from datetime import timedelta
 import hashlib
 import json
+import time
+
+# ユーザー別の検索・推奨結果のキャッシュ時間（秒）
+USER_RESULT_CACHE_TIMEOUT = 300
+
+# 公開ノート全体の版数（ユーザーIDの代わりに版数関数へ渡す）
+PUBLIC_DATA_VERSION = 'public'
+
+# ノート詳細のエントリー一覧の1ページあたりの件数（検索結果のアンカーのページ計算にも使う）
+ENTRIES_PER_PAGE = 10
 
 def generate_cache_key(prefix: str, *args) -> str:
     """キャッシュキー生成"""
     key_data = f"{prefix}:{'_'.join(map(str, args))}"
     return hashlib.md5(key_data.encode()).hexdigest()
 
+def get_user_data_version(user_id) -> int:
+    """
+    ユーザーデータの版数（ノート・エントリー・タグの書き込みごとに更新）
+    
+    キャッシュがプロセスごと（LocMemCache）でも他のプロセスの書き込みを反映するよう、版数はDBから読む。
+    """
+    from .models import UserDataVersion
+    
+    versions = UserDataVersion.objects.filter(key=str(user_id)).values_list('version', flat=True)
+    version = versions.first()
+    if version is None:
+        _create_user_data_versions({str(user_id)})
+        version = versions.first()
+    return version
+
+def _create_user_data_versions(keys):
+    """未作成の版数の作成（初期値は時刻。DBを作り直しても、以前の版数のキーと衝突しない）"""
+    from .models import UserDataVersion
+    
+    UserDataVersion.objects.bulk_create(
+        [UserDataVersion(key=key, version=time.time_ns()) for key in keys], ignore_conflicts=True
+    )
+
+def bump_user_data_version(*user_ids):
+    """ユーザーデータの版数を進め、そのユーザーの結果キャッシュをまとめて無効化（通常は1クエリ）"""
+    from django.db.models import F
+    from .models import UserDataVersion
+    
+    keys = {str(user_id) for user_id in user_ids}
+    if not keys:
+        return
+    if UserDataVersion.objects.filter(key__in=keys).update(version=F('version') + 1) < len(keys):
+        existing = set(UserDataVersion.objects.filter(key__in=keys).values_list('key', flat=True))
+        _create_user_data_versions(keys - existing)
+
+def generate_user_cache_key(prefix: str, user_id, *args) -> str:
+    """ユーザーデータの版数を含むキャッシュキー生成"""
+    return generate_cache_key(prefix, user_id, get_user_data_version(user_id), *args)
+
+def entry_urls(entries) -> dict:
+    """
+    ノート詳細のエントリーへのリンク {entry_id: URL}（1クエリ）
+    
+    entries は (エントリーID, ノートID) の並び。一覧（新しい順）での位置から ?page= を付け、アンカーで該当箇所に移動する。
+    """
+    from django.db.models import F, Window
+    from django.db.models.functions import RowNumber
+    from django.urls import reverse
+    from .models import Entry
+    
+    entries = list(entries)
+    if not entries:
+        return {}
+    positions = dict(Entry.objects.filter(notebook_id__in={notebook_id for _, notebook_id in entries}).annotate(
+        position=Window(RowNumber(), partition_by=F('notebook_id'), order_by=F('created_at').desc())
+    ).order_by().values_list('pk', 'position'))
+    
+    urls = {}
+    for pk, notebook_id in entries:
+        page = (positions.get(pk, 1) - 1) // ENTRIES_PER_PAGE + 1
+        url = reverse('notebook_detail', kwargs={'pk': notebook_id})
+        urls[pk] = f"{url}{f'?page={page}' if page > 1 else ''}#entry-{pk}"
+    return urls
+
+def generate_content_hash(*parts) -> str:
+    """コンテンツハッシュ生成（AI分析の再実行要否判定用）"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part or '').encode('utf-8'))
+        digest.update(b'\x1f')  # 区切り（連結位置の違いを区別）
+    return digest.hexdigest()
+
 def get_market_data_cache():
     """市場データ取得（キャッシュ付き）"""
     cache_key = 'market_data'
@@ -2,12 +2,12 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Count
+from django.db.models import Count
 from django.http import JsonResponse
 from django.core.paginator import Paginator
 from django.utils import timezone
 from datetime import timedelta
-from .models import Notebook, Entry
+from .models import Notebook, Entry, SavedSearchMatch
 from .forms import NotebookForm, EntryForm
 from taggit.models import Tag
 from django.contrib.auth import views as auth_views
@@ -16,12 +16,14 @@ from django.contrib.auth.models import User
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from .calculators import InvestmentCalculator
-from .utils import get_market_data_cache
+from .utils import get_market_data_cache, entry_urls, ENTRIES_PER_PAGE
+from .jobs import enqueue_notebook_analysis, enqueue_entry_analysis
+from .search_backends import LIST_SEARCH_COLUMNS, get_search_backend, load_notebooks, search_notebooks
 
 # AI機能のインポート（エラーハンドリング付き）
 AI_AVAILABLE = False
 try:
-    from .ai_analyzer import StockAnalysisAI
+    from .ai_analyzer import StockAnalysisAI, merge_partials
     from .semantic_search import SemanticSearchEngine
     AI_AVAILABLE = True
     print("AI機能が正常に読み込まれました")
@@ -47,9 +49,18 @@ def dashboard_view(request):
         
         # 最近のノート
         recent_notebooks = user_notebooks[:6]
+        
+        # 保存した検索に一致した未読のエントリー
+        saved_search_matches = list(SavedSearchMatch.objects.filter(
+            user=request.user, is_read=False
+        ).select_related('saved_search', 'entry', 'notebook')[:5])
+        urls = entry_urls((match.entry_id, match.notebook_id) for match in saved_search_matches)
+        for match in saved_search_matches:
+            match.url = urls[match.entry_id]
     else:
         total_notebooks = active_notebooks = total_entries = monthly_entries = 0
         recent_notebooks = []
+        saved_search_matches = []
     
     # 市場データ（模擬データ）
     market_data = [
@@ -71,6 +82,7 @@ def dashboard_view(request):
             'monthly_entries': monthly_entries,
         },
         'recent_notebooks': recent_notebooks,
+        'saved_search_matches': saved_search_matches,
         'market_data': market_data,
         'popular_tags': popular_tags,
         'ai_available': AI_AVAILABLE,
@@ -83,20 +95,17 @@ def notebook_list_view(request):
     """ノート一覧"""
     notebooks = Notebook.objects.filter(user=request.user)
     
-    # 検索機能
+    # 検索機能（検索バックエンドの順位順。表示するページ分だけ読み込む）
     search_query = request.GET.get('search', '')
     if search_query:
-        notebooks = notebooks.filter(
-            Q(title__icontains=search_query) |
-            Q(company_name__icontains=search_query) |
-            Q(stock_code__icontains=search_query) |
-            Q(tags__name__icontains=search_query)
-        ).distinct()
+        notebooks = get_search_backend().search(request.user.id, [search_query], columns=LIST_SEARCH_COLUMNS)
     
     # ページネーション
     paginator = Paginator(notebooks, 12)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    if search_query:
+        page_obj.object_list = load_notebooks(page_obj.object_list)
     
     context = {
         'page_obj': page_obj,
@@ -114,12 +123,12 @@ def notebook_create_view(request):
             try:
                 notebook = form.save(user=request.user)
                 
-                # AI分析の実行（利用可能な場合のみ）
+                # AI分析はジョブ登録のみ（analysis_worker が実行）
                 if AI_AVAILABLE:
                     try:
-                        perform_ai_analysis_for_notebook(notebook)
+                        enqueue_notebook_analysis(notebook)
                     except Exception as e:
-                        print(f"AI分析エラー: {str(e)}")
+                        print(f"AI分析ジョブ登録エラー: {str(e)}")
                         # AI分析失敗時もメッセージは表示しない
                 
                 messages.success(request, f'ノート「{notebook.title}」を作成しました。')
@@ -152,7 +161,7 @@ def notebook_detail_view(request, pk):
     entries = notebook.entries.all()
     
     # ページネーション
-    paginator = Paginator(entries, 10)
+    paginator = Paginator(entries, ENTRIES_PER_PAGE)
     page_number = request.GET.get('page')
     entries_page = paginator.get_page(page_number)
     
@@ -175,12 +184,12 @@ def notebook_edit_view(request, pk):
             try:
                 notebook = form.save()
                 
-                # AI分析の再実行（利用可能な場合のみ）
+                # AI分析の再実行はジョブ登録のみ（analysis_worker が実行）
                 if AI_AVAILABLE:
                     try:
-                        perform_ai_analysis_for_notebook(notebook)
+                        enqueue_notebook_analysis(notebook)
                     except Exception as e:
-                        print(f"AI分析エラー: {str(e)}")
+                        print(f"AI分析ジョブ登録エラー: {str(e)}")
                 
                 messages.success(request, f'ノート「{notebook.title}」を更新しました。')
                 return redirect('notebook_detail', pk=notebook.pk)
@@ -210,23 +219,16 @@ def entry_create_view(request, notebook_pk):
                 entry.save()
                 # form.save()内でタグの処理も行われるため、save_m2m()は不要
                 
-                # AI分析の実行（利用可能な場合のみ）
-                if AI_AVAILABLE:
-                    try:
-                        perform_ai_analysis_for_entry(entry)
-                    except Exception as e:
-                        print(f"AI分析エラー: {str(e)}")
-                
                 # ノートのエントリー数更新
                 notebook.entry_count = notebook.entries.count()
-                notebook.save()
+                notebook.save(update_fields=['entry_count', 'updated_at'])
                 
-                # ノート全体のAI分析も更新（利用可能な場合のみ）
+                # AI分析はジョブ登録のみ（エントリー分析後にノート全体の分析も更新される）
                 if AI_AVAILABLE:
                     try:
-                        perform_ai_analysis_for_notebook(notebook)
+                        enqueue_entry_analysis(entry)
                     except Exception as e:
-                        print(f"AI分析エラー: {str(e)}")
+                        print(f"AI分析ジョブ登録エラー: {str(e)}")
                 
                 messages.success(request, 'エントリーを作成しました。')
                 return redirect('notebook_detail', pk=notebook.pk)
@@ -249,14 +251,7 @@ def search_api_view(request):
         return JsonResponse({'results': []})
     
     if request.user.is_authenticated:
-        notebooks = Notebook.objects.filter(
-            user=request.user
-        ).filter(
-            Q(title__icontains=query) |
-            Q(company_name__icontains=query) |
-            Q(stock_code__icontains=query) |
-            Q(tags__name__icontains=query)
-        ).distinct()[:5]
+        notebooks = search_notebooks(request.user.id, query, 5)
         
         results = [{
             'id': str(notebook.pk),
@@ -321,21 +316,30 @@ class CustomLogoutView(auth_views.LogoutView):
 
 
 # AI分析機能（利用可能な場合のみ）
-def perform_ai_analysis_for_notebook(notebook):
-    """ノートブック全体のAI分析実行"""
+def perform_ai_analysis_for_notebook(notebook, raise_errors=False):
+    """ノートブック全体のAI分析実行（本体テキスト＋全エントリーの部分集計の合算）"""
     if not AI_AVAILABLE:
         return
     
     try:
-        search_engine = SemanticSearchEngine()
-        full_text = search_engine._extract_full_text(notebook)
+        header_text = notebook.get_ai_header_text()
+        entries_aggregate = notebook.ai_entries_aggregate or {}
         
-        if len(full_text.strip()) > 20:  # 最小文字数チェック
+        if len(header_text.strip()) + entries_aggregate.get('length', 0) > 20:  # 最小文字数チェック
+            # 内容・分析器とも前回から変わっていなければ再分析しない
+            content_hash = notebook.get_ai_content_hash()
+            if notebook.is_ai_analysis_current(content_hash):
+                return
+            
+            # エントリー本文は再分析せず、保存済みの部分集計に本体テキスト分を加える
             analyzer = StockAnalysisAI()
-            analysis = analyzer.analyze_content(full_text, notebook.title)
+            partial = merge_partials(
+                analyzer.analyze_partial(header_text, notebook.title), entries_aggregate
+            )
+            analysis = analyzer.analysis_from_partial(partial)
             
             # AI分析結果を保存
-            notebook.update_ai_analysis(analysis)
+            notebook.update_ai_analysis(analysis, content_hash)
             
             # AI推奨タグの自動追加（オプション）
             suggested_tags = analysis.get('suggested_tags', [])
@@ -347,21 +351,31 @@ def perform_ai_analysis_for_notebook(notebook):
                 notebook.tags.add(*new_tags)
     
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"AI分析エラー (ノートブック {notebook.pk}): {str(e)}")
 
 
-def perform_ai_analysis_for_entry(entry):
+def perform_ai_analysis_for_entry(entry, raise_errors=False):
     """エントリーのAI分析実行"""
     if not AI_AVAILABLE:
         return
     
     try:
         if len(entry.content.strip()) > 10:  # 最小文字数チェック
+            # 内容・分析器とも前回から変わっていなければ再分析しない
+            content_hash = entry.get_ai_content_hash()
+            if entry.is_ai_analysis_current(content_hash):
+                return
+            
             analyzer = StockAnalysisAI()
-            analysis = analyzer.analyze_content(entry.content, entry.title)
+            partial = analyzer.analyze_partial(entry.content, entry.title)
+            analysis = analyzer.analysis_from_partial(partial)
             
-            # AI分析結果を保存
-            entry.update_ai_analysis(analysis)
+            # AI分析結果を保存し、ノート集計には差分のみ反映
+            previous_partial = entry.ai_partial
+            entry.update_ai_analysis(analysis, content_hash, partial)
+            entry.notebook.apply_entry_partial(previous_partial, partial)
             
             # AI推奨タグの自動追加（オプション）
             suggested_tags = analysis.get('suggested_tags', [])
@@ -371,8 +385,15 @@ def perform_ai_analysis_for_entry(entry):
             new_tags = [tag for tag in suggested_tags[:2] if tag not in current_tags]
             if new_tags:
                 entry.tags.add(*new_tags)
+        elif entry.ai_partial:
+            # 分析対象外の長さに短縮された場合は、以前の部分集計をノート集計から差し引く
+            entry.notebook.apply_entry_partial(entry.ai_partial, {})
+            Entry.objects.filter(pk=entry.pk).update(ai_partial={})
+            entry.ai_partial = {}
     
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"AI分析エラー (エントリー {entry.pk}): {str(e)}")
 
 